@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import time
+
+from telegram.constants import ChatMemberStatus
+
+logger = logging.getLogger(__name__)
+
+# Период страховочного обновления списка администраторов (в секундах)
+ADMIN_REFRESH_INTERVAL = 600
+
+ADMIN_STATUSES = (ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER)
+
+
+# Реестр администраторов групп в памяти
+class AdminRegistry:
+    """
+    Хранит множества администраторов каждой обслуживаемой группы. Заполняется
+    при запуске, затем поддерживается обновлениями chat_member (назначения и снятия)
+    и периодическим обновлением раз в ADMIN_REFRESH_INTERVAL секунд. Проверка прав — O(1)
+    без запросов к Bot API. Глобальные администраторы из ADMIN_IDS имеют доступ ко всем группам.
+    """
+
+    def __init__(self, group_ids=(), global_admin_ids=()):
+        self.global_admin_ids = frozenset(global_admin_ids)
+        self.group_admin_ids = {}  # group_id -> {user_id, ...}
+        self._user_groups = {}     # user_id -> {group_id, ...}
+        self.loaded_at = None
+        self._lock = asyncio.Lock()
+        self.set_groups(group_ids)
+
+    @property
+    def group_ids(self) -> frozenset:
+        return frozenset(self.group_admin_ids)
+
+    def set_groups(self, group_ids):
+        """Задаёт набор обслуживаемых групп; администраторы исключённых групп забываются."""
+        group_ids = set(group_ids)
+        for group_id in set(self.group_admin_ids) - group_ids:
+            for user_id in self.group_admin_ids.pop(group_id):
+                self._forget(group_id, user_id)
+        for group_id in group_ids:
+            self.group_admin_ids.setdefault(group_id, set())
+
+    def _remember(self, group_id: int, user_id: int):
+        self.group_admin_ids[group_id].add(user_id)
+        self._user_groups.setdefault(user_id, set()).add(group_id)
+
+    def _forget(self, group_id: int, user_id: int):
+        groups = self._user_groups.get(user_id)
+        if groups is not None:
+            groups.discard(group_id)
+            if not groups:
+                del self._user_groups[user_id]
+
+    def is_admin(self, user_id: int, group_id: int = None) -> bool:
+        """Без group_id — администратор хотя бы одной группы."""
+        if user_id in self.global_admin_ids:
+            return True
+        if group_id is None:
+            return user_id in self._user_groups
+        admins = self.group_admin_ids.get(group_id)
+        return admins is not None and user_id in admins
+
+    def is_global_admin(self, user_id: int) -> bool:
+        """Администратор бота из ADMIN_IDS: команды, влияющие на весь процесс."""
+        return user_id in self.global_admin_ids
+
+    def admin_groups(self, user_id: int) -> frozenset:
+        """Группы, которыми пользователь может управлять."""
+        if user_id in self.global_admin_ids:
+            return self.group_ids
+        return frozenset(self._user_groups.get(user_id, ()))
+
+    async def refresh(self, bot):
+        """Загружает списки администраторов всех групп через get_chat_administrators."""
+        async with self._lock:
+            for group_id in list(self.group_admin_ids):
+                try:
+                    admins = await bot.get_chat_administrators(group_id)
+                except Exception as e:
+                    logger.error(f"Ошибка загрузки администраторов группы ID={group_id}: {e}")
+                    continue
+                if group_id not in self.group_admin_ids:
+                    continue  # группа исключена из конфигурации во время запроса
+                for user_id in self.group_admin_ids[group_id]:
+                    self._forget(group_id, user_id)
+                self.group_admin_ids[group_id] = set()
+                for admin in admins:
+                    self._remember(group_id, admin.user.id)
+                logger.info(f"Список администраторов группы ID={group_id} обновлён: {len(admins)}.")
+            self.loaded_at = time.monotonic()
+
+    def apply_chat_member_update(self, chat_member):
+        """Учитывает назначение или снятие администратора из обновления chat_member."""
+        group_id = chat_member.chat.id
+        admins = self.group_admin_ids.get(group_id)
+        if admins is None:
+            return
+        user_id = chat_member.new_chat_member.user.id
+        if chat_member.new_chat_member.status in ADMIN_STATUSES:
+            if user_id not in admins:
+                self._remember(group_id, user_id)
+                logger.info("Пользователь ID=%s назначен администратором группы ID=%s.", user_id, group_id)
+        elif user_id in admins:
+            admins.discard(user_id)
+            self._forget(group_id, user_id)
+            logger.info("Пользователь ID=%s больше не администратор группы ID=%s.", user_id, group_id)
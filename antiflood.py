@@ -0,0 +1,143 @@
+import logging
+import time
+from array import array
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Не более FLOOD_MAX_MESSAGES сообщений за FLOOD_WINDOW секунд
+FLOOD_MAX_MESSAGES = 8
+FLOOD_WINDOW = 10
+# Не более DUPLICATE_MAX одинаковых сообщений за DUPLICATE_WINDOW секунд
+DUPLICATE_MAX = 3
+DUPLICATE_WINDOW = 60
+DUPLICATE_HISTORY = 6
+# Не более LINK_MAX сообщений со ссылками за LINK_WINDOW секунд
+LINK_MAX = 3
+LINK_WINDOW = 60
+# Нарушения за STRIKE_WINDOW секунд: после STRIKES_TO_BAN вместо ограничения — бан
+STRIKE_WINDOW = 3600
+STRIKES_TO_BAN = 3
+# Через сколько секунд бездействия состояние пользователя удаляется, и максимум записей
+IDLE_TTL = 600
+MAX_TRACKED_USERS = 100000
+
+ACTION_RESTRICT = 'restrict'
+ACTION_BAN = 'ban'
+
+
+# Компактное состояние одного пользователя: кольцевые буферы на array
+class FloodState:
+    __slots__ = (
+        'msg_times', 'msg_pos',
+        'dup_hashes', 'dup_times', 'dup_pos',
+        'link_times', 'link_pos',
+        'strikes', 'last_strike', 'last_seen',
+    )
+
+    def __init__(self):
+        self.msg_times = array('d', bytes(8 * FLOOD_MAX_MESSAGES))
+        self.msg_pos = 0
+        self.dup_hashes = array('q', bytes(8 * DUPLICATE_HISTORY))
+        self.dup_times = array('d', bytes(8 * DUPLICATE_HISTORY))
+        self.dup_pos = 0
+        self.link_times = array('d', bytes(8 * LINK_MAX))
+        self.link_pos = 0
+        self.strikes = 0
+        self.last_strike = 0.0
+        self.last_seen = 0.0
+
+
+# Функция для записи времени в кольцевой буфер; возвращает True при превышении лимита
+def _push_rate(times: array, pos: int, now: float, window: float):
+    """
+    В буфере ёмкостью N хранится время N последних событий. Перезаписываемая
+    ячейка содержит время события N шагов назад: если оно внутри окна,
+    то вместе с текущим событий в окне больше N.
+    """
+    exceeded = times[pos] > 0 and now - times[pos] < window
+    times[pos] = now
+    return exceeded, (pos + 1) % len(times)
+
+
+# Детектор флуда и спама в группе
+class FloodDetector:
+    """
+    Следит за частотой сообщений, повторами одинакового текста и частотой ссылок
+    для каждого пользователя в каждой группе: состояние и нарушения ведутся
+    по ключу (group_id, user_id). Состояния хранятся в OrderedDict по времени
+    активности и удаляются после IDLE_TTL секунд бездействия, поэтому память
+    ограничена числом активных пользователей.
+    """
+
+    def __init__(self, idle_ttl: float = IDLE_TTL, max_users: int = MAX_TRACKED_USERS):
+        self.idle_ttl = idle_ttl
+        self.max_users = max_users
+        self._states = OrderedDict()
+        self.violations = {'rate': 0, 'duplicate': 0, 'links': 0}
+
+    def __len__(self):
+        return len(self._states)
+
+    def _evict(self, now: float):
+        states = self._states
+        while states:
+            state = next(iter(states.values()))
+            if now - state.last_seen < self.idle_ttl and len(states) <= self.max_users:
+                break
+            states.popitem(last=False)
+
+    def check(self, group_id: int, user_id: int, content: str, has_link: bool, now: float = None):
+        """
+        Учитывает сообщение и возвращает (действие, причина) при превышении порога
+        или None. Действие — ACTION_RESTRICT, при повторных нарушениях ACTION_BAN.
+        """
+        if now is None:
+            now = time.monotonic()
+        key = (group_id, user_id)
+        state = self._states.get(key)
+        if state is None:
+            state = self._states[key] = FloodState()
+        else:
+            self._states.move_to_end(key)
+        state.last_seen = now
+        self._evict(now)
+
+        reason = None
+        exceeded, state.msg_pos = _push_rate(state.msg_times, state.msg_pos, now, FLOOD_WINDOW)
+        if exceeded:
+            reason = 'rate'
+
+        if content:
+            content_hash = hash(content.casefold().strip())
+            repeats = 1
+            for i in range(DUPLICATE_HISTORY):
+                if state.dup_hashes[i] == content_hash and now - state.dup_times[i] < DUPLICATE_WINDOW:
+                    repeats += 1
+            state.dup_hashes[state.dup_pos] = content_hash
+            state.dup_times[state.dup_pos] = now
+            state.dup_pos = (state.dup_pos + 1) % DUPLICATE_HISTORY
+            if repeats > DUPLICATE_MAX and reason is None:
+                reason = 'duplicate'
+
+        if has_link:
+            exceeded, state.link_pos = _push_rate(state.link_times, state.link_pos, now, LINK_WINDOW)
+            if exceeded and reason is None:
+                reason = 'links'
+
+        if reason is None:
+            return None
+
+        self.violations[reason] += 1
+        if now - state.last_strike > STRIKE_WINDOW:
+            state.strikes = 0
+        state.strikes += 1
+        state.last_strike = now
+        # Сбрасываем окно частоты, чтобы одно нарушение не засчитывалось на каждом следующем сообщении
+        state.msg_times = array('d', bytes(8 * FLOOD_MAX_MESSAGES))
+        state.link_times = array('d', bytes(8 * LINK_MAX))
+        action = ACTION_BAN if state.strikes >= STRIKES_TO_BAN else ACTION_RESTRICT
+        return action, reason
+
+    def forget(self, group_id: int, user_id: int):
+        self._states.pop((group_id, user_id), None)
@@ -0,0 +1,310 @@
+"""
+Локальный HTTP-стенд вместо Telegram Bot API.
+
+Бот подключается к нему через BOT_API_BASE_URL=http://127.0.0.1:<порт>.
+Стенд реализует методы, которые вызывает bot.py, моделирует задержку ответа,
+лимиты Telegram на отправку (общий и по чатам) с ответами 429 retry_after
+и записывает все вызовы для отчёта нагрузочного генератора (benchmarks/loadgen.py).
+
+Отдельный запуск:
+    python -m benchmarks.fakeapi --port 8081 --latency-ms 40
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import math
+import random
+import time
+from collections import Counter, defaultdict, deque
+
+from aiohttp import web
+
+from benchmarks.fakebot import FAKE_BOT_USER
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Telegram на отправку сообщений: (сообщений, период в секундах)
+GLOBAL_SEND_LIMIT = (30, 1.0)
+PRIVATE_CHAT_LIMIT = (3, 3.0)  # в среднем 1 сообщение в секунду, короткие всплески допускаются
+GROUP_CHAT_LIMIT = (20, 60.0)
+# Методы, на которые распространяются лимиты отправки
+SEND_METHODS = frozenset({'sendMessage', 'sendDocument', 'editMessageText'})
+# Методы, не требующие особого ответа: стенд просто отвечает True
+TRUE_METHODS = frozenset({
+    'restrictChatMember', 'banChatMember', 'unbanChatMember', 'deleteMessage', 'deleteMessages',
+    'deleteWebhook', 'setWebhook', 'answerCallbackQuery', 'setMyCommands',
+})
+# Параметры, которые передаются строкой как есть (остальные PTB кодирует в JSON)
+TEXT_PARAMETERS = frozenset({'text', 'caption', 'parse_mode', 'url', 'secret_token'})
+
+
+def _parse_parameter(name: str, value):
+    if name in TEXT_PARAMETERS or not isinstance(value, str):
+        return value
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+# Скользящее окно отправок: сколько сообщений ушло за последний период
+class _SendWindow:
+    __slots__ = ('limit', 'period', 'times')
+
+    def __init__(self, limit: int, period: float):
+        self.limit = limit
+        self.period = period
+        self.times = deque()
+
+    def retry_after(self, now: float) -> int:
+        """0 — отправка разрешена (и учтена), иначе через сколько секунд повторить."""
+        while self.times and now - self.times[0] >= self.period:
+            self.times.popleft()
+        if len(self.times) >= self.limit:
+            return max(1, math.ceil(self.times[0] + self.period - now))
+        self.times.append(now)
+        return 0
+
+
+# Стенд Bot API: состояние чатов, очередь обновлений и журнал вызовов
+class FakeBotApi:
+    def __init__(self, latency: float = 0.04, jitter: float = 0.02, error_rate: float = 0.0,
+                 global_limit=GLOBAL_SEND_LIMIT, private_limit=PRIVATE_CHAT_LIMIT,
+                 group_limit=GROUP_CHAT_LIMIT, admin_ids=(), seed: int = None):
+        """
+        latency — базовая задержка ответа, jitter — среднее экспоненциальной добавки к ней
+        (даёт «хвост» медленных ответов). error_rate — доля случайных 429 сверх лимитов.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.global_window = _SendWindow(*global_limit)
+        self.private_limit = private_limit
+        self.group_limit = group_limit
+        self.admin_ids = tuple(admin_ids)
+        self._random = random.Random(seed)
+        self._chat_windows = {}
+        self._message_ids = itertools.count(1)
+        self._update_ids = itertools.count(1)
+        self._updates = deque()
+        self._updates_ready = asyncio.Event()
+        self._changed = asyncio.Condition()
+        self._runner = None
+        self.port = None
+
+        # Журнал для отчёта
+        self.calls = Counter()
+        self.throttled = Counter()
+        self.calls_by_user = defaultdict(Counter)
+        self.sent_to = Counter()
+        self.muted_at = {}
+        self.unmuted_at = {}
+        self.banned = set()
+        self.deleted_in = Counter()
+        self.deleted_at = {}
+        self.members = defaultdict(set)
+        self.polls = 0
+
+    # --- Обновления для бота ---
+
+    def push_update(self, update: dict) -> int:
+        update_id = next(self._update_ids)
+        update['update_id'] = update_id
+        self._updates.append(update)
+        self._updates_ready.set()
+        return update_id
+
+    async def _get_updates(self, parameters: dict) -> list:
+        offset = parameters.get('offset') or 0
+        limit = parameters.get('limit') or 100
+        timeout = parameters.get('timeout') or 0
+        while self._updates and self._updates[0]['update_id'] < offset:
+            self._updates.popleft()
+        if not self._updates and timeout:
+            self._updates_ready.clear()
+            try:
+                await asyncio.wait_for(self._updates_ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return list(itertools.islice(self._updates, limit))
+
+    # --- Ожидание событий (для генератора нагрузки) ---
+
+    async def wait_for(self, predicate, timeout: float) -> bool:
+        """Ждёт, пока predicate() не станет истинным после очередного вызова API."""
+        async with self._changed:
+            try:
+                await asyncio.wait_for(self._changed.wait_for(predicate), timeout)
+                return True
+            except asyncio.TimeoutError:
+                return False
+
+    async def _notify(self):
+        async with self._changed:
+            self._changed.notify_all()
+
+    # --- Обработка методов ---
+
+    def _chat_window(self, chat_id: int) -> _SendWindow:
+        window = self._chat_windows.get(chat_id)
+        if window is None:
+            limit = self.private_limit if chat_id > 0 else self.group_limit
+            window = self._chat_windows[chat_id] = _SendWindow(*limit)
+        return window
+
+    def _throttle(self, method: str, parameters: dict) -> int:
+        if method not in SEND_METHODS:
+            return 0
+        now = time.monotonic()
+        if self.error_rate and self._random.random() < self.error_rate:
+            return 1
+        chat_id = int(parameters.get('chat_id', 0))
+        retry_after = self._chat_window(chat_id).retry_after(now)
+        if retry_after:
+            return retry_after
+        retry_after = self.global_window.retry_after(now)
+        if retry_after:
+            # Отправка не состоялась — освобождаем место в окне чата
+            self._chat_window(chat_id).times.pop()
+        return retry_after
+
+    def _chat(self, chat_id: int) -> dict:
+        if chat_id > 0:
+            return {'id': chat_id, 'type': 'private', 'first_name': f'User{chat_id}'}
+        return {'id': chat_id, 'type': 'supergroup', 'title': f'Group{chat_id}'}
+
+    def _message(self, parameters: dict) -> dict:
+        chat_id = int(parameters.get('chat_id', 0))
+        return {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': self._chat(chat_id),
+            'from': FAKE_BOT_USER,
+            'text': parameters.get('text', ''),
+        }
+
+    def _record(self, method: str, parameters: dict, received: float):
+        chat_id = parameters.get('chat_id')
+        user_id = parameters.get('user_id')
+        owner = user_id if user_id is not None else (chat_id if isinstance(chat_id, int) and chat_id > 0 else None)
+        if owner is not None:
+            self.calls_by_user[owner][method] += 1
+        if method in SEND_METHODS and isinstance(chat_id, int):
+            self.sent_to[chat_id] += 1
+        elif method == 'restrictChatMember':
+            permissions = parameters.get('permissions') or {}
+            if permissions.get('can_send_messages'):
+                self.unmuted_at.setdefault(user_id, received)
+            else:
+                self.muted_at.setdefault(user_id, received)
+        elif method == 'banChatMember':
+            self.banned.add(user_id)
+            self.members[chat_id].discard(user_id)
+        elif method in ('deleteMessage', 'deleteMessages'):
+            self.deleted_in[chat_id] += len(parameters.get('message_ids') or ()) if method == 'deleteMessages' else 1
+            self.deleted_at.setdefault(chat_id, received)
+
+    async def _result(self, method: str, parameters: dict):
+        if method == 'getUpdates':
+            self.polls += 1
+            return await self._get_updates(parameters)
+        if method == 'getMe':
+            return FAKE_BOT_USER
+        if method in SEND_METHODS:
+            return self._message(parameters)
+        if method == 'getChat':
+            return self._chat(int(parameters.get('chat_id', 0)))
+        if method == 'getChatAdministrators':
+            admins = [{'status': 'creator', 'user': FAKE_BOT_USER, 'is_anonymous': False}]
+            admins.extend(
+                {'status': 'creator', 'user': {'id': admin_id, 'is_bot': False, 'first_name': 'Admin'},
+                 'is_anonymous': False}
+                for admin_id in self.admin_ids
+            )
+            return admins
+        if method == 'getChatMember':
+            chat_id, user_id = int(parameters['chat_id']), int(parameters['user_id'])
+            status = 'member' if user_id in self.members[chat_id] else 'left'
+            return {'status': status, 'user': {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'}}
+        if method in TRUE_METHODS:
+            return True
+        return None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        received = time.monotonic()
+        form = await request.post() if request.can_read_body else {}
+        parameters = {name: _parse_parameter(name, value) for name, value in form.items()}
+        self.calls[method] += 1
+
+        if method != 'getUpdates':
+            delay = self.latency + (self._random.expovariate(1 / self.jitter) if self.jitter else 0)
+            await asyncio.sleep(delay)
+
+        retry_after = self._throttle(method, parameters)
+        if retry_after:
+            self.throttled[method] += 1
+            return web.json_response({
+                'ok': False, 'error_code': 429,
+                'description': f'Too Many Requests: retry after {retry_after}',
+                'parameters': {'retry_after': retry_after},
+            }, status=429)
+
+        result = await self._result(method, parameters)
+        if result is None:
+            return web.json_response(
+                {'ok': False, 'error_code': 404, 'description': 'Not Found: method not found'}, status=404
+            )
+        self._record(method, parameters, received)
+        await self._notify()
+        return web.json_response({'ok': True, 'result': result})
+
+    # --- Жизненный цикл сервера ---
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> int:
+        app = web.Application()
+        app.router.add_route('*', '/bot{token}/{method}', self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+        logger.info(f"Стенд Bot API слушает http://{host}:{self.port}")
+        return self.port
+
+    async def stop(self):
+        # Разбудить висящие long polling-запросы, чтобы сервер закрылся сразу
+        self._updates_ready.set()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Локальный стенд Telegram Bot API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency-ms', type=float, default=40.0)
+    parser.add_argument('--jitter-ms', type=float, default=20.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Доля случайных ответов 429")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    async def serve():
+        api = FakeBotApi(args.latency_ms / 1000, args.jitter_ms / 1000, args.error_rate)
+        await api.start(args.host, args.port)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await api.stop()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+
+from telegram.request import BaseRequest
+
+# Бот, от имени которого отвечает фейковый API
+FAKE_BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+
+
+# Транспорт PTB без сети: отвечает на запросы Bot API из памяти
+class FakeRequest(BaseRequest):
+    """
+    Подставляется через ApplicationBuilder().request(...), поэтому весь стек
+    PTB (сериализация параметров, разбор ответов, ExtBot) работает как обычно.
+    Каждый вызов учитывается в calls, latency задаёт искусственную задержку ответа.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self._message_ids = itertools.count(1)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _result(self, endpoint: str, parameters: dict):
+        if endpoint == 'getMe':
+            return FAKE_BOT_USER
+        if endpoint in ('sendMessage', 'sendDocument', 'editMessageText'):
+            chat_id = int(parameters.get('chat_id', 0))
+            return {
+                'message_id': next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'supergroup'},
+                'from': FAKE_BOT_USER,
+                'text': parameters.get('text', ''),
+            }
+        if endpoint == 'getUpdates':
+            return []
+        return True
+
+    async def do_request(self, url: str, method: str, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        self.calls[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        parameters = request_data.parameters if request_data is not None else {}
+        body = json.dumps({'ok': True, 'result': self._result(endpoint, parameters)})
+        return 200, body.encode()
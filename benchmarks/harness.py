@@ -0,0 +1,145 @@
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+# Процентили, попадающие в отчёт
+PERCENTILES = (50, 99)
+
+
+# Функция для вычисления процентиля по отсортированному списку
+def percentile(sorted_values, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+# Результат одного бенчмарка
+class BenchResult:
+    __slots__ = ('name', 'params', 'ops', 'seconds', 'latencies', 'peak_memory', 'extra')
+
+    def __init__(self, name: str, params: dict = None):
+        self.name = name
+        self.params = params or {}
+        self.ops = 0
+        self.seconds = 0.0
+        self.latencies = []
+        self.peak_memory = None
+        self.extra = {}
+
+    @property
+    def key(self) -> str:
+        params = ','.join(f"{key}={value}" for key, value in sorted(self.params.items()))
+        return f"{self.name}[{params}]" if params else self.name
+
+    def to_dict(self) -> dict:
+        latencies = sorted(self.latencies)
+        data = {
+            'name': self.name,
+            'params': self.params,
+            'ops': self.ops,
+            'seconds': round(self.seconds, 6),
+            'ops_per_sec': round(self.ops / self.seconds, 2) if self.seconds else None,
+            'peak_memory_bytes': self.peak_memory,
+        }
+        for pct in PERCENTILES:
+            data[f'p{pct}_ms'] = round(percentile(latencies, pct) * 1000, 4) if latencies else None
+        data.update(self.extra)
+        return data
+
+    def summary(self) -> str:
+        data = self.to_dict()
+        memory = f"{data['peak_memory_bytes'] / 1024:.0f} КБ" if data['peak_memory_bytes'] is not None else '-'
+        p50 = f"{data['p50_ms']:.3f}" if data['p50_ms'] is not None else '-'
+        p99 = f"{data['p99_ms']:.3f}" if data['p99_ms'] is not None else '-'
+        return (
+            f"{self.key:<48} {data['ops_per_sec'] or 0:>12.1f} оп/с   "
+            f"p50 {p50:>9} мс   p99 {p99:>9} мс   пик {memory}"
+        )
+
+
+# Функция для замера синхронной функции на наборе входных данных
+def bench_sync(name: str, function, inputs, params: dict = None, memory: bool = True) -> BenchResult:
+    result = BenchResult(name, params)
+    clock = time.perf_counter
+    latencies = result.latencies
+    started = clock()
+    for item in inputs:
+        begin = clock()
+        function(item)
+        latencies.append(clock() - begin)
+    result.seconds = clock() - started
+    result.ops = len(latencies)
+    if memory:
+        # Отдельный проход под tracemalloc, чтобы трассировка не искажала время
+        tracemalloc.start()
+        for item in inputs:
+            function(item)
+        result.peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+
+# Функция для замера пиковой памяти асинхронной операции
+async def peak_memory_async(factory) -> int:
+    tracemalloc.start()
+    try:
+        await factory()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+# Функция для получения метаданных запуска (коммит, версии)
+def run_metadata(repo_dir: str) -> dict:
+    commit = None
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=repo_dir,
+            capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        pass
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+# Функция для записи результатов в JSON
+def write_results(path: str, metadata: dict, results) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'metadata': metadata, 'results': [result.to_dict() for result in results]}, f,
+                  ensure_ascii=False, indent=2)
+
+
+# Функция для сравнения с результатами предыдущего запуска
+def compare_results(baseline_path: str, results) -> list:
+    """Возвращает строки отчёта: изменение оп/с и p99 относительно baseline."""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    previous = {}
+    for item in baseline['results']:
+        result = BenchResult(item['name'], item['params'])
+        previous[result.key] = item
+    lines = [f"Сравнение с {baseline_path} (коммит {baseline['metadata'].get('commit')}):"]
+    for result in results:
+        old = previous.get(result.key)
+        if old is None:
+            continue
+        new = result.to_dict()
+        parts = []
+        for field, label in (('ops_per_sec', 'оп/с'), ('p99_ms', 'p99')):
+            if old.get(field) and new.get(field):
+                change = (new[field] - old[field]) / old[field] * 100
+                parts.append(f"{label} {change:+.1f}%")
+        lines.append(f"  {result.key:<48} {'   '.join(parts)}")
+    return lines
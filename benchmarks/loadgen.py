@@ -0,0 +1,261 @@
+"""
+Генератор нагрузки: запускает немодифицированный bot.py (main()) против локального
+стенда Bot API (benchmarks/fakeapi.py) и проигрывает сценарии рейда.
+
+    python -m benchmarks.loadgen --scenario all --users 2000
+    python -m benchmarks.loadgen --scenario join_storm --users 5000 --join-rate 500
+
+Сценарии:
+    join_storm     — N пользователей вступают в группу (chat_member), замер «вступление → ограничение»;
+    registrations  — вступившие проходят регистрацию параллельно, замер «/start → снятие ограничения»;
+    mass_leave     — все выходят из группы, замер «выход → удаление личных сообщений бота»;
+    all            — все три подряд.
+В отчёте также число вызовов API на одного зарегистрированного пользователя и число ответов 429.
+"""
+import argparse
+import asyncio
+import os
+import signal
+import sys
+import tempfile
+import time
+
+from benchmarks.fakeapi import FakeBotApi
+from benchmarks.harness import BenchResult, run_metadata, write_results
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GROUP_ID = -1001000000001
+ADMIN_ID = 1000
+FIRST_USER_ID = 20_000_000
+REGISTRATION_ANSWERS = ('Иван Петров', 'Київ', 'Audi A4', '2012', 'Общение')
+SCENARIOS = ('join_storm', 'registrations', 'mass_leave')
+
+
+def _user(user_id: int) -> dict:
+    return {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'}
+
+
+def _group() -> dict:
+    return {'id': GROUP_ID, 'type': 'supergroup', 'title': 'Load test'}
+
+
+def chat_member_update(user_id: int, old_status: str, new_status: str) -> dict:
+    user = _user(user_id)
+    return {'chat_member': {
+        'chat': _group(), 'from': user, 'date': int(time.time()),
+        'old_chat_member': {'status': old_status, 'user': user},
+        'new_chat_member': {'status': new_status, 'user': user},
+    }}
+
+
+def left_member_message(user_id: int, message_id: int) -> dict:
+    user = _user(user_id)
+    return {'message': {
+        'message_id': message_id, 'date': int(time.time()), 'chat': _group(),
+        'from': user, 'left_chat_member': user,
+    }}
+
+
+def private_message(user_id: int, message_id: int, text: str) -> dict:
+    message = {
+        'message_id': message_id, 'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private', 'first_name': f'User{user_id}'},
+        'from': _user(user_id), 'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'message': message}
+
+
+# Процесс бота, подключённый к стенду
+class BotProcess:
+    def __init__(self, api_url: str, workdir: str, log_path: str):
+        self.api_url = api_url
+        self.workdir = workdir
+        self.log_path = log_path
+        self.process = None
+        self._log = None
+
+    async def start(self):
+        env = dict(os.environ)
+        env.update({
+            'BOT_TOKEN': '123456:LOADTEST',
+            'BOT_API_BASE_URL': self.api_url,
+            'BOT_MODE': 'polling',
+            'GROUP_ID': str(GROUP_ID),
+            'ADMIN_IDS': str(ADMIN_ID),
+            'INVITE_LINK': 'https://t.me/+loadtest',
+            'DB_PATH': os.path.join(self.workdir, 'bot.db'),
+            'METRICS_PORT': '0',
+            'LOG_FORMAT': 'text',
+            'LOG_LEVEL': env.get('LOAD_BOT_LOG_LEVEL', 'WARNING'),
+        })
+        self._log = open(self.log_path, 'wb')
+        self.process = await asyncio.create_subprocess_exec(
+            sys.executable, 'bot.py', cwd=REPO_DIR, env=env,
+            stdout=self._log, stderr=asyncio.subprocess.STDOUT
+        )
+
+    async def stop(self, timeout: float = 30.0):
+        if self.process is not None and self.process.returncode is None:
+            self.process.send_signal(signal.SIGINT)
+            try:
+                await asyncio.wait_for(self.process.wait(), timeout)
+            except asyncio.TimeoutError:
+                self.process.kill()
+                await self.process.wait()
+        if self._log is not None:
+            self._log.close()
+
+
+# Сценарии нагрузки
+class LoadGenerator:
+    def __init__(self, api: FakeBotApi, users: int, concurrency: int, join_rate: float, timeout: float):
+        self.api = api
+        self.user_ids = range(FIRST_USER_ID, FIRST_USER_ID + users)
+        self.concurrency = concurrency
+        self.join_rate = join_rate
+        self.timeout = timeout
+        self.joined_at = {}
+        self.started_at = {}
+        self.registered = []
+        self._message_ids = iter(range(1, 10 ** 9))
+
+    async def _pace(self, index: int, started: float):
+        if self.join_rate:
+            delay = started + index / self.join_rate - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    async def join_storm(self) -> BenchResult:
+        api = self.api
+        result = BenchResult('join_to_restrict', {'users': len(self.user_ids), 'join_rate': self.join_rate})
+        muted_before = len(api.muted_at)
+        started = time.monotonic()
+        for index, user_id in enumerate(self.user_ids):
+            await self._pace(index, started)
+            api.members[GROUP_ID].add(user_id)
+            self.joined_at[user_id] = time.monotonic()
+            api.push_update(chat_member_update(user_id, 'left', 'member'))
+        await api.wait_for(lambda: len(api.muted_at) - muted_before >= len(self.user_ids), self.timeout)
+        result.seconds = time.monotonic() - started
+        result.latencies = [api.muted_at[user_id] - self.joined_at[user_id]
+                            for user_id in self.user_ids if user_id in api.muted_at]
+        result.ops = len(result.latencies)
+        result.extra['restricted'] = result.ops
+        return result
+
+    async def _register(self, user_id: int, semaphore: asyncio.Semaphore) -> bool:
+        api = self.api
+        async with semaphore:
+            self.started_at[user_id] = time.monotonic()
+            steps = ('/start', *REGISTRATION_ANSWERS)
+            for step, text in enumerate(steps, 1):
+                sent_before = api.sent_to[user_id]
+                api.push_update(private_message(user_id, next(self._message_ids), text))
+                if step == len(steps):
+                    return await api.wait_for(lambda: user_id in api.unmuted_at, self.timeout)
+                # Следующий ответ — только после вопроса бота, как у живого пользователя
+                if not await api.wait_for(lambda: api.sent_to[user_id] > sent_before, self.timeout):
+                    return False
+        return False
+
+    async def registrations(self) -> BenchResult:
+        api = self.api
+        if not self.joined_at:
+            await self.join_storm()
+        result = BenchResult('start_to_unmute', {'users': len(self.user_ids), 'concurrency': self.concurrency})
+        semaphore = asyncio.Semaphore(self.concurrency)
+        calls_before = {user_id: sum(api.calls_by_user[user_id].values()) for user_id in self.user_ids}
+        started = time.monotonic()
+        outcomes = await asyncio.gather(*(self._register(user_id, semaphore) for user_id in self.user_ids))
+        result.seconds = time.monotonic() - started
+        self.registered = [user_id for user_id, ok in zip(self.user_ids, outcomes) if ok]
+        result.latencies = [api.unmuted_at[user_id] - self.started_at[user_id] for user_id in self.registered]
+        result.ops = len(self.registered)
+        result.extra['registered'] = len(self.registered)
+        if self.registered:
+            # Вызовы API, адресованные пользователю (личные сообщения, ограничения), от вступления до конца
+            total = sum(sum(api.calls_by_user[user_id].values()) for user_id in self.registered)
+            registration = total - sum(calls_before[user_id] for user_id in self.registered)
+            result.extra['api_calls_per_user'] = round(total / len(self.registered), 2)
+            result.extra['api_calls_per_registration'] = round(registration / len(self.registered), 2)
+        return result
+
+    async def mass_leave(self) -> BenchResult:
+        api = self.api
+        result = BenchResult('leave_to_cleanup', {'users': len(self.user_ids)})
+        # Удаление личных сообщений ожидается только у тех, кому бот писал
+        expected = [user_id for user_id in self.user_ids if api.sent_to[user_id]]
+        deleted_before = len(api.deleted_at)
+        left_at = {}
+        started = time.monotonic()
+        for user_id in self.user_ids:
+            api.members[GROUP_ID].discard(user_id)
+            left_at[user_id] = time.monotonic()
+            api.push_update(chat_member_update(user_id, 'member', 'left'))
+            api.push_update(left_member_message(user_id, next(self._message_ids)))
+        await api.wait_for(lambda: len(api.deleted_at) - deleted_before >= len(expected), self.timeout)
+        result.seconds = time.monotonic() - started
+        result.latencies = [api.deleted_at[user_id] - left_at[user_id]
+                            for user_id in expected if user_id in api.deleted_at]
+        result.ops = len(self.user_ids)
+        result.extra['cleaned'] = len(result.latencies)
+        result.extra['expected_cleanup'] = len(expected)
+        return result
+
+
+async def run(args) -> list:
+    api = FakeBotApi(args.latency_ms / 1000, args.jitter_ms / 1000, args.error_rate, admin_ids=(ADMIN_ID,))
+    port = await api.start()
+    workdir = args.workdir or tempfile.mkdtemp(prefix='bot-load-')
+    bot_process = BotProcess(f'http://127.0.0.1:{port}', workdir, os.path.join(workdir, 'bot.log'))
+    await bot_process.start()
+    results = []
+    try:
+        if not await api.wait_for(lambda: api.polls > 0, args.startup_timeout):
+            raise RuntimeError(f"Бот не начал опрос стенда, см. {bot_process.log_path}")
+        generator = LoadGenerator(api, args.users, args.concurrency, args.join_rate, args.timeout)
+        scenarios = SCENARIOS if args.scenario == 'all' else (args.scenario,)
+        for scenario in scenarios:
+            results.append(await getattr(generator, scenario)())
+    finally:
+        await bot_process.stop()
+        await api.stop()
+    for result in results:
+        result.extra['api_calls'] = dict(api.calls)
+        result.extra['throttled_429'] = dict(api.throttled)
+    print(f"Журнал бота: {bot_process.log_path}")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочные сценарии против локального стенда Bot API")
+    parser.add_argument('--scenario', choices=(*SCENARIOS, 'all'), default='all')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=100, help="Одновременных регистраций")
+    parser.add_argument('--join-rate', type=float, default=0.0, help="Вступлений в секунду (0 — все сразу)")
+    parser.add_argument('--latency-ms', type=float, default=40.0)
+    parser.add_argument('--jitter-ms', type=float, default=20.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Доля случайных ответов 429")
+    parser.add_argument('--timeout', type=float, default=300.0, help="Предельное время сценария, с")
+    parser.add_argument('--startup-timeout', type=float, default=60.0)
+    parser.add_argument('--workdir', help="Каталог для базы и журнала бота (по умолчанию — временный)")
+    parser.add_argument('--output', help="Сохранить результаты в JSON")
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(run(args))
+    for result in results:
+        print(result.summary())
+        data = result.to_dict()
+        details = {key: data[key] for key in result.extra if key not in ('api_calls', 'throttled_429')}
+        print(f"    {details}")
+    if results:
+        print(f"Вызовы API: {results[-1].extra['api_calls']}")
+        print(f"Ответы 429: {results[-1].extra['throttled_429']}")
+    if args.output:
+        write_results(args.output, run_metadata(REPO_DIR), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,298 @@
+"""
+Офлайн-бенчмарки бота: валидаторы, хранилище анкет и полный диалог регистрации.
+
+Запуск из корня репозитория:
+    python -m benchmarks.run                      # все группы
+    python -m benchmarks.run --only validators --quick
+    python -m benchmarks.run --compare benchmarks/results/<прошлый запуск>.json
+
+Сеть не используется: Bot API подменяется FakeRequest, база — временный файл SQLite.
+Результаты (оп/с, p50/p99, пиковая память) пишутся в JSON для сравнения между коммитами.
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# bot.py читает файлы данных по относительным путям и настраивает логирование при импорте
+os.chdir(REPO_DIR)
+sys.path.insert(0, REPO_DIR)
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+os.environ.setdefault('LOG_FORMAT', 'text')
+
+from telegram import Update  # noqa: E402
+from telegram.ext import ApplicationBuilder  # noqa: E402
+
+import bot  # noqa: E402
+from cities import read_city_file, BLOCKED_CITIES_PATH, ALLOWED_CITIES_PATH  # noqa: E402
+from storage import SqliteUserStore  # noqa: E402
+from benchmarks.fakebot import FakeRequest  # noqa: E402
+from benchmarks.harness import (  # noqa: E402
+    BenchResult, bench_sync, peak_memory_async, run_metadata, write_results, compare_results
+)
+
+RESULTS_DIR = os.path.join(REPO_DIR, 'benchmarks', 'results')
+STORE_SIZES = (1000, 10000, 100000)
+# Число одиночных сохранений, замеряемых на заполненной базе
+SAVE_SAMPLE = 2000
+LOAD_REPEATS = 3
+GROUP_ID = -1001000000001
+
+_LETTERS_RU = 'абвгдеёжзийклмнопрстуфхцчшщъыьэюя'
+_LETTERS_EN = 'abcdefghijklmnopqrstuvwxyz'
+_CAR_MODELS = ('Audi A4', 'Toyota Camry', 'Volkswagen Golf', 'Skoda Octavia', 'Mercedes C200',
+               'Lada Vesta', 'Hyundai Tucson', 'Kia Sportage', 'Renault Logan', 'Ford Focus')
+
+
+def _word(rng, letters, low=3, high=10) -> str:
+    return ''.join(rng.choice(letters) for _ in range(rng.randint(low, high)))
+
+
+def _typo(rng, text: str) -> str:
+    if len(text) < 4:
+        return text
+    position = rng.randrange(1, len(text) - 1)
+    return text[:position] + rng.choice(_LETTERS_RU) + text[position + 1:]
+
+
+# Синтетические входные данные валидаторов
+def validator_inputs(count: int, seed: int = 1):
+    rng = random.Random(seed)
+    names = []
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.6:
+            names.append(f"{_word(rng, _LETTERS_RU).title()} {_word(rng, _LETTERS_RU).title()}")
+        elif kind < 0.8:
+            names.append(f"{_word(rng, _LETTERS_EN).title()} {_word(rng, _LETTERS_EN)}{rng.randint(0, 99)}")
+        else:
+            names.append(' '.join(_word(rng, _LETTERS_RU) for _ in range(rng.randint(5, 30))))
+
+    city_names = [name for name, _ in read_city_file(BLOCKED_CITIES_PATH) + read_city_file(ALLOWED_CITIES_PATH)]
+    cities = []
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.4:
+            cities.append(rng.choice(city_names))
+        elif kind < 0.7:
+            cities.append(_typo(rng, rng.choice(city_names)))
+        elif kind < 0.85:
+            cities.append(f"г. {rng.choice(city_names)}, {_word(rng, _LETTERS_RU)}")
+        else:
+            cities.append(' '.join(_word(rng, _LETTERS_RU) for _ in range(rng.randint(1, 6))))
+
+    cars = []
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.8:
+            cars.append(f"{rng.choice(_CAR_MODELS)} {rng.randint(1995, 2024)}")
+        elif kind < 0.9:
+            cars.append(rng.choice(('BMW X5', 'бмв е39', 'беха', 'Bmw 3 series')))
+        else:
+            cars.append(' '.join(_word(rng, _LETTERS_EN) for _ in range(rng.randint(5, 40))))
+    return names, cities, cars
+
+
+# Группа: валидаторы ответов анкеты
+def run_validators(count: int) -> list:
+    names, cities, cars = validator_inputs(count)
+    results = [
+        bench_sync('is_valid_name', bot.is_valid_name, names, {'inputs': count}),
+    ]
+    bot.city_index._lookup.cache_clear()
+    results.append(bench_sync('is_valid_city', bot.is_valid_city, cities, {'inputs': count, 'cache': 'cold'},
+                              memory=False))
+    # Повтор тех же входов: часть ответов берётся из LRU-кэша индекса городов
+    results.append(bench_sync('is_valid_city', bot.is_valid_city, cities, {'inputs': count, 'cache': 'warm'}))
+    results.append(bench_sync('is_valid_car_type', bot.is_valid_car_type, cars, {'inputs': count}))
+    return results
+
+
+def _user_row(user_id: int, rng) -> tuple:
+    return (
+        GROUP_ID, user_id, f"Пользователь {user_id}", rng.choice(('Київ', 'Львів', 'Одеса', 'Харків', 'Дніпро')),
+        rng.choice(_CAR_MODELS), str(rng.randint(1995, 2024)), 'Общение', time.time()
+    )
+
+
+async def _fill_store(store: SqliteUserStore, size: int, seed: int = 2):
+    rng = random.Random(seed)
+    rows = (_user_row(user_id, rng) for user_id in range(1, size + 1))
+    await store.db.executemany(
+        "INSERT INTO users (group_id, user_id, name, city, car_type, year, purpose, updated_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        rows
+    )
+    await store.db.commit()
+
+
+# Группа: сохранение и загрузка анкет на базах разного размера
+async def run_store(sizes, workdir: str) -> list:
+    results = []
+    bot.REGISTERED_USERS_JSON = os.path.join(workdir, 'missing.json')  # миграция из JSON не нужна
+    for size in sizes:
+        path = os.path.join(workdir, f'store_{size}.db')
+        store = SqliteUserStore(path)
+        await store.open()
+        bot.user_store = store
+        try:
+            await _fill_store(store, size)
+            await bot.load_registered_users()
+
+            # Сохранение одной анкеты (save_registered_user) на базе из size анкет
+            rng = random.Random(3)
+            sample = min(size, SAVE_SAMPLE)
+            result = BenchResult('save_registered_user', {'users': size})
+            started = time.perf_counter()
+            for user_id in rng.sample(range(1, size + 1), sample):
+                bot.group_registry.register(GROUP_ID, user_id, bot.UserRecord.from_dict(
+                    dict(zip(('name', 'city', 'car_type', 'year', 'purpose'), _user_row(user_id, rng)[2:7]))
+                ))
+                begin = time.perf_counter()
+                await bot.save_registered_user(GROUP_ID, user_id)
+                result.latencies.append(time.perf_counter() - begin)
+            result.seconds = time.perf_counter() - started
+            result.ops = sample
+            results.append(result)
+
+            # Полная загрузка (load_registered_users): анкеты -> UserRecord и пересборка статистики
+            result = BenchResult('load_registered_users', {'users': size})
+            for _ in range(LOAD_REPEATS):
+                begin = time.perf_counter()
+                await bot.load_registered_users()
+                elapsed = time.perf_counter() - begin
+                result.latencies.append(elapsed)
+                result.seconds += elapsed
+                result.ops += size
+            result.peak_memory = await peak_memory_async(bot.load_registered_users)
+            result.extra['loaded'] = bot.group_registry.registered_count
+            results.append(result)
+        finally:
+            await store.close()
+    return results
+
+
+def _message_update(update_id: int, user_id: int, text: str) -> dict:
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': f'U{user_id}'},
+        'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': message}
+
+
+# Группа: полный диалог /start -> NAME -> ... -> PURPOSE через настоящий ConversationHandler
+async def run_conversation(users: int, concurrency: int, latency: float, workdir: str) -> list:
+    request = FakeRequest(latency)
+    application = (
+        ApplicationBuilder()
+        .token('1:benchmark')
+        .request(request)
+        .get_updates_request(FakeRequest())
+        .build()
+    )
+    application.add_handler(bot.build_registration_handler(persistent=False))
+    store = SqliteUserStore(os.path.join(workdir, 'conversation.db'))
+    await store.open()
+    bot.user_store = store
+    await application.initialize()
+
+    answers = ('/start', 'Иван Петров', 'Київ', 'Audi A4', '2012', 'Общение')
+    update_latencies = []
+    conversation = BenchResult('registration_conversation',
+                               {'users': users, 'concurrency': concurrency, 'api_latency_ms': latency * 1000})
+    update_ids = iter(range(1, users * len(answers) + 1))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def register(user_id: int):
+        async with semaphore:
+            bot.group_registry.add_pending(GROUP_ID, user_id)
+            begin = time.perf_counter()
+            for text in answers:
+                update = Update.de_json(_message_update(next(update_ids), user_id, text), application.bot)
+                step_begin = time.perf_counter()
+                await application.process_update(update)
+                update_latencies.append(time.perf_counter() - step_begin)
+            conversation.latencies.append(time.perf_counter() - begin)
+
+    user_ids = range(10_000_000, 10_000_000 + users)
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*(register(user_id) for user_id in user_ids))
+        conversation.seconds = time.perf_counter() - started
+        conversation.ops = users
+        completed = sum(1 for user_id in user_ids if bot.group_registry.is_registered(GROUP_ID, user_id))
+        conversation.extra['completed'] = completed
+        conversation.extra['api_calls'] = dict(request.calls)
+
+        per_update = BenchResult('conversation_update', dict(conversation.params))
+        per_update.latencies = update_latencies
+        per_update.seconds = conversation.seconds
+        per_update.ops = len(update_latencies)
+        return [conversation, per_update]
+    finally:
+        await application.shutdown()
+        await store.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарки бота")
+    parser.add_argument('--only', choices=('validators', 'store', 'conversation'), action='append',
+                        help="Запустить только указанные группы (можно повторять)")
+    parser.add_argument('--quick', action='store_true', help="Уменьшенные размеры для быстрой проверки")
+    parser.add_argument('--validator-inputs', type=int, default=20000)
+    parser.add_argument('--store-sizes', default=','.join(map(str, STORE_SIZES)))
+    parser.add_argument('--users', type=int, default=500, help="Пользователей в бенчмарке диалога")
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--api-latency-ms', type=float, default=5.0, help="Задержка ответа фейкового Bot API")
+    parser.add_argument('--workdir', help="Каталог для временных баз (по умолчанию — временный)")
+    parser.add_argument('--output', help="Файл результатов JSON (по умолчанию benchmarks/results/<время>-<коммит>.json)")
+    parser.add_argument('--compare', help="JSON предыдущего запуска для сравнения")
+    args = parser.parse_args(argv)
+
+    groups = args.only or ['validators', 'store', 'conversation']
+    store_sizes = [int(size) for size in args.store_sizes.split(',') if size]
+    if args.quick:
+        args.validator_inputs = min(args.validator_inputs, 2000)
+        store_sizes = [size for size in store_sizes if size <= 10000] or [1000]
+        args.users = min(args.users, 50)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='bot-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    metadata = run_metadata(REPO_DIR)
+    results = []
+    try:
+        if 'validators' in groups:
+            results += run_validators(args.validator_inputs)
+        if 'store' in groups:
+            results += asyncio.run(run_store(store_sizes, workdir))
+        if 'conversation' in groups:
+            results += asyncio.run(run_conversation(
+                args.users, args.concurrency, args.api_latency_ms / 1000, workdir
+            ))
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    for result in results:
+        print(result.summary())
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{metadata['commit'] or 'unknown'}.json"
+    )
+    write_results(output, metadata, results)
+    print(f"Результаты записаны в {output}")
+    if args.compare:
+        print('\n'.join(compare_results(args.compare, results)))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,62 +3,176 @@ import os
 import time
 import asyncio
 import re
-import json
+import html
+import io
+from collections import deque
 from dotenv import load_dotenv
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ChatPermissions
-from telegram.constants import ChatMemberStatus
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ChatPermissions, InputFile
+from telegram.constants import ChatMemberStatus, ChatType
+from telegram.error import TimedOut
 from telegram.ext import (
-    ApplicationBuilder, CommandHandler, MessageHandler, ConversationHandler, ContextTypes,
-    ChatMemberHandler, filters
+    ApplicationBuilder, ApplicationHandlerStop, CommandHandler, MessageHandler, ConversationHandler, ContextTypes,
+    ChatMemberHandler, CallbackQueryHandler, filters
 )
 
+from storage import SqliteUserStore
+from persistence import SqlitePersistence
+from deadlines import DeadlineManager
+from ratelimit import PriorityRateLimiter, PRIORITY_NAMES
+from raid import RaidDetector, WelcomeAggregator
+from tasks import retry_with_backoff
+from cleanup import MessageCleaner, MessageTracker
+from webhook import WebhookServer, run_webhook
+from lanes import LaneApplication, LaneUpdateProcessor, GROUP_UPDATE_CONCURRENCY as DEFAULT_GROUP_UPDATE_CONCURRENCY
+from groups import GroupRegistry, RAID_RESTRICT_CONCURRENCY
+from profiles import ProfileCache
+from admins import AdminRegistry, ADMIN_REFRESH_INTERVAL
+from moderation import ACTION_WARN, ACTION_RESTRICT
+from config import ConfigReloader, ConfigError, CONFIG_PATH
+from profiling import SamplingProfiler, SlowUpdateTracer, record_api_call, trace_handler, MAX_PROFILE_SECONDS
+from antiflood import FloodDetector, ACTION_BAN as FLOOD_ACTION_BAN
+from records import UserRecord, deep_sizeof
+from reconcile import MembershipReconciler, RECONCILE_INTERVAL
+from export import export_users, parse_export_args
+from metrics import MetricsRegistry, MetricsServer, instrument_application, iter_handlers, METRICS_HOST, LAG_BUCKETS
+from logs import configure_logging, shutdown_logging, set_level, parse_levels, current_levels, with_log_context
+from stats import RegistrationFunnel, STATS_FIELDS, FUNNEL_OUTCOMES
+
 # Загрузка переменных окружения из .env файла
 load_dotenv()
 
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO  # Уровень INFO для основных сообщений
-)
-logger = logging.getLogger(__name__)
-
+# Настройка логирования: запись в фоновом потоке, JSON (LOG_FORMAT=text — прежний текстовый формат)
+# Уровни подсистем задаются LOG_LEVELS="ratelimit=WARNING,cleanup=DEBUG" и командой /loglevel
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
 # Установка более высокого уровня логирования для внешних библиотек
-logging.getLogger('telegram').setLevel(logging.WARNING)
-logging.getLogger('telegram.ext').setLevel(logging.WARNING)
-logging.getLogger('httpx').setLevel(logging.WARNING)
-logging.getLogger('asyncio').setLevel(logging.WARNING)
+LOG_LEVELS = {
+    'telegram': 'WARNING',
+    'telegram.ext': 'WARNING',
+    'httpx': 'WARNING',
+    'asyncio': 'WARNING',
+    **parse_levels(os.getenv('LOG_LEVELS', '')),
+}
+configure_logging(LOG_LEVEL.upper(), json_output=LOG_FORMAT != 'text', levels=LOG_LEVELS)
+logger = logging.getLogger(__name__)
 
 # Этапы регистрации (изменён порядок)
 NAME, CITY, CAR_TYPE, YEAR, PURPOSE = range(5)
 
-# Время ожидания регистрации и блокировок (в секундах)
-REGISTRATION_TIMEOUT = 120  # Время для регистрации
-BAN_DURATION = 30          # Время блокировки (в секундах)
-
-# Списки для отслеживания пользователей
-registered_users = {}  # Словарь для хранения данных зарегистрированных пользователей
-pending_users = {}
-
-# Словарь для хранения message_ids отправленных ботом пользователям
-user_messages = {}
-
-# Правила чата
-CHAT_RULES = """
-**Правила чата:**
-1. Торгівля (відкрита/закрита) будь-якого виду
-2. Реклама (відкрита / закрита) своїх послуг будь-якого виду
-3. Пропаганда BMW
-4. Розмови про те, що VAG ламається )))
-5. Грошові збори
-6. Інше ...
-"""
-
-# Получение постоянной ссылки приглашения из .env
+# Время ожидания регистрации и блокировок (REGISTRATION_TIMEOUT, BAN_DURATION) задаётся в конфигурации, см. apply_config
+DEADLINE_SWEEP_INTERVAL = 1  # Период проверки истёкших сроков регистрации (в секундах)
+
+# Состояние регистрации по группам: анкеты {user_id: UserRecord}, ожидающие пользователи,
+# распределения анкет и пул фоновых ограничений у каждой группы свои (ключ записи — (group_id, user_id))
+group_registry = GroupRegistry(RAID_RESTRICT_CONCURRENCY)
+
+# Отправленные ботом пользователям сообщения по ключу (group_id, user_id):
+# не больше 50 на переписку, старше окна удаления вытесняются
+user_messages = MessageTracker()
+TRACKED_MESSAGES_EVICT_INTERVAL = 600  # Период вытеснения устаревших переписок (в секундах)
+
+# Фоновая очистка отправленных сообщений
+message_cleaner = MessageCleaner()
+
+# Группы, которые обслуживает бот: GROUP_IDS="-1001,-1002" (GROUP_ID — одна группа, как раньше)
+# и группы из раздела groups конфигурации, см. apply_config
+GROUP_IDS = []
+for group_id_env in (os.getenv('GROUP_ID', '') + ',' + os.getenv('GROUP_IDS', '')).split(','):
+    group_id_env = group_id_env.strip()
+    if group_id_env.lstrip('-').isdigit() and int(group_id_env) not in GROUP_IDS:
+        GROUP_IDS.append(int(group_id_env))
+# Анкеты из старого JSON-файла (без group_id) относятся к первой группе
+LEGACY_GROUP_ID = GROUP_IDS[0] if GROUP_IDS else None
+
+# Хранилище анкет (SQLite) и путь к старому JSON-файлу для однократной миграции
+DB_PATH = os.getenv('DB_PATH', 'bot.db')
+REGISTERED_USERS_JSON = 'registered_users.json'
+user_store = SqliteUserStore(DB_PATH)
+
+# Персистентность ожидающих пользователей, отслеживаемых сообщений и состояний диалога
+state_persistence = SqlitePersistence(DB_PATH)
+
+# Метрики в формате Prometheus на http://127.0.0.1:METRICS_PORT/metrics (0 — отключить)
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9100'))
+metrics_registry = MetricsRegistry()
+handler_latency = metrics_registry.histogram(
+    'bot_handler_duration_seconds', 'Длительность обработчиков обновлений', labels=('handler',)
+)
+handler_errors = metrics_registry.counter(
+    'bot_handler_errors_total', 'Исключения в обработчиках обновлений', labels=('handler',)
+)
+api_latency = metrics_registry.histogram(
+    'bot_api_request_duration_seconds', 'Длительность запросов к Bot API', labels=('method',)
+)
+api_errors = metrics_registry.counter(
+    'bot_api_errors_total', 'Ошибки запросов к Bot API', labels=('method', 'error')
+)
+deadline_lag = metrics_registry.histogram(
+    'bot_ban_job_lag_seconds', 'Опоздание обработки срока регистрации относительно запланированного', buckets=LAG_BUCKETS
+)
+metrics_registry.gauge('bot_pending_users', 'Пользователи, ожидающие регистрации', function=lambda: group_registry.pending_count)
+metrics_registry.gauge('bot_registered_users', 'Зарегистрированные пользователи', function=lambda: group_registry.registered_count)
+update_queue_depth = metrics_registry.gauge('bot_update_queue_depth', 'Обновления в очереди приложения')
+lane_queue_depth = metrics_registry.gauge('bot_lane_queue_depth', 'Обновления, ожидающие в полосах пользователей')
+metrics_registry.gauge(
+    'bot_api_queue_depth', 'Запросы к Bot API в очереди ограничителя по классам приоритета', labels=('priority',),
+    function=lambda: {
+        PRIORITY_NAMES[priority]: count
+        for priority, count in api_rate_limiter.stats()['queued_by_priority'].items()
+    }
+)
+metrics_server = MetricsServer(metrics_registry, METRICS_HOST, METRICS_PORT)
+
+# Функция для учёта длительности и ошибок запросов к Bot API (вызывается ограничителем)
+def observe_api_request(endpoint, duration, error):
+    api_latency.observe(duration, method=endpoint)
+    if error is not None:
+        api_errors.inc(method=endpoint, error=type(error).__name__)
+    record_api_call(endpoint, duration, error)  # в трассу текущего обновления, если трассировка включена
+
+# Профилирование по команде администратора: сэмплирующий профилировщик и трассировка медленных обновлений
+sampling_profiler = SamplingProfiler()
+update_tracer = SlowUpdateTracer()
+DEFAULT_PROFILE_SECONDS = 30
+
+# Сроки регистрации ожидающих пользователей (min-куча с отменой по (group_id, user_id))
+registration_deadlines = DeadlineManager(lag_observer=deadline_lag.observe)
+
+# Общая очередь исходящих запросов к Bot API: лимиты Telegram, приоритеты и повтор после RetryAfter
+api_rate_limiter = PriorityRateLimiter(observer=observe_api_request)
+
+# Воронка регистрации (распределения анкет ведёт group_registry), /stats показывает топ STATS_TOP_N
+registration_funnel = RegistrationFunnel()
+STATS_TOP_N = 10
+# Задержки от ответа на последний вопрос до снятия ограничений (последние 1000 регистраций)
+unmute_latencies = deque(maxlen=1000)
+
+# Сверка хранилища с составом групп (курсоры продолжения хранятся в таблице meta)
+membership_reconciler = MembershipReconciler(user_store)
+
+# Кэш профилей пользователей (полные имена) и размер страницы /list_users
+profile_cache = ProfileCache()
+LIST_USERS_PAGE_SIZE = 10
+
+# Постоянная ссылка приглашения по умолчанию из .env (у группы может быть своя: groups.<ID>.invite_link)
 INVITE_LINK = os.getenv('INVITE_LINK')  # Добавьте эту переменную в ваш .env файл
 
-if not INVITE_LINK:
-    logger.critical("INVITE_LINK не установлена. Добавьте INVITE_LINK в ваш .env файл.")
-    exit(1)
+# Режим получения обновлений: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling').strip().lower()
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # Публичный URL, например https://bot.example.com/telegram
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')  # Секретный токен заголовка X-Telegram-Bot-Api-Secret-Token (без него — случайный)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+
+# Адрес сервера Bot API (локальный telegram-bot-api или тестовый стенд); по умолчанию — api.telegram.org
+BOT_API_BASE_URL = os.getenv('BOT_API_BASE_URL', '').strip().rstrip('/')
+
+# Максимум одновременно обрабатываемых обновлений (обновления одного пользователя всегда идут по порядку)
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', '32'))
+# Сколько из них может занять одна группа: рейд в одной группе не останавливает остальные
+GROUP_UPDATE_CONCURRENCY = int(os.getenv('GROUP_UPDATE_CONCURRENCY', str(DEFAULT_GROUP_UPDATE_CONCURRENCY)))
 
 # Получение списка администраторов из .env
 ADMIN_IDS_ENV = os.getenv('ADMIN_IDS', '')
@@ -68,13 +182,67 @@ if not ADMIN_IDS:
     logger.warning("ADMIN_IDS не установлены или некорректны. Добавьте ADMIN_IDS в ваш .env файл, если хотите использовать глобальных администраторов.")
     # Можно продолжить работу без глобальных администраторов
 
-# Список российских городов (пример, дополните по необходимости)
-RUSSIAN_CITIES = {
-    "Москва", "Санкт-Петербург", "Новосибирск", "Екатеринбург", "Казань",
-    "Нижний Новгород", "Челябинск", "Самара", "Омск", "Ростов-на-Дону",
-    "Уфа", "Красноярск", "Воронеж", "Пермь", "Волгоград",
-    # Добавьте остальные города
-}
+# Реестр администраторов: администраторы каждой группы + глобальные ADMIN_IDS, проверка прав без запросов к API
+admin_registry = AdminRegistry(GROUP_IDS, ADMIN_IDS)
+
+# Конфигурация, перечитываемая без перезапуска (data/bot_config.json): правила чата,
+# списки городов, запрещённые марки, правила модерации, сроки регистрации и бана
+BOT_CONFIG_PATH = os.getenv('BOT_CONFIG_PATH', CONFIG_PATH)
+MODERATION_RULES_PATH = os.getenv('MODERATION_RULES_PATH')  # переопределяет путь из конфигурации
+
+# Правила модерации текущего снимка конфигурации (задаются в apply_config)
+moderation_engine = None
+
+# Функция для применения снимка конфигурации
+def apply_config(config):
+    """
+    Вызывается в цикле событий без await, поэтому обработчики видят все значения
+    одного снимка. Регистрации в процессе не прерываются; новый срок регистрации
+    действует для новых вступлений, уже назначенные сроки не меняются.
+    Правила чата, ссылка приглашения, сроки регистрации и бана — bot_config.group(group_id).
+    """
+    global bot_config, BANNED_CAR_REGEX, city_index, moderation_engine
+    if not config.invite_link:
+        raise ConfigError("INVITE_LINK не установлена. Добавьте INVITE_LINK в ваш .env файл или invite_link в конфигурацию.")
+    bot_config = config
+    BANNED_CAR_REGEX = config.banned_car_regex
+    # Индекс российских городов с транслитерацией и поиском опечаток
+    city_index = config.city_index
+    # Правила модерации сообщений в группе (ключевые слова, регулярные выражения, домены);
+    # счётчики /modstats переносятся из прежнего движка
+    if moderation_engine is not None and config.moderation_engine is not moderation_engine:
+        config.moderation_engine.adopt_stats(moderation_engine)
+    moderation_engine = config.moderation_engine
+    # Обслуживаемые группы: из окружения и из раздела groups конфигурации
+    served_groups = [*GROUP_IDS, *(group_id for group_id in config.groups if group_id not in GROUP_IDS)]
+    admin_registry.set_groups(served_groups)
+    for group_id in served_groups:
+        group_registry.ensure(group_id)
+
+config_overrides = {}
+if MODERATION_RULES_PATH:
+    config_overrides['moderation_rules_path'] = MODERATION_RULES_PATH
+if INVITE_LINK:
+    config_overrides['invite_link'] = INVITE_LINK
+config_reloader = ConfigReloader(BOT_CONFIG_PATH, apply_config, overrides=config_overrides or None)
+try:
+    config_reloader.load()
+except ConfigError as e:
+    logger.critical(f"Некорректная конфигурация {BOT_CONFIG_PATH}: {e}")
+    exit(1)
+
+if not admin_registry.group_ids:
+    logger.warning("GROUP_IDS (GROUP_ID) не установлены или некорректны. Административные команды будут доступны только ADMIN_IDS.")
+
+# Функция для получения названия группы для сообщений администраторам
+def group_title(group_id) -> str:
+    title = bot_config.group(group_id).title
+    return f"{title} (ID={group_id})" if title else f"ID={group_id}"
+
+# Защита от флуда: частота сообщений, повторы и ссылки на пользователя
+FLOOD_RESTRICT_SECONDS = 600
+FLOOD_BAN_SECONDS = 86400
+flood_detector = FloodDetector()
 
 # Функция для проверки имени
 def is_valid_name(name: str) -> bool:
@@ -92,78 +260,96 @@ def is_valid_name(name: str) -> bool:
 # Функция для проверки города
 def is_valid_city(city: str) -> bool:
     """
-    Проверяет, что город не является российским.
+    Проверяет, что город не является российским (с учётом транслитерации,
+    украинского написания, опечаток и слов вроде "г.").
     """
-    return city.strip().title() not in RUSSIAN_CITIES
+    return not city_index.is_blocked(city)
 
 # Функция для проверки типа машины
 def is_valid_car_type(car_type: str) -> bool:
     """
-    Проверяет, что тип машины не содержит 'bmw', 'бмв' или 'беха' в любом регистре.
+    Проверяет, что тип машины не совпадает с запрещённым шаблоном из конфигурации
+    (по умолчанию 'bmw', 'бмв' или 'беха' в любом регистре).
     """
-    return not re.search(r'\bbmw\b|\bбмв\b|\bбеха\b', car_type, re.IGNORECASE)
+    return not BANNED_CAR_REGEX.search(car_type)
 
 # Функция для бановки пользователя, если он не зарегистрировался
-async def ban_user_if_not_registered(context: ContextTypes.DEFAULT_TYPE):
-    job = context.job
-    user_id = job.data['user_id']
-    group_id = job.data['group_id']
+async def ban_user_if_not_registered(bot, user_id, group_id):
+    logger.info("Выполнение задачи бановки пользователя ID=%s в группе ID=%s", user_id, group_id)
 
-    logger.info(f"Выполнение задачи бановки пользователя ID={user_id} в группе ID={group_id}")
+    # Срок регистрации истёк: пользователь больше не ожидает регистрации в этой группе
+    if group_registry.discard_pending(group_id, user_id):
+        state_persistence.drop_pending(group_id, user_id)
 
-    if user_id not in registered_users:
+    if not group_registry.is_registered(group_id, user_id):
         try:
-            # Проверка, не является ли user_id ботом
-            bot = await context.bot.get_me()
-            bot_id = bot.id
-            if user_id == bot_id:
+            # Проверка, не является ли user_id ботом (bot.id известен после инициализации)
+            if user_id == bot.id:
                 logger.warning(f"Попытка заблокировать бота самого себя (ID={user_id}). Операция отменена.")
                 return
 
-            # Баним пользователя на BAN_DURATION секунд
-            until_date = int(time.time()) + BAN_DURATION
-            await context.bot.ban_chat_member(
+            # Баним пользователя на ban_duration секунд из настроек группы
+            ban_duration = bot_config.group(group_id).ban_duration
+            until_date = int(time.time()) + ban_duration
+            await bot.ban_chat_member(
                 chat_id=group_id,
                 user_id=user_id,
                 until_date=until_date
             )
-            logger.info(f"Пользователь ID={user_id} временно забанен в группе ID={group_id} за отсутствие регистрации.")
+            # Срок истёк и бан выполнен — только тогда учитываем тайм-аут в воронке
+            registration_funnel.step('timeouts')
+            registration_funnel.step('bans')
+            logger.info("Пользователь ID=%s временно забанен в группе ID=%s за отсутствие регистрации.", user_id, group_id,
+                        extra={'event': 'member_banned'})
 
             # Отправляем уведомление в группу (опционально)
-            await context.bot.send_message(
+            await bot.send_message(
                 chat_id=group_id,
-                text=f"Пользователь был временно забанен за отсутствие регистрации. Он сможет снова присоединиться через {BAN_DURATION} секунд."
+                text=f"Пользователь был временно забанен за отсутствие регистрации. Он сможет снова присоединиться через {ban_duration} секунд."
             )
 
         except Exception as e:
             logger.error(f"Ошибка при бановке участника ID={user_id} из группы ID={group_id}: {e}")
     else:
-        logger.info(f"Пользователь ID={user_id} уже зарегистрирован. Бан не требуется.")
+        logger.info("Пользователь ID=%s уже зарегистрирован. Бан не требуется.", user_id)
+
+# Текущий проход по истёкшим срокам регистрации (не больше одного одновременно)
+sweep_task = None
 
-# Функция для отправки сообщения и хранения message_id
-async def send_message_and_store_id(user_id, context, text, reply_markup=None):
+# Периодическая задача: банит всех пользователей с истёкшим сроком регистрации
+async def sweep_registration_deadlines(context: ContextTypes.DEFAULT_TYPE):
+    """
+    Проход запускается фоновой задачей, а сама задача планировщика сразу завершается:
+    долгий проход (медленный API, много истёкших сроков) не пересекается со следующими
+    срабатываниями — они пропускаются, пока предыдущий проход не закончится.
+    """
+    global sweep_task
+    if sweep_task is not None and not sweep_task.done():
+        logger.debug("Предыдущий проход по истёкшим срокам ещё выполняется, запуск пропущен.")
+        return
+    bot = context.bot
+    sweep_task = context.application.create_task(registration_deadlines.sweep(
+        lambda group_id, user_id: ban_user_if_not_registered(bot, user_id, group_id)
+    ))
+
+# Функция для отправки сообщения и хранения message_id (переписка регистрации в группе group_id)
+async def send_message_and_store_id(user_id, group_id, context, text, reply_markup=None):
     try:
         message = await context.bot.send_message(chat_id=user_id, text=text, reply_markup=reply_markup, parse_mode='HTML')
-        if user_id not in user_messages:
-            user_messages[user_id] = []
-        user_messages[user_id].append(message.message_id)
-        logger.info(f"Отправлено сообщение ID={message.message_id} пользователю ID={user_id}.")
+        entries = user_messages.add((group_id, user_id), message.message_id)
+        state_persistence.save_messages(group_id, user_id, entries)
+        logger.info("Отправлено сообщение ID=%s пользователю ID=%s.", message.message_id, user_id, extra={'event': 'message_sent'})
     except Exception as e:
         logger.error(f"Ошибка отправки сообщения пользователю ID={user_id}: {e}")
 
-# Функция для удаления сообщений пользователя
-async def delete_user_messages(user_id, context):
-    user_msgs = user_messages.get(user_id, [])
-    for message_id in user_msgs:
-        try:
-            await context.bot.delete_message(chat_id=user_id, message_id=message_id)
-            logger.info(f"Удалено сообщение ID={message_id} пользователю ID={user_id}.")
-        except Exception as e:
-            logger.error(f"Ошибка удаления сообщения ID={message_id} пользователю ID={user_id}: {e}")
-    # Очистка списка сообщений после удаления
-    if user_id in user_messages:
-        del user_messages[user_id]
-        logger.debug(f"Очистка списка сообщений пользователя ID={user_id}.")
+# Функция для удаления сообщений переписки пользователя по группе (выполняется в фоне)
+async def delete_user_messages(group_id, user_id, context):
+    user_msgs = user_messages.pop((group_id, user_id))
+    if user_msgs is None:
+        return
+    state_persistence.drop_messages(group_id, user_id)
+    logger.debug("Очистка списка сообщений пользователя ID=%s по группе ID=%s.", user_id, group_id)
+    message_cleaner.schedule(context.bot, user_id, user_msgs)
 
 # Обработчик покидания группы (MessageHandler)
 async def handle_left_chat_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -176,23 +362,69 @@ async def handle_left_chat_member(update: Update, context: ContextTypes.DEFAULT_
     user_id = left_member.id
     group_id = message.chat.id
 
-    logger.info(f"Пользователь ID={user_id} покинул группу ID={group_id}.")
+    logger.info("Пользователь ID=%s покинул группу ID=%s.", user_id, group_id, extra={'event': 'member_left'})
 
-    # Проверяем, был ли пользователь ранее зарегистрирован
-    if user_id in registered_users:
-        registered_users.pop(user_id, None)
-        logger.info(f"Пользователь ID={user_id} удалён из registered_users.")
-        save_registered_users()  # Сохранение изменений
+    # Проверяем, был ли пользователь зарегистрирован в этой группе (регистрации в других группах сохраняются)
+    if group_registry.unregister(group_id, user_id) is not None:
+        logger.info("Пользователь ID=%s удалён из зарегистрированных группы ID=%s.", user_id, group_id)
+        await delete_registered_user(group_id, user_id)  # Сохранение изменений
     else:
-        logger.debug(f"Пользователь ID={user_id} покинул группу, но не был зарегистрирован.")
+        logger.debug("Пользователь ID=%s покинул группу ID=%s, но не был в ней зарегистрирован.", user_id, group_id)
 
-    # Удаление личных сообщений
-    await delete_user_messages(user_id, context)
+    # Удаление личных сообщений регистрации в этой группе
+    await delete_user_messages(group_id, user_id, context)
 
-    # Удаляем из pending_users, если находится
-    if user_id in pending_users:
-        pending_users.pop(user_id, None)
-        logger.debug(f"Пользователь ID={user_id} удалён из pending_users.")
+    # Удаляем из ожидающих регистрации в этой группе, если находится
+    if group_registry.discard_pending(group_id, user_id):
+        state_persistence.drop_pending(group_id, user_id)
+        registration_funnel.step('left')
+        logger.debug("Пользователь ID=%s удалён из ожидающих группы ID=%s.", user_id, group_id)
+
+# Клавиатура с кнопкой перехода к регистрации в боте (параметр ссылки g<group_id> указывает группу)
+def registration_keyboard(bot, group_id):
+    keyboard = [
+        [InlineKeyboardButton("📋 Зарегистрироваться", url=f"https://t.me/{bot.username}?start=g{group_id}")]
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+# Детектор рейдов и сборщик сводных приветствий (пулы фоновых ограничений — в состоянии каждой группы)
+raid_detector = RaidDetector()
+welcome_aggregator = WelcomeAggregator(registration_keyboard)
+
+# Функция для выбора группы, в очередь которой попадает обновление (LaneScheduler)
+def update_group(update):
+    """
+    События группы относятся к ней самой, личные сообщения — к группе, где пользователь
+    ожидает регистрации. Остальные обновления (команды администраторов) ограничены только общим лимитом.
+    """
+    if not isinstance(update, Update):
+        return None
+    chat = update.effective_chat
+    if chat is not None and chat.type in (ChatType.GROUP, ChatType.SUPERGROUP):
+        return chat.id
+    user = update.effective_user
+    if user is not None:
+        groups = group_registry.pending_groups(user.id)
+        if groups:
+            return min(groups)
+    return None
+
+# Функция для ограничения нового участника до прохождения регистрации
+async def restrict_new_member(bot, group_id, user_id):
+    try:
+        restrict_permissions = ChatPermissions(
+            can_send_messages=False,
+            can_send_polls=False,
+            can_add_web_page_previews=False
+        )
+        await bot.restrict_chat_member(
+            chat_id=group_id,
+            user_id=user_id,
+            permissions=restrict_permissions
+        )
+        logger.info("Пользователь ID=%s ограничен в группе ID=%s.", user_id, group_id, extra={'event': 'member_restricted'})
+    except Exception as e:
+        logger.error(f"Ошибка ограничения участника ID={user_id} в группе ID={group_id}: {e}")
 
 # Отслеживание новых и покидающих участников группы (ChatMemberHandler)
 async def monitor_new_members(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -203,82 +435,102 @@ async def monitor_new_members(update: Update, context: ContextTypes.DEFAULT_TYPE
     user_id = user.id
     group_id = chat_member.chat.id
 
-    logger.debug(f"Обновление статуса участника: ID={user_id}, старый статус={old_status}, новый статус={new_status}")
+    logger.debug("Обновление статуса участника: ID=%s, старый статус=%s, новый статус=%s", user_id, old_status, new_status)
+
+    # Профиль уже есть в обновлении — запоминаем его без дополнительных запросов к API
+    profile_cache.remember(user)
+    # Назначение или снятие администратора
+    admin_registry.apply_chat_member_update(chat_member)
 
     # Обработка присоединения пользователя к группе
     if new_status in [ChatMemberStatus.MEMBER, ChatMemberStatus.RESTRICTED]:
-        # Если пользователь уже зарегистрирован или в процессе регистрации, ничего не делаем
-        if user_id in registered_users or user_id in pending_users:
-            logger.debug(f"Пользователь ID={user_id} уже зарегистрирован или находится в процессе регистрации.")
+        # Если пользователь уже зарегистрирован или в процессе регистрации в этой группе, ничего не делаем
+        group_state = group_registry.ensure(group_id)
+        if user_id in group_state.registered or user_id in group_state.pending:
+            logger.debug("Пользователь ID=%s уже зарегистрирован или находится в процессе регистрации.", user_id)
             return
 
-        # Ограничиваем возможности пользователя
-        try:
-            restrict_permissions = ChatPermissions(
-                can_send_messages=False,
-                can_send_polls=False,
-                can_add_web_page_previews=False
-            )
-            await context.bot.restrict_chat_member(
-                chat_id=group_id,
-                user_id=user_id,
-                permissions=restrict_permissions
-            )
-            logger.info(f"Пользователь ID={user_id} ограничен в группе ID={group_id}.")
-        except Exception as e:
-            logger.error(f"Ошибка ограничения участника ID={user_id} в группе ID={group_id}: {e}")
+        # Во время рейда ограничения ставятся в фоне, а приветствия собираются в одно сообщение
+        raid_active = raid_detector.register_join(group_id)
 
-        # Отправляем сообщение о необходимости регистрации с отметкой пользователя
-        keyboard = [
-            [InlineKeyboardButton("📋 Зарегистрироваться", url=f"https://t.me/{context.bot.username}?start=registration")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        # Ограничиваем возможности пользователя (во время рейда — через пул этой группы)
+        if raid_active:
+            group_state.restrict_pool.submit(restrict_new_member(context.bot, group_id, user_id))
+        else:
+            await restrict_new_member(context.bot, group_id, user_id)
 
-        try:
-            await context.bot.send_message(
-                chat_id=group_id,
-                text=f"Добро пожаловать, <a href='tg://user?id={user_id}'>{user.first_name}</a>! Чтобы остаться в группе, пожалуйста, зарегистрируйтесь через нашего бота.",
-                reply_markup=reply_markup,
-                parse_mode='HTML'  # Включаем HTML-разметку для упоминания пользователя
-            )
-            logger.info(f"Отправлено сообщение о регистрации пользователю ID={user_id} в группу ID={group_id}.")
-        except Exception as e:
-            logger.error(f"Ошибка отправки сообщения о регистрации: {e}")
-
-        # Добавляем пользователя в pending_users для регистрации
-        pending_users[user_id] = group_id
-        logger.debug(f"Пользователь ID={user_id} добавлен в pending_users.")
-
-        # Планируем бан пользователя через REGISTRATION_TIMEOUT секунд, если он не зарегистрируется
-        context.job_queue.run_once(
-            ban_user_if_not_registered,
-            REGISTRATION_TIMEOUT,
-            data={'user_id': user_id, 'group_id': group_id},
-            name=f"ban_user_if_not_registered_{user_id}"
-        )
-        logger.debug(f"Запланирована задача бановки пользователя ID={user_id} через {REGISTRATION_TIMEOUT} секунд.")
+        # Отправляем сообщение о необходимости регистрации с отметкой пользователя
+        if raid_active:
+            welcome_aggregator.add(context.bot, group_id, user_id, user.first_name)
+        else:
+            try:
+                await context.bot.send_message(
+                    chat_id=group_id,
+                    text=f"Добро пожаловать, <a href='tg://user?id={user_id}'>{user.first_name}</a>! Чтобы остаться в группе, пожалуйста, зарегистрируйтесь через нашего бота.",
+                    reply_markup=registration_keyboard(context.bot, group_id),
+                    parse_mode='HTML'  # Включаем HTML-разметку для упоминания пользователя
+                )
+                logger.info("Отправлено сообщение о регистрации пользователю ID=%s в группу ID=%s.", user_id, group_id, extra={'event': 'member_joined'})
+            except Exception as e:
+                logger.error(f"Ошибка отправки сообщения о регистрации: {e}")
+
+        # Добавляем пользователя в ожидающие регистрации в этой группе
+        group_registry.add_pending(group_id, user_id)
+        registration_funnel.step('joins')
+        logger.debug("Пользователь ID=%s добавлен в ожидающие группы ID=%s.", user_id, group_id)
+
+        # Планируем бан пользователя через срок регистрации группы, если он не зарегистрируется
+        registration_timeout = bot_config.group(group_id).registration_timeout
+        deadline = time.time() + registration_timeout
+        registration_deadlines.schedule(group_id, user_id, deadline)
+        state_persistence.save_pending(group_id, user_id, deadline)
+        logger.debug("Запланирован бан пользователя ID=%s через %s секунд.", user_id, registration_timeout)
+
+# Функция для выбора группы, регистрацию в которой начинает пользователь
+def pending_registration_group(user_id, payload=None):
+    """
+    Группа из параметра ссылки /start g<group_id>, если пользователь ожидает в ней
+    регистрации, иначе группа ожидания с ближайшим сроком (или None).
+    """
+    if payload and payload.startswith('g') and payload[1:].lstrip('-').isdigit():
+        group_id = int(payload[1:])
+        if group_registry.is_pending(group_id, user_id):
+            return group_id
+    groups = group_registry.pending_groups(user_id)
+    if not groups:
+        return None
+    return min(groups, key=lambda group_id: registration_deadlines.deadline_of(group_id, user_id) or float('inf'))
+
+# Функция для получения группы текущей регистрации пользователя
+def registration_group(context, user_id):
+    group_id = context.user_data.get('registration_group')
+    # Диалоги, начатые до разделения состояния по группам, группу в user_data не хранят
+    return group_id if group_id is not None else pending_registration_group(user_id)
 
 # Регистрация через бота
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.from_user.id
-    logger.debug(f"Пользователь ID={user_id} начал регистрацию.")
+    logger.debug("Пользователь ID=%s начал регистрацию.", user_id)
 
-    # Проверяем, находится ли пользователь в pending_users
-    if user_id not in pending_users:
+    # Проверяем, ожидает ли пользователь регистрации в какой-либо группе
+    group_id = pending_registration_group(user_id, context.args[0] if context.args else None)
+    if group_id is None:
         await update.message.reply_text('Вы должны присоединиться к группе, чтобы начать регистрацию.')
         logger.warning(f"Пользователь ID={user_id} попытался зарегистрироваться без присоединения к группе.")
         return ConversationHandler.END
 
+    context.user_data['registration_group'] = group_id
+    registration_funnel.step('start')
     # Отправляем приветственное сообщение и сохраняем message_id
-    await send_message_and_store_id(user_id, context, 'Добро пожаловать! Давайте начнём регистрацию.\n\nВопрос 1: Как вас зовут? (псевдоним)')
-    logger.debug(f"Пользователь ID={user_id} получил вопрос 1.")
+    await send_message_and_store_id(user_id, group_id, context, 'Добро пожаловать! Давайте начнём регистрацию.\n\nВопрос 1: Как вас зовут? (псевдоним)')
+    logger.debug("Пользователь ID=%s получил вопрос 1.", user_id)
     return NAME
 
 # Обработчик Вопроса 1: Как вас зовут? (псевдоним)
 async def name_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     name = update.message.text
     user_id = update.message.from_user.id
-    logger.debug(f"Пользователь ID={user_id} ответил на Вопрос 1: {name}")
+    logger.debug("Пользователь ID=%s ответил на Вопрос 1: %s", user_id, name, extra={'event': 'answer_received'})
 
     if not is_valid_name(name):
         await update.message.reply_text(
@@ -287,14 +539,15 @@ async def name_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.warning(f"Пользователь ID={user_id} ввёл некорректное имя: {name}")
         return NAME  # Повторный запрос
     context.user_data['name'] = name.strip()
-    await send_message_and_store_id(user_id, context, 'Вопрос 2: Из какого вы города?')
+    registration_funnel.step('name')
+    await send_message_and_store_id(user_id, registration_group(context, user_id), context, 'Вопрос 2: Из какого вы города?')
     return CITY
 
 # Обработчик Вопроса 2: Из какого вы города?
 async def city_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     city = update.message.text
     user_id = update.message.from_user.id
-    logger.debug(f"Пользователь ID={user_id} ответил на Вопрос 2: {city}")
+    logger.debug("Пользователь ID=%s ответил на Вопрос 2: %s", user_id, city, extra={'event': 'answer_received'})
 
     if not is_valid_city(city):
         await update.message.reply_text(
@@ -304,14 +557,15 @@ async def city_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return CITY  # Повторный запрос
 
     context.user_data['city'] = city.strip()
-    await send_message_and_store_id(user_id, context, 'Вопрос 3: Какая у вас модель автомобиля?')
+    registration_funnel.step('city')
+    await send_message_and_store_id(user_id, registration_group(context, user_id), context, 'Вопрос 3: Какая у вас модель автомобиля?')
     return CAR_TYPE
 
 # Обработчик Вопроса 3: Какая у вас модель автомобиля?
 async def car_type_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     car_type = update.message.text
     user_id = update.message.from_user.id
-    logger.debug(f"Пользователь ID={user_id} ответил на Вопрос 3: {car_type}")
+    logger.debug("Пользователь ID=%s ответил на Вопрос 3: %s", user_id, car_type, extra={'event': 'answer_received'})
 
     if not is_valid_car_type(car_type):
         await update.message.reply_text(
@@ -321,125 +575,92 @@ async def car_type_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return CAR_TYPE  # Повторный запрос
 
     context.user_data['car_type'] = car_type.strip()
-    await send_message_and_store_id(user_id, context, 'Вопрос 4: Какой год выпуска вашей машины?')
+    registration_funnel.step('car_type')
+    await send_message_and_store_id(user_id, registration_group(context, user_id), context, 'Вопрос 4: Какой год выпуска вашей машины?')
     return YEAR
 
 # Обработчик Вопроса 4: Какой год выпуска вашей машины?
 async def year_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     year_input = update.message.text
     user_id = update.message.from_user.id
-    logger.debug(f"Пользователь ID={user_id} ответил на Вопрос 4: {year_input}")
+    logger.debug("Пользователь ID=%s ответил на Вопрос 4: %s", user_id, year_input, extra={'event': 'answer_received'})
 
     # Убрана проверка на корректность года
     context.user_data['year'] = year_input.strip()
-    await send_message_and_store_id(user_id, context, 'Вопрос 5: Какова цель вашего визита?')
+    registration_funnel.step('year')
+    await send_message_and_store_id(user_id, registration_group(context, user_id), context, 'Вопрос 5: Какова цель вашего визита?')
     return PURPOSE
 
 # Обработчик Вопроса 5: Какова цель вашего визита?
 async def purpose_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    started = time.monotonic()
     purpose = update.message.text
     user_id = update.message.from_user.id
-    logger.debug(f"Пользователь ID={user_id} ответил на Вопрос 5: {purpose}")
-
-    context.user_data['purpose'] = purpose.strip()
-    # Сохраняем данные пользователя
-    registered_users[user_id] = {
-        'name': context.user_data.get('name'),
-        'city': context.user_data.get('city'),
-        'car_type': context.user_data.get('car_type'),
-        'year': context.user_data.get('year'),
-        'purpose': context.user_data.get('purpose')
-    }
-    logger.info(f"Данные пользователя ID={user_id} сохранены в registered_users.")
-    
-    save_registered_users()  # Сохранение данных после регистрации
-
-    # Удаляем из ожидающих регистрации
-    group_id = pending_users.pop(user_id, None)
-    logger.debug(f"Пользователь ID={user_id} удалён из pending_users.")
+    logger.debug("Пользователь ID=%s ответил на Вопрос 5: %s", user_id, purpose, extra={'event': 'answer_received'})
 
-    # Отправляем сообщение с правилами и ссылкой-приглашением
-    keyboard = [
-        [InlineKeyboardButton("📢 Перейти в чат", url=INVITE_LINK)]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    group_id = registration_group(context, user_id)
+    if group_id is None:
+        await update.message.reply_text('Вы должны присоединиться к группе, чтобы начать регистрацию.')
+        logger.warning(f"Неизвестна группа регистрации пользователя ID={user_id}.")
+        context.user_data.clear()
+        return ConversationHandler.END
 
-    try:
-        await context.bot.send_message(
-            chat_id=user_id,
-            text=f"Спасибо за регистрацию! Теперь вы можете отправлять сообщения в группе.\n\n**Правила чата:**\n{CHAT_RULES}",
-            reply_markup=reply_markup,
-            parse_mode='HTML'
+    context.user_data['purpose'] = purpose.strip()
+    # Сохраняем данные пользователя (при повторной регистрации старая анкета вычитается из статистики)
+    group_registry.register(group_id, user_id, UserRecord(
+        name=context.user_data.get('name'),
+        city=context.user_data.get('city'),
+        car_type=context.user_data.get('car_type'),
+        year=context.user_data.get('year'),
+        purpose=context.user_data.get('purpose')
+    ))
+    registration_funnel.step('completed')
+    logger.info("Данные пользователя ID=%s сохранены для группы ID=%s.", user_id, group_id)
+
+    # Сохранение в хранилище не зависит от Bot API и идёт параллельно со снятием ограничений
+    save_task = asyncio.create_task(save_registered_user(group_id, user_id))
+
+    # Удаляем из ожидающих регистрации и явно отменяем запланированный бан
+    was_pending = group_registry.discard_pending(group_id, user_id)
+    state_persistence.drop_pending(group_id, user_id)
+    registration_deadlines.cancel(group_id, user_id)
+    logger.debug("Пользователь ID=%s удалён из ожидающих группы ID=%s, бан отменён.", user_id, group_id)
+
+    # Критический путь: сначала снимаем ограничения
+    if was_pending:
+        unrestrict_permissions = ChatPermissions(
+            can_send_messages=True,
+            can_send_polls=True,
+            can_send_other_messages=True,
+            can_add_web_page_previews=True,
+            can_change_info=False,
+            can_invite_users=False,
+            can_pin_messages=False
         )
-        logger.info(f"Отправлено сообщение с правилами и приглашением пользователю ID={user_id}.")
-    except Exception as e:
-        logger.error(f"Ошибка отправки личного сообщения пользователю ID={user_id}: {e}")
-        # Если не удалось отправить в личные сообщения, отправляем в группу
-        if group_id:
-            try:
-                await context.bot.send_message(
-                    chat_id=group_id,
-                    text=f"Пользователь <a href='tg://user?id={user_id}'>{context.user_data.get('name')}</a> успешно зарегистрирован и теперь может отправлять сообщения.",
-                    parse_mode='HTML'
-                )
-                # Также можно добавить кнопку с приглашением
-                await context.bot.send_message(
-                    chat_id=group_id,
-                    text="Если вы хотите проверить свои настройки или повторно присоединиться, используйте кнопку ниже.",
-                    reply_markup=reply_markup,
-                    parse_mode='HTML'
-                )
-                logger.info(f"Отправлено сообщение с приглашением в группу для пользователя ID={user_id}.")
-            except Exception as ex:
-                logger.error(f"Ошибка отправки сообщения в группу для пользователя ID={user_id}: {ex}")
-
-    # Снимаем ограничения с пользователя
-    if group_id:
         try:
-            # Разрешаем пользователю отправлять сообщения
-            unrestrict_permissions = ChatPermissions(
-                can_send_messages=True,
-                can_send_polls=True,
-                can_send_other_messages=True,
-                can_add_web_page_previews=True,
-                can_change_info=False,
-                can_invite_users=False,
-                can_pin_messages=False
-            )
-            await context.bot.restrict_chat_member(
-                chat_id=group_id,
-                user_id=user_id,
-                permissions=unrestrict_permissions,
-                until_date=None  # Снятие ограничений
+            await retry_with_backoff(
+                lambda: context.bot.restrict_chat_member(
+                    chat_id=group_id,
+                    user_id=user_id,
+                    permissions=unrestrict_permissions,
+                    until_date=None  # Снятие ограничений
+                ),
+                f"Снятие ограничений с пользователя ID={user_id}"
             )
-            logger.info(f"Ограничения сняты с пользователя ID={user_id} в группе ID={group_id}.")
+            latency = time.monotonic() - started
+            unmute_latencies.append(latency)
+            logger.info("Ограничения сняты с пользователя ID=%s в группе ID=%s за %.0f мс.", user_id, group_id, latency * 1000,
+                        extra={'event': 'member_unmuted'})
         except Exception as e:
             logger.error(f"Ошибка снятия ограничений с участника ID={user_id} в группе ID={group_id}: {e}")
-
-    # Отправляем пользователю ссылку приглашения в группу
-    if group_id:
-        try:
-            await context.bot.send_message(
-                chat_id=user_id,
-                text=f"Спасибо за регистрацию! Вы можете вернуться в группу по ссылке: {INVITE_LINK}",
-                parse_mode='HTML'
-            )
-            logger.info(f"Отправлено приглашение пользователю ID={user_id} в группу.")
-        except Exception as e:
-            logger.error(f"Ошибка отправки приглашения пользователю ID={user_id}: {e}")
-            # Попробуем отправить в группу
-            try:
-                await context.bot.send_message(
-                    chat_id=group_id,
-                    text=f"Пользователь <a href='tg://user?id={user_id}'>{context.user_data.get('name')}</a>, пожалуйста, используйте ссылку ниже для повторного присоединения к чату.",
-                    parse_mode='HTML',
-                    reply_markup=reply_markup
-                )
-                logger.info(f"Отправлено приглашение в группу для пользователя ID={user_id}.")
-            except Exception as ex:
-                logger.error(f"Ошибка отправки приглашения в группу для пользователя ID={user_id}: {ex}")
     else:
-        logger.error(f"Неизвестный group_id для пользователя ID={user_id}.")
+        logger.error(f"Пользователь ID={user_id} не ожидал регистрации в группе ID={group_id}, ограничения не сняты.")
+
+    # Одно итоговое сообщение: благодарность, правила и кнопка возврата в группу
+    await asyncio.gather(
+        send_registration_complete(context.bot, user_id, group_id, context.user_data.get('name')),
+        save_task
+    )
 
     # **Удаление личных сообщений после регистрации убрано, чтобы сохранить переписку**
     # await delete_user_messages(user_id, context)  # Удалено
@@ -449,40 +670,139 @@ async def purpose_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     return ConversationHandler.END
 
+# Функция для отправки итогового сообщения о регистрации (в личные сообщения, при ошибке — в группу)
+async def send_registration_complete(bot, user_id, group_id, name):
+    settings = bot_config.group(group_id)
+    keyboard = [
+        [InlineKeyboardButton("📢 Перейти в чат", url=settings.invite_link)]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    # Сообщения отправляются один раз: повтор после TimedOut может продублировать уже доставленное
+    try:
+        await bot.send_message(
+            chat_id=user_id,
+            text=f"Спасибо за регистрацию! Теперь вы можете отправлять сообщения в группе. "
+                 f"Вернуться в группу можно по кнопке ниже.\n\n**Правила чата:**\n{settings.chat_rules}",
+            reply_markup=reply_markup,
+            parse_mode='HTML'
+        )
+        logger.info("Отправлено сообщение с правилами и приглашением пользователю ID=%s.", user_id)
+        return
+    except TimedOut as e:
+        # Сообщение могло быть доставлено — сообщение в группу не дублирует его
+        logger.warning(f"Таймаут отправки итогового сообщения пользователю ID={user_id}, повтор не выполняется: {e}")
+        return
+    except Exception as e:
+        logger.error(f"Ошибка отправки личного сообщения пользователю ID={user_id}: {e}")
+
+    # Если не удалось отправить в личные сообщения, отправляем одно сообщение в группу
+    if not group_id:
+        return
+    try:
+        await bot.send_message(
+            chat_id=group_id,
+            text=f"Пользователь <a href='tg://user?id={user_id}'>{html.escape(name or str(user_id))}</a> успешно зарегистрирован "
+                 f"и теперь может отправлять сообщения. Ссылка для возвращения в чат — по кнопке ниже.",
+            reply_markup=reply_markup,
+            parse_mode='HTML'
+        )
+        logger.info("Отправлено сообщение с приглашением в группу для пользователя ID=%s.", user_id)
+    except Exception as e:
+        logger.error(f"Ошибка отправки сообщения в группу для пользователя ID={user_id}: {e}")
+
 # Обработчик Отмены Регистрации
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.from_user.id
     await update.message.reply_text('Регистрация отменена.')
-    logger.info(f"Пользователь ID={user_id} отменил регистрацию.")
-
-    # Удаляем из ожидающих и зарегистрированных, если необходимо
-    if user_id in pending_users:
-        pending_users.pop(user_id, None)
-        logger.debug(f"Пользователь ID={user_id} удалён из pending_users.")
-    if user_id in registered_users:
-        registered_users.pop(user_id, None)
-        logger.debug(f"Пользователь ID={user_id} удалён из registered_users.")
-        save_registered_users()  # Сохранение изменений
-
-    # Отменяем запланированную задачу бановки
-    job_name = f"ban_user_if_not_registered_{user_id}"
-    current_jobs = context.job_queue.get_jobs_by_name(job_name)
-    if current_jobs:
-        for job in current_jobs:
-            job.schedule_removal()
-            logger.debug(f"Запланированная задача бановки пользователя ID={user_id} отменена.")
+    registration_funnel.step('cancelled')
+    logger.info("Пользователь ID=%s отменил регистрацию.", user_id)
+
+    # Удаляем из ожидающих и зарегистрированных группы, в которой шла регистрация
+    group_id = registration_group(context, user_id)
+    if group_id is not None:
+        if group_registry.discard_pending(group_id, user_id):
+            state_persistence.drop_pending(group_id, user_id)
+            logger.debug("Пользователь ID=%s удалён из ожидающих группы ID=%s.", user_id, group_id)
+        if group_registry.unregister(group_id, user_id) is not None:
+            logger.debug("Пользователь ID=%s удалён из зарегистрированных группы ID=%s.", user_id, group_id)
+            await delete_registered_user(group_id, user_id)  # Сохранение изменений
+
+    # Отменяем запланированный бан
+    if group_id is not None and registration_deadlines.cancel(group_id, user_id):
+        logger.debug("Запланированный бан пользователя ID=%s отменён.", user_id)
     else:
-        logger.warning(f"Запланированные задачи бановки для пользователя ID={user_id} не найдены.")
+        logger.warning(f"Запланированный бан для пользователя ID={user_id} не найден.")
 
     # Удаляем личные сообщения
-    await delete_user_messages(user_id, context)
+    if group_id is not None:
+        await delete_user_messages(group_id, user_id, context)
 
     # Очищаем данные пользователя из context.user_data
     context.user_data.clear()
 
     return ConversationHandler.END
 
-# Обработчик команды /list_users для администраторов
+# Функция для выбора группы административной команды: указанной явно или единственной группы администратора
+def resolve_admin_group(user_id, group_id=None):
+    """Возвращает (group_id, None) или (None, текст ответа администратору)."""
+    groups = admin_registry.admin_groups(user_id)
+    if group_id is not None:
+        if group_id not in groups:
+            return None, f"Вы не администратор группы ID={group_id}."
+        return group_id, None
+    if len(groups) == 1:
+        return next(iter(groups)), None
+    if not groups:
+        return None, "Нет групп, которыми вы управляете."
+    choices = "\n".join(f"• {group_title(group)}" for group in sorted(groups))
+    return None, f"Укажите ID группы:\n{choices}"
+
+# Функция для формирования одной страницы списка пользователей группы
+async def render_users_page(bot, group_id, cursor=None, backward=False):
+    """
+    Возвращает (текст, клавиатура) для страницы списка, начинающейся после cursor
+    (или заканчивающейся перед cursor при backward=True). Профили запрашиваются
+    только для пользователей этой страницы. Если страница пуста, возвращает (None, None).
+    """
+    page = await user_store.page(group_id, cursor, LIST_USERS_PAGE_SIZE, backward)
+    if not page:
+        return None, None
+
+    uids = [uid for uid, _ in page]
+    full_names = await profile_cache.get_many(bot, uids)
+
+    message_lines = [f"<b>Список зарегистрированных пользователей группы {html.escape(group_title(group_id))}:</b>\n"]
+    for uid, data in page:
+        full_name = full_names.get(uid)
+        if full_name is None:
+            message_lines.append(
+                f"<b>Пользователь ID={uid}:</b> Не удалось получить информацию.\n"
+                "-----"
+            )
+            continue
+        message_lines.append(
+            f"<b>Пользователь:</b> {html.escape(full_name)} (ID: {uid})\n"
+            f"• Имя (псевдоним): {html.escape(data.get('name') or 'Не указано')}\n"
+            f"• Город: {html.escape(data.get('city') or 'Не указано')}\n"
+            f"• Модель автомобиля: {html.escape(data.get('car_type') or 'Не указано')}\n"
+            f"• Год выпуска: {html.escape(data.get('year') or 'Не указано')}\n"
+            f"• Цель визита: {html.escape(data.get('purpose') or 'Не указано')}\n"
+            "-----"
+        )
+
+    # Кнопки навигации: курсоры — первый и последний user_id страницы
+    first_uid, last_uid = uids[0], uids[-1]
+    has_prev = bool(await user_store.page(group_id, first_uid, 1, backward=True))
+    has_next = bool(await user_store.page(group_id, last_uid, 1))
+    buttons = []
+    if has_prev:
+        buttons.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"list_users:{group_id}:prev:{first_uid}"))
+    if has_next:
+        buttons.append(InlineKeyboardButton("Вперёд ➡️", callback_data=f"list_users:{group_id}:next:{last_uid}"))
+    reply_markup = InlineKeyboardMarkup([buttons]) if buttons else None
+
+    return "\n".join(message_lines), reply_markup
+
 # Обработчик команды /list_users для администраторов группы
 async def list_users_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
@@ -496,53 +816,31 @@ async def list_users_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     try:
         # Проверяем, является ли пользователь администратором указанной группы
-        admins = await context.bot.get_chat_administrators(int(os.getenv('GROUP_ID')))
-        admin_ids = {admin.user.id for admin in admins}
-
-        if user_id not in admin_ids:
+        if not admin_registry.is_admin(user_id):
             await update.message.reply_text("У вас нет прав для выполнения этой команды. Только администраторы группы могут использовать её.")
             logger.warning(f"Пользователь ID={user_id} попытался использовать /list_users без прав.")
             return
 
-        if not registered_users:
+        if context.args and not context.args[0].lstrip('-').isdigit():
+            await update.message.reply_text("Использование: /list_users [ID группы]")
+            return
+        group_id, error = resolve_admin_group(user_id, int(context.args[0]) if context.args else None)
+        if error:
+            await update.message.reply_text(error)
+            return
+
+        message_text, reply_markup = await render_users_page(context.bot, group_id)
+        if message_text is None:
             await update.message.reply_text("Нет зарегистрированных пользователей.")
             logger.info("Запрос списка пользователей, но список пуст.")
             return
 
-        # Форматируем список пользователей
-        message_lines = ["**Список зарегистрированных пользователей:**\n"]
-        for uid, data in registered_users.items():
-            try:
-                user = await context.bot.get_chat(uid)
-                name = data.get('name', 'Не указано')
-                city = data.get('city', 'Не указано')
-                car_type = data.get('car_type', 'Не указано')
-                year = data.get('year', 'Не указано')
-                purpose = data.get('purpose', 'Не указано')
-
-                message_lines.append(
-                    f"**Пользователь:** {user.full_name} (ID: {uid})\n"
-                    f"• Имя (псевдоним): {name}\n"
-                    f"• Город: {city}\n"
-                    f"• Модель автомобиля: {car_type}\n"
-                    f"• Год выпуска: {year}\n"
-                    f"• Цель визита: {purpose}\n"
-                    "-----"
-                )
-            except Exception as e:
-                logger.error(f"Ошибка получения информации о пользователе ID={uid}: {e}")
-                message_lines.append(
-                    f"**Пользователь ID={uid}:** Не удалось получить информацию.\n"
-                    "-----"
-                )
-
-        message_text = "\n".join(message_lines)
-
         try:
             await context.bot.send_message(
                 chat_id=user_id,
                 text=message_text,
-                parse_mode='Markdown',
+                reply_markup=reply_markup,
+                parse_mode='HTML',
                 disable_web_page_preview=True
             )
             logger.info(f"Отправлен список пользователей администратору ID={user_id}.")
@@ -550,52 +848,707 @@ async def list_users_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
             logger.error(f"Ошибка отправки списка пользователей администратору ID={user_id}: {e}")
             await update.message.reply_text("Произошла ошибка при отправке списка пользователей.")
     except Exception as e:
-        logger.error(f"Ошибка проверки администратора группы: {e}")
-        await update.message.reply_text("Произошла ошибка при проверке администратора группы.")
+        logger.error(f"Ошибка формирования списка пользователей: {e}")
+        await update.message.reply_text("Произошла ошибка при формировании списка пользователей.")
+
+# Обработчик команды /export_users: выгрузка анкет файлом CSV или JSONL
+async def export_users_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    chat_id = update.effective_chat.id
+
+    if chat_id != user_id:
+        await update.message.reply_text("Эту команду можно использовать только в личных сообщениях боту.")
+        logger.warning(f"Пользователь ID={user_id} попытался использовать /export_users в чате ID={chat_id}.")
+        return
+    if not admin_registry.is_admin(user_id):
+        await update.message.reply_text("У вас нет прав для выполнения этой команды. Только администраторы группы могут использовать её.")
+        logger.warning(f"Пользователь ID={user_id} попытался использовать /export_users без прав.")
+        return
+
+    arguments = update.message.text.partition(' ')[2]
+    try:
+        export_format, group_id, field_filters = parse_export_args(arguments)
+    except ValueError as e:
+        await update.message.reply_text(
+            f"{e}\nИспользование: /export_users [csv|jsonl] [group=ID] [city=...] [car_type=...] [year=...]"
+        )
+        return
+    group_id, error = resolve_admin_group(user_id, group_id)
+    if error:
+        await update.message.reply_text(error)
+        return
+
+    started = time.monotonic()
+    try:
+        export_file, count = await export_users(user_store, group_id, export_format, field_filters)
+    except Exception as e:
+        logger.error(f"Ошибка выгрузки пользователей для администратора ID={user_id}: {e}")
+        await update.message.reply_text("Произошла ошибка при выгрузке пользователей.")
+        return
+
+    with export_file:
+        if count == 0:
+            await update.message.reply_text("Нет пользователей, подходящих под фильтры.")
+            return
+        filename = f"users_{group_id}_{time.strftime('%Y%m%d_%H%M%S')}.{export_format}"
+        filters_text = ", ".join(f"{field}={value}" for field, value in field_filters.items()) or "без фильтров"
+        try:
+            # InputFile читает файл целиком: пик памяти при отправке — размер выгрузки
+            await context.bot.send_document(
+                chat_id=user_id,
+                document=InputFile(export_file, filename=filename),
+                caption=f"Группа {group_title(group_id)}. Пользователей: {count} ({filters_text})"
+            )
+            logger.info(
+                f"Выгрузка {count} пользователей ({export_format}, {filters_text}) отправлена администратору ID={user_id} "
+                f"за {time.monotonic() - started:.2f} с."
+            )
+        except Exception as e:
+            logger.error(f"Ошибка отправки выгрузки администратору ID={user_id}: {e}")
+            await update.message.reply_text("Произошла ошибка при отправке файла выгрузки.")
+
+# Обработчик кнопок навигации по списку пользователей
+async def list_users_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    user_id = query.from_user.id
+
+    try:
+        _, group_id, direction, cursor = query.data.split(':')
+        group_id = int(group_id)
+        if not admin_registry.is_admin(user_id, group_id):
+            await query.answer("У вас нет прав для выполнения этой команды.", show_alert=True)
+            logger.warning(f"Пользователь ID={user_id} попытался листать /list_users группы ID={group_id} без прав.")
+            return
+
+        message_text, reply_markup = await render_users_page(
+            context.bot, group_id, int(cursor), backward=(direction == 'prev')
+        )
+        await query.answer()
+        if message_text is None:
+            return
+        await query.edit_message_text(
+            text=message_text,
+            reply_markup=reply_markup,
+            parse_mode='HTML',
+            disable_web_page_preview=True
+        )
+    except Exception as e:
+        logger.error(f"Ошибка перелистывания списка пользователей для ID={user_id}: {e}")
+
+# Модерация текстовых сообщений в группе по правилам чата
+async def moderate_group_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    message = update.effective_message
+    user = update.effective_user
+    if message is None or user is None or not message.text:
+        return
+    group_id = message.chat.id
+    if admin_registry.is_admin(user.id, group_id):
+        return
+
+    verdict = moderation_engine.check(message.text)
+    if verdict is None:
+        return
+
+    logger.info("Сообщение ID=%s пользователя ID=%s нарушает правила %s: действие %s.", message.message_id, user.id,
+                verdict.rule_ids, verdict.action, extra={'event': 'moderation_violation'})
+
+    if verdict.action == ACTION_WARN:
+        try:
+            await message.reply_text(
+                f"<a href='tg://user?id={user.id}'>{html.escape(user.first_name)}</a>, напоминаем о правилах чата:\n{bot_config.group(group_id).chat_rules}",
+                parse_mode='HTML'
+            )
+        except Exception as e:
+            logger.error(f"Ошибка отправки предупреждения пользователю ID={user.id}: {e}")
+        return
+
+    # delete и restrict: удаляем сообщение
+    deleted = False
+    try:
+        await message.delete()
+        deleted = True
+    except Exception as e:
+        logger.error(f"Ошибка удаления сообщения ID={message.message_id} в группе ID={group_id}: {e}")
+
+    if verdict.action == ACTION_RESTRICT:
+        try:
+            restrict_permissions = ChatPermissions(
+                can_send_messages=False,
+                can_send_polls=False,
+                can_add_web_page_previews=False
+            )
+            await context.bot.restrict_chat_member(
+                chat_id=group_id,
+                user_id=user.id,
+                permissions=restrict_permissions,
+                until_date=int(time.time()) + verdict.restrict_seconds
+            )
+            logger.info("Пользователь ID=%s ограничен на %s секунд в группе ID=%s.", user.id, verdict.restrict_seconds, group_id)
+        except Exception as e:
+            logger.error(f"Ошибка ограничения участника ID={user.id} в группе ID={group_id}: {e}")
+
+    # Удалённое сообщение не должно учитываться антифлудом (группа обработчиков 2)
+    if deleted:
+        raise ApplicationHandlerStop
+
+# Проверка сообщений в группе на флуд и спам
+async def check_group_flood(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    message = update.effective_message
+    user = update.effective_user
+    if message is None or user is None or admin_registry.is_admin(user.id, message.chat.id):
+        return
+
+    content = message.text or message.caption
+    if content is None and message.sticker is not None:
+        content = message.sticker.file_unique_id
+    entities = (*message.entities, *message.caption_entities)
+    has_link = any(entity.type in ('url', 'text_link') for entity in entities)
+
+    group_id = message.chat.id
+    result = flood_detector.check(group_id, user.id, content, has_link)
+    if result is None:
+        return
+
+    action, reason = result
+    logger.info("Флуд от пользователя ID=%s в группе ID=%s (%s): действие %s.", user.id, group_id, reason, action,
+                extra={'event': 'flood_violation'})
+
+    try:
+        await message.delete()
+    except Exception as e:
+        logger.error(f"Ошибка удаления сообщения ID={message.message_id} в группе ID={group_id}: {e}")
+
+    try:
+        if action == FLOOD_ACTION_BAN:
+            await context.bot.ban_chat_member(
+                chat_id=group_id,
+                user_id=user.id,
+                until_date=int(time.time()) + FLOOD_BAN_SECONDS
+            )
+            flood_detector.forget(group_id, user.id)
+            logger.info("Пользователь ID=%s забанен за флуд на %s секунд в группе ID=%s.", user.id, FLOOD_BAN_SECONDS, group_id)
+        else:
+            restrict_permissions = ChatPermissions(
+                can_send_messages=False,
+                can_send_polls=False,
+                can_add_web_page_previews=False
+            )
+            await context.bot.restrict_chat_member(
+                chat_id=group_id,
+                user_id=user.id,
+                permissions=restrict_permissions,
+                until_date=int(time.time()) + FLOOD_RESTRICT_SECONDS
+            )
+            logger.info("Пользователь ID=%s ограничен за флуд на %s секунд в группе ID=%s.", user.id, FLOOD_RESTRICT_SECONDS, group_id)
+    except Exception as e:
+        logger.error(f"Ошибка применения меры за флуд к пользователю ID={user.id} в группе ID={group_id}: {e}")
+
+# Обработчик команды /modstats: счётчики срабатываний правил модерации
+async def moderation_stats_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    chat_id = update.effective_chat.id
+
+    if chat_id != user_id:
+        await update.message.reply_text("Эту команду можно использовать только в личных сообщениях боту.")
+        logger.warning(f"Пользователь ID={user_id} попытался использовать /modstats в чате ID={chat_id}.")
+        return
+    # Команда затрагивает весь процесс (все группы), поэтому доступна только администраторам из ADMIN_IDS
+    if not admin_registry.is_global_admin(user_id):
+        await update.message.reply_text("У вас нет прав для выполнения этой команды. Она доступна только администраторам бота.")
+        logger.warning(f"Пользователь ID={user_id} попытался использовать /modstats без прав.")
+        return
+
+    stats = moderation_engine.stats()
+    lines = [f"Проверено сообщений: {stats['checked']}"]
+    for rule_id, hits in stats['hits'].items():
+        lines.append(f"• {rule_id}: {hits}")
+    lines.append(f"Флуд (отслеживается пользователей: {len(flood_detector)}):")
+    for reason, count in flood_detector.violations.items():
+        lines.append(f"• {reason}: {count}")
+    await update.message.reply_text("\n".join(lines))
+
+# Обработчик команды /stats: распределения анкет и воронка регистрации
+async def stats_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    chat_id = update.effective_chat.id
+
+    if chat_id != user_id:
+        await update.message.reply_text("Эту команду можно использовать только в личных сообщениях боту.")
+        logger.warning(f"Пользователь ID={user_id} попытался использовать /stats в чате ID={chat_id}.")
+        return
+    if not admin_registry.is_admin(user_id):
+        await update.message.reply_text("У вас нет прав для выполнения этой команды.")
+        logger.warning(f"Пользователь ID={user_id} попытался использовать /stats без прав.")
+        return
+
+    if context.args and not context.args[0].lstrip('-').isdigit():
+        await update.message.reply_text("Использование: /stats [ID группы]")
+        return
+    # Сводка — сумма по группам: пользователь из нескольких групп учитывается в каждой
+    registration_stats, scope = group_registry.stats, "сумма по всем группам"
+    unique_users = None
+    # Администратор группы видит свои группы; сводка по всем группам — для глобальных администраторов
+    if context.args or not admin_registry.is_global_admin(user_id):
+        group_id, error = resolve_admin_group(user_id, int(context.args[0]) if context.args else None)
+        if error:
+            await update.message.reply_text(error)
+            return
+        registration_stats, scope = group_registry.ensure(group_id).stats, f"группа {group_title(group_id)}"
+    else:
+        unique_users = group_registry.unique_registered_count()
+
+    titles = {'car_type': 'Модели автомобилей', 'city': 'Города', 'year': 'Годы выпуска'}
+    lines = [f"<b>Анкет ({html.escape(scope)}):</b> {registration_stats.total}"]
+    if unique_users is not None:
+        lines.append(f"<b>Разных пользователей:</b> {unique_users}")
+    for field in STATS_FIELDS:
+        lines.append(f"\n<b>{titles[field]}</b> (всего вариантов: {registration_stats.distinct(field)}):")
+        for label, count in registration_stats.top(field, STATS_TOP_N):
+            lines.append(f"• {html.escape(label)}: {count}")
+
+    # Воронка и задержки общие для всех групп — их видят только администраторы бота
+    if admin_registry.is_global_admin(user_id):
+        lines.append("\n<b>Воронка регистрации</b> (все группы, с момента запуска):")
+        for step, count, share in registration_funnel.conversion():
+            share_text = f" ({share:.0%})" if share is not None else ""
+            lines.append(f"• {step}: {count}{share_text}")
+        for outcome in FUNNEL_OUTCOMES:
+            lines.append(f"• {outcome}: {registration_funnel.counts[outcome]}")
+        if unmute_latencies:
+            latencies = sorted(unmute_latencies)
+            p50 = latencies[len(latencies) // 2] * 1000
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000
+            lines.append(f"\n<b>Снятие ограничений после регистрации:</b> p50 {p50:.0f} мс, p95 {p95:.0f} мс")
+    await update.message.reply_text("\n".join(lines), parse_mode='HTML')
+
+# Обработчик команды /loglevel: просмотр и изменение уровней логирования без перезапуска
+async def log_level_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    chat_id = update.effective_chat.id
+
+    if chat_id != user_id:
+        await update.message.reply_text("Эту команду можно использовать только в личных сообщениях боту.")
+        logger.warning(f"Пользователь ID={user_id} попытался использовать /loglevel в чате ID={chat_id}.")
+        return
+    # Команда затрагивает весь процесс (все группы), поэтому доступна только администраторам из ADMIN_IDS
+    if not admin_registry.is_global_admin(user_id):
+        await update.message.reply_text("У вас нет прав для выполнения этой команды. Она доступна только администраторам бота.")
+        logger.warning(f"Пользователь ID={user_id} попытался использовать /loglevel без прав.")
+        return
+
+    if len(context.args) == 2:
+        name, level = context.args
+        try:
+            set_level('' if name == 'root' else name, level)
+        except ValueError as e:
+            await update.message.reply_text(str(e))
+            return
+        logger.warning(f"Администратор ID={user_id} установил уровень логирования {level.upper()} для '{name}'.")
+    elif context.args:
+        await update.message.reply_text("Использование: /loglevel [подсистема уровень], например /loglevel ratelimit DEBUG")
+        return
+
+    lines = ["<b>Уровни логирования:</b>"]
+    for name, level in current_levels().items():
+        lines.append(f"• {html.escape(name)}: {level}")
+    await update.message.reply_text("\n".join(lines), parse_mode='HTML')
+
+# Обработчик команды /reload_config: принудительная перезагрузка конфигурации и её состояние
+async def reload_config_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    chat_id = update.effective_chat.id
+
+    if chat_id != user_id:
+        await update.message.reply_text("Эту команду можно использовать только в личных сообщениях боту.")
+        logger.warning(f"Пользователь ID={user_id} попытался использовать /reload_config в чате ID={chat_id}.")
+        return
+    # Команда затрагивает весь процесс (все группы), поэтому доступна только администраторам из ADMIN_IDS
+    if not admin_registry.is_global_admin(user_id):
+        await update.message.reply_text("У вас нет прав для выполнения этой команды. Она доступна только администраторам бота.")
+        logger.warning(f"Пользователь ID={user_id} попытался использовать /reload_config без прав.")
+        return
+
+    applied = await config_reloader.reload(force=True)
+    stats = config_reloader.stats()
+    loaded_at = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(stats['loaded_at']))
+    lines = [
+        "<b>Конфигурация перезагружена.</b>" if applied else "<b>Конфигурация не изменена.</b>",
+        f"Файл: {html.escape(stats['path'])}",
+        f"Загружена: {loaded_at}",
+        f"Перезагрузок: {stats['reloads']}, ошибок: {stats['failures']}",
+        f"Срок регистрации: {bot_config.registration_timeout} с, бан: {bot_config.ban_duration} с (по умолчанию)",
+        f"Групп с собственными настройками: {len(bot_config.groups)}, обслуживается групп: {len(admin_registry.group_ids)}",
+    ]
+    if stats['last_error']:
+        lines.append(f"Последняя ошибка: {html.escape(stats['last_error'])}")
+    await update.message.reply_text("\n".join(lines), parse_mode='HTML')
+
+# Функция для завершения профилирования и отправки результата администратору
+async def finish_profile(bot, user_id, seconds):
+    await asyncio.sleep(seconds)
+    sampling_profiler.stop()
+    samples = sum(sampling_profiler.samples.values())
+    # Задача фоновая: ошибку отправки никто не дождётся, поэтому она только логируется
+    try:
+        if not samples:
+            await bot.send_message(chat_id=user_id, text="Профилирование завершено, но стеки не собраны.")
+            return
+        top = "\n".join(
+            f"{share:.0%} {html.escape(label)}" for label, share in sampling_profiler.top_functions(5)
+        )
+        profile = io.BytesIO(sampling_profiler.collapsed().encode('utf-8'))
+        await bot.send_document(
+            chat_id=user_id,
+            document=InputFile(profile, filename=f"profile_{time.strftime('%Y%m%d_%H%M%S')}.folded"),
+            caption=f"Профиль за {sampling_profiler.duration:.0f} с, {samples} стеков "
+                    f"(flamegraph.pl или speedscope.app).\n\nЧаще всего на вершине стека:\n{top}"[:1024]
+        )
+        logger.info(f"Профиль ({samples} стеков) отправлен администратору ID={user_id}.")
+    except Exception as e:
+        logger.error(f"Ошибка отправки профиля администратору ID={user_id}: {e}")
+
+# Обработчик команды /profile: сэмплирующее профилирование на N секунд
+async def profile_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    chat_id = update.effective_chat.id
+
+    if chat_id != user_id:
+        await update.message.reply_text("Эту команду можно использовать только в личных сообщениях боту.")
+        logger.warning(f"Пользователь ID={user_id} попытался использовать /profile в чате ID={chat_id}.")
+        return
+    # Профиль и трассы содержат данные всех групп
+    if not admin_registry.is_global_admin(user_id):
+        await update.message.reply_text("У вас нет прав для выполнения этой команды. Она доступна только администраторам бота.")
+        logger.warning(f"Пользователь ID={user_id} попытался использовать /profile без прав.")
+        return
+
+    seconds = DEFAULT_PROFILE_SECONDS
+    if context.args:
+        if not context.args[0].isdigit() or not 1 <= int(context.args[0]) <= MAX_PROFILE_SECONDS:
+            await update.message.reply_text(f"Использование: /profile [секунды от 1 до {MAX_PROFILE_SECONDS}]")
+            return
+        seconds = int(context.args[0])
+    if sampling_profiler.running:
+        await update.message.reply_text("Профилирование уже выполняется, дождитесь результата.")
+        return
+
+    # Обработчик выполняется в потоке цикла событий — его и профилируем
+    sampling_profiler.start()
+    context.application.create_task(finish_profile(context.bot, user_id, seconds))
+    logger.warning(f"Администратор ID={user_id} запустил профилирование на {seconds} с.")
+    await update.message.reply_text(f"Профилирование запущено на {seconds} с. Результат придёт файлом.")
+
+# Обработчик команды /trace: трассировка медленных обновлений
+async def trace_updates_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    chat_id = update.effective_chat.id
+
+    if chat_id != user_id:
+        await update.message.reply_text("Эту команду можно использовать только в личных сообщениях боту.")
+        logger.warning(f"Пользователь ID={user_id} попытался использовать /trace в чате ID={chat_id}.")
+        return
+    # Профиль и трассы содержат данные всех групп
+    if not admin_registry.is_global_admin(user_id):
+        await update.message.reply_text("У вас нет прав для выполнения этой команды. Она доступна только администраторам бота.")
+        logger.warning(f"Пользователь ID={user_id} попытался использовать /trace без прав.")
+        return
+
+    usage = "Использование: /trace on [порог_мс [блокировка_мс]] | off | clear, без аргументов — отчёт"
+    action = context.args[0].lower() if context.args else None
+    if action == 'on':
+        limits = context.args[1:3]
+        if not all(value.isdigit() and int(value) > 0 for value in limits):
+            await update.message.reply_text(usage)
+            return
+        thresholds = [int(value) / 1000 for value in limits] + [None, None]
+        update_tracer.enable(asyncio.get_running_loop(), thresholds[0], thresholds[1])
+        logger.warning(f"Администратор ID={user_id} включил трассировку медленных обновлений.")
+        await update.message.reply_text(
+            f"Трассировка включена: обновления дольше {update_tracer.threshold * 1000:.0f} мс, "
+            f"блокировки цикла дольше {update_tracer.block_threshold * 1000:.0f} мс. "
+            f"Хранятся {update_tracer.keep} самых медленных."
+        )
+        return
+    if action == 'off':
+        update_tracer.disable()
+        logger.warning(f"Администратор ID={user_id} выключил трассировку медленных обновлений.")
+        await update.message.reply_text("Трассировка выключена, собранные трассы сохранены (/trace — отчёт).")
+        return
+    if action == 'clear':
+        update_tracer.clear()
+        await update.message.reply_text("Собранные трассы удалены.")
+        return
+    if action is not None:
+        await update.message.reply_text(usage)
+        return
+
+    if not update_tracer.slowest() and not update_tracer.recent_blocks:
+        await update.message.reply_text(update_tracer.report().strip())
+        return
+    report = io.BytesIO(update_tracer.report().encode('utf-8'))
+    await context.bot.send_document(
+        chat_id=user_id,
+        document=InputFile(report, filename=f"slow_updates_{time.strftime('%Y%m%d_%H%M%S')}.txt"),
+        caption=f"Медленные обновления: {update_tracer.slow} из {update_tracer.traced}"
+    )
+
+# Обработчик команды /memstats: размеры структур в памяти
+async def memory_stats_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    chat_id = update.effective_chat.id
+
+    if chat_id != user_id:
+        await update.message.reply_text("Эту команду можно использовать только в личных сообщениях боту.")
+        logger.warning(f"Пользователь ID={user_id} попытался использовать /memstats в чате ID={chat_id}.")
+        return
+    # Команда затрагивает весь процесс (все группы), поэтому доступна только администраторам из ADMIN_IDS
+    if not admin_registry.is_global_admin(user_id):
+        await update.message.reply_text("У вас нет прав для выполнения этой команды. Она доступна только администраторам бота.")
+        logger.warning(f"Пользователь ID={user_id} попытался использовать /memstats без прав.")
+        return
+
+    # Пулы задач групп ссылаются на цикл событий, поэтому измеряются только словари и множества
+    structures = (
+        ('registered_users', group_registry.registered_count, [state.registered for state in group_registry]),
+        ('user_messages', len(user_messages), user_messages),
+        ('pending_users', group_registry.pending_count, [state.pending for state in group_registry]),
+        ('registration_deadlines', len(registration_deadlines), registration_deadlines),
+        ('profile_cache', len(profile_cache), profile_cache),
+        ('flood_detector', len(flood_detector), flood_detector),
+    )
+    lines = [f"<b>Память</b> (групп: {len(group_registry)}):"]
+    for title, count, container in structures:
+        size_kb = deep_sizeof(container) / 1024
+        lines.append(f"• {title}: {count} записей, {size_kb:.1f} КБ")
+    lines.append(f"• отслеживаемых сообщений: {user_messages.message_count}, вытеснено: {user_messages.evicted}")
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+        lines.append(f"• RSS процесса: {resident_pages * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024:.1f} МБ")
+    except (OSError, ValueError):
+        pass
+    await update.message.reply_text("\n".join(lines), parse_mode='HTML')
+
 # Обработка ошибок
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.error(msg="Exception while handling an update:", exc_info=context.error)
 
-# Функция для сохранения данных о зарегистрированных пользователях в JSON
-def save_registered_users():
+# Функция для сохранения анкеты одного пользователя группы в хранилище
+async def save_registered_user(group_id, user_id):
+    try:
+        await user_store.upsert(group_id, user_id, group_registry.record(group_id, user_id).to_dict())
+        logger.info("Данные пользователя ID=%s группы ID=%s сохранены в хранилище.", user_id, group_id)
+    except Exception as e:
+        logger.error(f"Ошибка сохранения пользователя ID={user_id} группы ID={group_id}: {e}")
+
+# Функция для удаления анкеты одного пользователя группы из хранилища
+async def delete_registered_user(group_id, user_id):
+    try:
+        await user_store.delete(group_id, user_id)
+        logger.info("Пользователь ID=%s группы ID=%s удалён из хранилища.", user_id, group_id)
+    except Exception as e:
+        logger.error(f"Ошибка удаления пользователя ID={user_id} группы ID={group_id} из хранилища: {e}")
+
+# Функция для загрузки данных о зарегистрированных пользователях из хранилища
+async def load_registered_users():
     try:
-        with open('registered_users.json', 'w', encoding='utf-8') as f:
-            json.dump({str(k): v for k, v in registered_users.items()}, f, ensure_ascii=False, indent=4)
-        logger.info("Данные зарегистрированных пользователей сохранены.")
+        await user_store.migrate_from_json(REGISTERED_USERS_JSON, LEGACY_GROUP_ID)
+        group_registry.load({
+            key: UserRecord.from_dict(data) for key, data in (await user_store.load_all()).items()
+        })
+        logger.info(
+            f"Данные зарегистрированных пользователей загружены: {group_registry.registered_count} "
+            f"в {len(group_registry)} группах."
+        )
     except Exception as e:
-        logger.error(f"Ошибка сохранения зарегистрированных пользователей: {e}")
+        logger.error(f"Ошибка загрузки зарегистрированных пользователей: {e}")
+        group_registry.load({})
+
+# Функция для восстановления ожидающих пользователей и сроков их регистрации после перезапуска
+async def restore_pending_state(application):
+    stored_messages = await state_persistence.load_messages()
+    user_messages.restore(stored_messages)
+    for group_id, user_id in user_messages.evict_expired():
+        state_persistence.drop_messages(group_id, user_id)
+
+    stored_pending = await state_persistence.load_pending()
+    now = time.time()
+    overdue = 0
+    for (group_id, user_id), deadline in stored_pending.items():
+        group_registry.add_pending(group_id, user_id)
+        if deadline <= now:
+            overdue += 1
+        # Просроченные сроки будут обработаны при первом же проходе sweep_registration_deadlines
+        registration_deadlines.schedule(group_id, user_id, deadline)
+    logger.info(
+        f"Восстановлено состояние: ожидающих пользователей {len(stored_pending)} (просрочено {overdue}), "
+        f"отслеживаемых переписок {len(stored_messages)}."
+    )
 
-# Функция для загрузки данных о зарегистрированных пользователях из JSON
-def load_registered_users():
-    global registered_users
-    if os.path.exists('registered_users.json'):
+# Периодическое вытеснение переписок, сообщения которых уже нельзя удалить
+async def evict_tracked_messages(context: ContextTypes.DEFAULT_TYPE):
+    evicted = user_messages.evict_expired()
+    for group_id, user_id in evicted:
+        state_persistence.drop_messages(group_id, user_id)
+    if evicted:
+        logger.info(f"Вытеснено устаревших переписок: {len(evicted)}.")
+
+# Периодическая сверка зарегистрированных и ожидающих пользователей с составом групп
+async def reconcile_membership_job(context: ContextTypes.DEFAULT_TYPE):
+    # Группы сверяются по очереди, у каждой свой курсор продолжения
+    for group_id in group_registry.group_ids():
         try:
-            with open('registered_users.json', 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                # Преобразуем ключи обратно в int
-                registered_users = {int(k): v for k, v in data.items()}
-            logger.info("Данные зарегистрированных пользователей загружены.")
-        except json.JSONDecodeError:
-            logger.error("Ошибка декодирования JSON-файла с зарегистрированными пользователями.")
-            registered_users = {}
+            await reconcile_pending_users(context, group_id)
         except Exception as e:
-            logger.error(f"Ошибка загрузки зарегистрированных пользователей: {e}")
-            registered_users = {}
-    else:
-        registered_users = {}
-        logger.info("JSON-файл с зарегистрированными пользователями не найден. Создаётся новый.")
+            logger.error(f"Ошибка сверки ожидающих регистрации в группе ID={group_id}: {e}")
+        try:
+            departed = await membership_reconciler.run(context.bot, group_id)
+        except Exception as e:
+            logger.error(f"Ошибка сверки участников группы ID={group_id}: {e}")
+            continue
+        removed = 0
+        for user_id, checked_at in departed:
+            # Анкета, заполненная заново во время проверки, остаётся: её сохранение вернёт строку в хранилище
+            if group_registry.unregister_if_older(group_id, user_id, checked_at) is None:
+                continue
+            removed += 1
+            profile_cache.discard(user_id)
+            await delete_user_messages(group_id, user_id, context)
+        if removed:
+            logger.info(f"Удалены ушедшие из группы ID={group_id} пользователи: {removed}.")
+
+# Сверка ожидающих регистрации: ушедшие удаляются, потерявшие срок бана снова ставятся в очередь
+async def reconcile_pending_users(context: ContextTypes.DEFAULT_TYPE, group_id):
+    state = group_registry.get(group_id)
+    if state is None or not state.pending:
+        return
+    departed = await membership_reconciler.check_pending(context.bot, group_id, list(state.pending))
+    for user_id in departed:
+        if group_registry.discard_pending(group_id, user_id):
+            state_persistence.drop_pending(group_id, user_id)
+            registration_deadlines.cancel(group_id, user_id)
+            registration_funnel.step('left')
+            await delete_user_messages(group_id, user_id, context)
+
+    # Во время прохода по истёкшим срокам сроки уже извлечены из очереди — пропускаем до следующей сверки
+    if sweep_task is not None and not sweep_task.done():
+        return
+    requeued = 0
+    timeout = bot_config.group(group_id).registration_timeout
+    for user_id in list(state.pending):
+        if registration_deadlines.deadline_of(group_id, user_id) is None:
+            deadline = time.time() + timeout
+            registration_deadlines.schedule(group_id, user_id, deadline)
+            state_persistence.save_pending(group_id, user_id, deadline)
+            requeued += 1
+    if departed or requeued:
+        logger.warning(
+            f"Сверка ожидающих регистрации в группе ID={group_id}: ушли {len(departed)}, "
+            f"снова поставлены в очередь без срока {requeued}."
+        )
 
-def main():
-    load_registered_users()  # Загрузка данных о зарегистрированных пользователях
+# Периодическое страховочное обновление списка администраторов группы
+async def refresh_admins_job(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        await admin_registry.refresh(context.bot)
+    except Exception as e:
+        logger.error(f"Ошибка обновления списка администраторов: {e}")
+
+# Инициализация перед запуском бота: открываем хранилище и загружаем данные
+async def post_init(application):
+    await user_store.open()
+    await load_registered_users()  # Загрузка данных о зарегистрированных пользователях
+    await restore_pending_state(application)
+    config_reloader.start(asyncio.get_running_loop())
+    update_queue_depth.function = application.update_queue.qsize
+    lane_queue_depth.function = lambda: application.lane_scheduler.queued
+    if METRICS_PORT:
+        try:
+            await metrics_server.start()
+        except OSError as e:
+            logger.error(f"Не удалось запустить сервер метрик на порту {METRICS_PORT}: {e}")
+    application.job_queue.run_repeating(
+        sweep_registration_deadlines,
+        interval=DEADLINE_SWEEP_INTERVAL,
+        first=0,
+        name="sweep_registration_deadlines"
+    )
+    application.job_queue.run_repeating(
+        refresh_admins_job,
+        interval=ADMIN_REFRESH_INTERVAL,
+        first=0,
+        name="refresh_admins"
+    )
+    application.job_queue.run_repeating(
+        reconcile_membership_job,
+        interval=RECONCILE_INTERVAL,
+        first=60,
+        name="reconcile_membership"
+    )
+    application.job_queue.run_repeating(
+        evict_tracked_messages,
+        interval=TRACKED_MESSAGES_EVICT_INTERVAL,
+        first=TRACKED_MESSAGES_EVICT_INTERVAL,
+        name="evict_tracked_messages"
+    )
 
+# Освобождение ресурсов после остановки бота
+async def post_shutdown(application):
+    await config_reloader.stop()
+    update_tracer.disable()
+    sampling_profiler.stop()
+    await metrics_server.stop()
+    await user_store.close()
+
+# Функция для создания ConversationHandler регистрации
+def build_registration_handler(persistent: bool = True) -> ConversationHandler:
+    """persistent=False — для запуска без персистентности (например, в бенчмарках)."""
+    return ConversationHandler(
+        entry_points=[CommandHandler('start', start)],
+        states={
+            NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, name_handler)],
+            CITY: [MessageHandler(filters.TEXT & ~filters.COMMAND, city_handler)],
+            CAR_TYPE: [MessageHandler(filters.TEXT & ~filters.COMMAND, car_type_handler)],
+            YEAR: [MessageHandler(filters.TEXT & ~filters.COMMAND, year_handler)],
+            PURPOSE: [MessageHandler(filters.TEXT & ~filters.COMMAND, purpose_handler)],
+        },
+        fallbacks=[CommandHandler('cancel', cancel)],
+        name='registration',
+        persistent=persistent
+    )
+
+def main():
     BOT_TOKEN = os.getenv('BOT_TOKEN')  # Использование переменной окружения для токена
 
     if not BOT_TOKEN:
         logger.critical("Токен бота не установлен. Установите переменную окружения BOT_TOKEN.")
         return
 
+    if BOT_MODE not in ('polling', 'webhook'):
+        logger.critical(f"Неизвестный режим BOT_MODE={BOT_MODE}. Допустимые значения: polling, webhook.")
+        return
+    if BOT_MODE == 'webhook' and not WEBHOOK_URL:
+        logger.critical("Для режима webhook установите переменную окружения WEBHOOK_URL.")
+        return
+
     # Создаём приложение
-    application = ApplicationBuilder().token(BOT_TOKEN).build()
+    builder = (
+        ApplicationBuilder()
+        .application_class(LaneApplication)
+        .concurrent_updates(LaneUpdateProcessor(UPDATE_CONCURRENCY, update_group, GROUP_UPDATE_CONCURRENCY))
+        .token(BOT_TOKEN)
+        .persistence(state_persistence)
+        .rate_limiter(api_rate_limiter)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if BOT_API_BASE_URL:
+        builder = builder.base_url(f"{BOT_API_BASE_URL}/bot").base_file_url(f"{BOT_API_BASE_URL}/file/bot")
+        logger.info(f"Используется сервер Bot API {BOT_API_BASE_URL}")
+    if BOT_MODE == 'webhook':
+        # Обновления приходят во встроенный HTTP-сервер, Updater для long polling не нужен
+        builder = builder.updater(None)
+    application = builder.build()
 
     # Обработчик новых и покидающих участников (ChatMemberHandler)
     application.add_handler(ChatMemberHandler(monitor_new_members, ChatMemberHandler.CHAT_MEMBER))
@@ -607,30 +1560,65 @@ def main():
     application.add_handler(left_member_handler)
 
     # Обработчики команд регистрации (ConversationHandler)
-    conv_handler = ConversationHandler(
-        entry_points=[CommandHandler('start', start)],
-        states={
-            NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, name_handler)],
-            CITY: [MessageHandler(filters.TEXT & ~filters.COMMAND, city_handler)],
-            CAR_TYPE: [MessageHandler(filters.TEXT & ~filters.COMMAND, car_type_handler)],
-            YEAR: [MessageHandler(filters.TEXT & ~filters.COMMAND, year_handler)],
-            PURPOSE: [MessageHandler(filters.TEXT & ~filters.COMMAND, purpose_handler)],
-        },
-        fallbacks=[CommandHandler('cancel', cancel)]
-    )
+    conv_handler = build_registration_handler()
 
     application.add_handler(conv_handler)
 
     # Обработчик команды /list_users для администраторов
     list_users_command = CommandHandler('list_users', list_users_handler)
     application.add_handler(list_users_command)
+    application.add_handler(CallbackQueryHandler(list_users_page_callback, pattern=r'^list_users:'))
+    application.add_handler(CommandHandler('export_users', export_users_handler))
+
+    # Модерация сообщений в группе (отдельная группа обработчиков, не мешает регистрации)
+    application.add_handler(
+        MessageHandler(filters.ChatType.GROUPS & filters.TEXT & ~filters.COMMAND, moderate_group_message),
+        group=1
+    )
+    application.add_handler(
+        MessageHandler(filters.ChatType.GROUPS & ~filters.COMMAND & ~filters.StatusUpdate.ALL, check_group_flood),
+        group=2
+    )
+    application.add_handler(CommandHandler('modstats', moderation_stats_handler))
+    application.add_handler(CommandHandler('memstats', memory_stats_handler))
+    application.add_handler(CommandHandler('stats', stats_handler))
+    application.add_handler(CommandHandler('loglevel', log_level_handler))
+    application.add_handler(CommandHandler('reload_config', reload_config_handler))
+    application.add_handler(CommandHandler('profile', profile_handler))
+    application.add_handler(CommandHandler('trace', trace_updates_handler))
 
     # Обработчик ошибок
     application.add_error_handler(error_handler)
 
+    # Контекст обновления (user_id, group_id, обработчик) для всех записей журнала
+    # и цепочка обработчиков в трассе обновления (/trace)
+    application.update_tracer = update_tracer
+    for group_handlers in application.handlers.values():
+        for handler in iter_handlers(group_handlers):
+            handler.callback = with_log_context(trace_handler(handler.callback))
+
+    # Замер длительности всех обработчиков без изменения их кода
+    instrumented = instrument_application(application, handler_latency, handler_errors)
+    logger.debug("Подключены метрики для %s обработчиков.", instrumented)
+
     # Запуск бота
-    logger.info("Запуск бота...")
-    application.run_polling()
+    logger.info(f"Запуск бота в режиме {BOT_MODE}...")
+    if BOT_MODE == 'webhook':
+        server = WebhookServer(
+            application,
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            path=WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS
+        )
+        run_webhook(application, server, WEBHOOK_URL)
+    else:
+        application.run_polling()
 
 if __name__ == '__main__':
-    main()
+    try:
+        main()
+    finally:
+        # Дописываем оставшиеся в очереди записи журнала
+        shutdown_logging()
@@ -0,0 +1,274 @@
+import hashlib
+import logging
+import os
+import pickle
+import re
+import unicodedata
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# Файлы данных: запрещённые города и города, которые всегда разрешены
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+BLOCKED_CITIES_PATH = os.path.join(DATA_DIR, 'cities_ru.txt')
+ALLOWED_CITIES_PATH = os.path.join(DATA_DIR, 'cities_allowed.txt')
+# Скомпилированный снимок индекса (пересобирается при изменении файлов данных)
+SNAPSHOT_PATH = os.path.join(DATA_DIR, 'cities.idx')
+SNAPSHOT_VERSION = 2
+
+BLOCKED = 'blocked'
+ALLOWED = 'allowed'
+
+# Кириллица (русская и украинская) -> латиница, упрощённая схема для сравнения написаний
+_CYRILLIC_TO_LATIN = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'ґ': 'g', 'д': 'd', 'е': 'e', 'є': 'e',
+    'ж': 'zh', 'з': 'z', 'и': 'i', 'і': 'i', 'ї': 'i', 'й': 'i', 'к': 'k', 'л': 'l',
+    'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
+    'ф': 'f', 'х': 'h', 'ц': 'c', 'ч': 'ch', 'ш': 'sh', 'щ': 'sh', 'ъ': '', 'ы': 'i',
+    'ь': '', 'э': 'e', 'ю': 'u', 'я': 'a',
+}
+_TRANSLIT_TABLE = str.maketrans(_CYRILLIC_TO_LATIN)
+
+# Латинские сочетания, приводимые к той же схеме (порядок важен: длинные раньше)
+_LATIN_RULES = (
+    ('shch', 'sh'), ('sch', 'sh'), ('kh', 'h'), ('ts', 'c'), ('tz', 'c'),
+    ('yu', 'u'), ('ju', 'u'), ('ya', 'a'), ('ja', 'a'), ('ye', 'e'), ('yo', 'e'), ('jo', 'e'),
+    ('y', 'i'), ('j', 'i'), ('w', 'v'), ('x', 'ks'), ('ck', 'k'), ('q', 'k'),
+)
+
+# Слова-приставки перед названием: "г. Москва", "город Москва", "м. Київ"
+_PREFIX_WORDS = {'г', 'гор', 'город', 'м', 'місто', 'city', 'town', 'пгт', 'смт', 'с', 'село'}
+_NON_WORD = re.compile(r"[^\w]+")
+
+
+# Функция для нормализации текста: Unicode NFKC, casefold, без пунктуации и приставок
+def normalize_words(text: str) -> list:
+    text = unicodedata.normalize('NFKC', text).casefold().replace('ё', 'е')
+    words = [word for word in _NON_WORD.split(text) if word]
+    while words and words[0] in _PREFIX_WORDS:
+        words = words[1:]
+    return words
+
+
+# Функция для построения ключа сравнения: транслитерация и склейка слов
+def translit_key(words) -> str:
+    key = ''.join(words).translate(_TRANSLIT_TABLE)
+    for source, target in _LATIN_RULES:
+        key = key.replace(source, target)
+    return key
+
+
+# Расстояние Левенштейна с ранним выходом при превышении limit
+def levenshtein(a: str, b: str, limit: int) -> int:
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        row_min = i
+        for j, char_b in enumerate(b, 1):
+            value = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b)
+            )
+            current.append(value)
+            if value < row_min:
+                row_min = value
+        if row_min > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+# Допустимое расстояние редактирования в зависимости от длины ключа
+def max_distance(key: str) -> int:
+    if len(key) <= 4:
+        return 0
+    if len(key) <= 8:
+        return 1
+    return 2
+
+
+# Функция для получения множества триграмм ключа (с дополнением по краям)
+def trigrams(key: str) -> set:
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+# Триграммный индекс для поиска ключей в пределах расстояния редактирования
+class TrigramIndex:
+    """
+    Инвертированный индекс триграмма -> ключи. Кандидаты отбираются по числу
+    общих триграмм (одна правка меняет не более трёх триграмм), затем
+    проверяются расстоянием Левенштейна с ранним выходом.
+    """
+    __slots__ = ('postings', 'gram_counts')
+
+    def __init__(self):
+        self.postings = {}     # триграмма -> список ключей
+        self.gram_counts = {}  # ключ -> число его триграмм
+
+    def add(self, key: str):
+        if key in self.gram_counts:
+            return
+        grams = trigrams(key)
+        self.gram_counts[key] = len(grams)
+        for gram in grams:
+            self.postings.setdefault(gram, []).append(key)
+
+    def search(self, key: str, limit: int) -> list:
+        """Возвращает [(расстояние, ключ), ...] в пределах limit."""
+        grams = trigrams(key)
+        shared = {}
+        for gram in grams:
+            for candidate in self.postings.get(gram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+        found = []
+        for candidate, common in shared.items():
+            # Лемма о q-граммах: при расстоянии <= limit общих триграмм не меньше этого порога
+            if common < max(len(grams), self.gram_counts[candidate]) - 3 * limit:
+                continue
+            distance = levenshtein(key, candidate, limit)
+            if distance <= limit:
+                found.append((distance, candidate))
+        return found
+
+
+# Индекс городов с нормализацией, транслитерацией и нечётким поиском
+class CityIndex:
+    """
+    Ключ города — транслитерированная склейка нормализованных слов, поэтому
+    "Москва", "Moskva", "г. Москва" и украинские написания совпадают точно (O(1)).
+    Опечатки находятся через триграммный индекс в пределах max_distance().
+    Разрешённые города имеют приоритет над запрещёнными при равном расстоянии.
+    """
+
+    def __init__(self):
+        self.keys = {}  # ключ -> (каноническое название, категория)
+        self.grams = TrigramIndex()
+        self.source_hash = None
+        self._lookup = lru_cache(maxsize=4096)(self._lookup_uncached)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __getstate__(self):
+        return {'keys': self.keys, 'grams': self.grams, 'source_hash': self.source_hash}
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.keys = state['keys']
+        self.grams = state['grams']
+        self.source_hash = state['source_hash']
+
+    def add(self, name: str, category: str, aliases=()):
+        for variant in (name, *aliases):
+            key = translit_key(normalize_words(variant))
+            if not key:
+                continue
+            existing = self.keys.get(key)
+            # Разрешённое написание не перезаписывается запрещённым
+            if existing is not None and existing[1] == ALLOWED and category == BLOCKED:
+                continue
+            self.keys[key] = (name, category)
+            self.grams.add(key)
+
+    def _match_key(self, key: str):
+        exact = self.keys.get(key)
+        if exact is not None:
+            return exact
+        limit = max_distance(key)
+        if limit == 0:
+            return None
+        candidates = self.grams.search(key, limit)
+        if not candidates:
+            return None
+        candidates.sort(key=lambda item: (item[0], self.keys[item[1]][1] != ALLOWED))
+        return self.keys[candidates[0][1]]
+
+    def _lookup_uncached(self, text: str):
+        words = normalize_words(text)
+        if not words:
+            return None
+        # 1. Вся строка целиком ("Ростов-на-Дону", "Kryvyi Rih")
+        match = self._match_key(translit_key(words))
+        if match is not None:
+            return match
+        # 2. Фрагменты из 1–3 слов ("Москва, Россия", "живу в Питере")
+        for size in (3, 2, 1):
+            for start in range(len(words) - size + 1):
+                match = self._match_key(translit_key(words[start:start + size]))
+                if match is not None and match[1] == BLOCKED:
+                    return match
+        return None
+
+    def lookup(self, text: str):
+        """Возвращает (каноническое название, категория) или None."""
+        return self._lookup(text)
+
+    def is_blocked(self, text: str) -> bool:
+        match = self._lookup(text)
+        return match is not None and match[1] == BLOCKED
+
+
+# Функция для чтения файла данных: [(название, [варианты]), ...]
+def read_city_file(path: str) -> list:
+    entries = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            names = [name.strip() for name in line.split('|') if name.strip()]
+            entries.append((names[0], names[1:]))
+    return entries
+
+
+def _source_hash(paths) -> str:
+    digest = hashlib.sha256(str(SNAPSHOT_VERSION).encode())
+    for path in paths:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+# Функция для построения индекса из файлов данных
+def build_city_index(blocked_path: str = BLOCKED_CITIES_PATH,
+                     allowed_path: str = ALLOWED_CITIES_PATH) -> CityIndex:
+    index = CityIndex()
+    # Сначала разрешённые, чтобы их написания имели приоритет
+    for name, aliases in read_city_file(allowed_path):
+        index.add(name, ALLOWED, aliases)
+    for name, aliases in read_city_file(blocked_path):
+        index.add(name, BLOCKED, aliases)
+    index.source_hash = _source_hash((blocked_path, allowed_path))
+    return index
+
+
+# Функция для загрузки индекса из снимка или его построения заново
+def load_city_index(blocked_path: str = BLOCKED_CITIES_PATH,
+                    allowed_path: str = ALLOWED_CITIES_PATH,
+                    snapshot_path: str = SNAPSHOT_PATH) -> CityIndex:
+    source_hash = _source_hash((blocked_path, allowed_path))
+    if snapshot_path and os.path.exists(snapshot_path):
+        try:
+            with open(snapshot_path, 'rb') as f:
+                index = pickle.load(f)
+            if isinstance(index, CityIndex) and index.source_hash == source_hash:
+                logger.info(f"Индекс городов загружен из снимка: {len(index)} ключей.")
+                return index
+        except Exception as e:
+            logger.warning(f"Не удалось загрузить снимок индекса городов: {e}")
+
+    index = build_city_index(blocked_path, allowed_path)
+    logger.info(f"Индекс городов построен: {len(index)} ключей.")
+    if snapshot_path:
+        try:
+            tmp_path = f"{snapshot_path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, snapshot_path)
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить снимок индекса городов: {e}")
+    return index
@@ -0,0 +1,241 @@
+import asyncio
+import logging
+import time
+from array import array
+from collections import OrderedDict
+
+from telegram.error import BadRequest, InvalidToken
+
+from tasks import BoundedTaskPool
+
+logger = logging.getLogger(__name__)
+
+# Telegram позволяет боту удалять сообщения не старше 48 часов; берём запас
+DELETE_WINDOW = 48 * 3600 - 600
+# Максимум сообщений в одном вызове deleteMessages
+DELETE_BATCH_SIZE = 100
+# Максимум одновременных одиночных удалений при откате на deleteMessage
+SINGLE_DELETE_CONCURRENCY = 5
+# Максимум одновременных фоновых очисток
+CLEANUP_CONCURRENCY = 10
+# Максимум отслеживаемых сообщений одного пользователя (старые вытесняются)
+MAX_TRACKED_PER_USER = 50
+
+
+# Функция для приведения сохранённой записи к виду (message_id, sent_at)
+def normalize_entry(entry, now: float = None):
+    if isinstance(entry, (list, tuple)):
+        return int(entry[0]), float(entry[1])
+    # Старый формат без времени отправки: считаем сообщение свежим
+    return int(entry), time.time() if now is None else now
+
+
+# Движок очистки отправленных ботом сообщений
+class MessageCleaner:
+    """
+    Удаляет сообщения пачками через deleteMessages (до 100 за вызов),
+    при ошибке откатывается на одиночные deleteMessage с ограниченной параллельностью.
+    Пачки навсегда отключаются, только если сервер ответил, что метода нет,
+    а токен при этом действителен (get_me проходит).
+    Сообщения старше окна удаления пропускаются без обращения к API.
+    Очистка выполняется в фоне, вызывающий обработчик её не ждёт.
+    """
+
+    def __init__(self, window: float = DELETE_WINDOW, batch_size: int = DELETE_BATCH_SIZE,
+                 single_concurrency: int = SINGLE_DELETE_CONCURRENCY,
+                 concurrency: int = CLEANUP_CONCURRENCY):
+        self.window = window
+        self.batch_size = batch_size
+        self.single_concurrency = single_concurrency
+        self.pool = BoundedTaskPool(concurrency, name='cleanup')
+        self.batch_supported = True
+        self.deleted = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def split_expired(self, entries, now: float = None):
+        """Возвращает (message_ids, которые ещё можно удалить, число просроченных)."""
+        if now is None:
+            now = time.time()
+        deletable = []
+        expired = 0
+        for entry in entries:
+            message_id, sent_at = normalize_entry(entry, now)
+            if now - sent_at < self.window:
+                deletable.append(message_id)
+            else:
+                expired += 1
+        return deletable, expired
+
+    def schedule(self, bot, chat_id: int, entries):
+        """Запускает очистку сообщений чата в фоне."""
+        message_ids, expired = self.split_expired(entries)
+        self.skipped += expired
+        if expired:
+            logger.debug("Пропущено %s сообщений старше окна удаления в чате ID=%s.", expired, chat_id)
+        if message_ids:
+            self.pool.submit(self.delete(bot, chat_id, message_ids))
+
+    async def delete(self, bot, chat_id: int, message_ids):
+        for start in range(0, len(message_ids), self.batch_size):
+            chunk = message_ids[start:start + self.batch_size]
+            if self.batch_supported and len(chunk) > 1:
+                try:
+                    await bot.delete_messages(chat_id=chat_id, message_ids=chunk)
+                    self.deleted += len(chunk)
+                    continue
+                except (InvalidToken, BadRequest) as e:
+                    if await self._method_missing(bot, e):
+                        self.batch_supported = False
+                        logger.warning(f"deleteMessages не поддерживается сервером ({e}), переходим на deleteMessage.")
+                    else:
+                        logger.warning(f"Ошибка deleteMessages ({e}), удаляем по одному в чате ID={chat_id}.")
+                except Exception as e:
+                    logger.warning(f"deleteMessages недоступен ({e}), удаляем по одному в чате ID={chat_id}.")
+            await self._delete_single(bot, chat_id, chunk)
+        logger.info("Удалено %s сообщений в чате ID=%s.", len(message_ids), chat_id, extra={'event': 'message_deleted'})
+
+    @staticmethod
+    async def _method_missing(bot, error) -> bool:
+        """
+        True, если сервер не знает метода deleteMessages. На неизвестный метод Bot API
+        отвечает 404 «Not Found» (PTB превращает его в InvalidToken) или, на некоторых
+        локальных серверах, «method not found». Токен проверяется через get_me, чтобы
+        настоящая ошибка авторизации не отключила пакетное удаление.
+        """
+        message = str(error).lower()
+        if 'not found' not in message:
+            return False
+        if isinstance(error, BadRequest) and 'method' not in message:
+            return False  # например, «message to delete not found»
+        try:
+            await bot.get_me()
+        except Exception:
+            return False
+        return True
+
+    async def _delete_single(self, bot, chat_id: int, message_ids):
+        semaphore = asyncio.Semaphore(self.single_concurrency)
+
+        async def delete_one(message_id):
+            async with semaphore:
+                try:
+                    await bot.delete_message(chat_id=chat_id, message_id=message_id)
+                    self.deleted += 1
+                except Exception as e:
+                    self.failed += 1
+                    logger.debug("Ошибка удаления сообщения ID=%s в чате ID=%s: %s", message_id, chat_id, e)
+
+        await asyncio.gather(*(delete_one(message_id) for message_id in message_ids))
+
+
+# Отслеживаемые сообщения одного пользователя: два параллельных массива
+class _TrackedMessages:
+    __slots__ = ('message_ids', 'sent_at', 'last_sent')
+
+    def __init__(self):
+        self.message_ids = array('q')
+        self.sent_at = array('d')
+        self.last_sent = 0.0
+
+
+# Учёт отправленных ботом сообщений с ограничением по времени и количеству
+class MessageTracker:
+    """
+    Хранит (message_id, время отправки) в массивах array вместо списков кортежей.
+    На пользователя хранится не больше per_user_cap сообщений, а переписки,
+    в которых ничего не отправлялось дольше окна удаления, вытесняются целиком:
+    такие сообщения Telegram всё равно не даст удалить. Пользователи упорядочены
+    по последней отправке, поэтому вытеснение затрагивает только устаревшие записи.
+    Ключ переписки выбирает вызывающий код: бот ведёт переписки по паре
+    (group_id, user_id), чтобы выход из одной группы не трогал регистрацию в другой.
+    """
+
+    def __init__(self, ttl: float = DELETE_WINDOW, per_user_cap: int = MAX_TRACKED_PER_USER):
+        self.ttl = ttl
+        self.per_user_cap = per_user_cap
+        self._users = OrderedDict()
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._users)
+
+    def __contains__(self, user_id):
+        return user_id in self._users
+
+    @property
+    def message_count(self) -> int:
+        return sum(len(tracked.message_ids) for tracked in self._users.values())
+
+    def _trim(self, tracked: _TrackedMessages, now: float):
+        drop = 0
+        for sent_at in tracked.sent_at:
+            if now - sent_at < self.ttl:
+                break
+            drop += 1
+        drop = max(drop, len(tracked.message_ids) - self.per_user_cap)
+        if drop > 0:
+            del tracked.message_ids[:drop]
+            del tracked.sent_at[:drop]
+            self.evicted += drop
+
+    def add(self, user_id: int, message_id: int, sent_at: float = None) -> list:
+        """Добавляет сообщение и возвращает актуальный список записей пользователя."""
+        if sent_at is None:
+            sent_at = time.time()
+        tracked = self._users.get(user_id)
+        if tracked is None:
+            tracked = self._users[user_id] = _TrackedMessages()
+        else:
+            self._users.move_to_end(user_id)
+        tracked.message_ids.append(message_id)
+        tracked.sent_at.append(sent_at)
+        tracked.last_sent = sent_at
+        self._trim(tracked, sent_at)
+        return self.entries(user_id)
+
+    def restore(self, stored: dict, now: float = None) -> int:
+        """
+        Восстанавливает записи {user_id: [записи]} из хранилища. Пользователи
+        добавляются в порядке последней отправки, чтобы вытеснение оставалось
+        корректным. Возвращает число восстановленных переписок.
+        """
+        if now is None:
+            now = time.time()
+        normalized = []
+        for user_id, entries in stored.items():
+            records = sorted((normalize_entry(entry, now) for entry in entries), key=lambda item: item[1])
+            if records:
+                normalized.append((records[-1][1], user_id, records))
+        normalized.sort(key=lambda item: item[0])
+        for _, user_id, records in normalized:
+            for message_id, sent_at in records:
+                self.add(user_id, message_id, sent_at)
+        return len(self._users)
+
+    def entries(self, user_id: int) -> list:
+        tracked = self._users.get(user_id)
+        if tracked is None:
+            return []
+        return list(zip(tracked.message_ids, tracked.sent_at))
+
+    def pop(self, user_id: int):
+        """Удаляет и возвращает записи пользователя или None."""
+        tracked = self._users.pop(user_id, None)
+        if tracked is None:
+            return None
+        return list(zip(tracked.message_ids, tracked.sent_at))
+
+    def evict_expired(self, now: float = None) -> list:
+        """Вытесняет переписки без отправок дольше ttl и возвращает их user_id."""
+        if now is None:
+            now = time.time()
+        evicted = []
+        while self._users:
+            user_id, tracked = next(iter(self._users.items()))
+            if now - tracked.last_sent < self.ttl:
+                break
+            self._users.popitem(last=False)
+            self.evicted += len(tracked.message_ids)
+            evicted.append(user_id)
+        return evicted
@@ -0,0 +1,360 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
+from cities import DATA_DIR, load_city_index
+from moderation import ModerationEngine
+
+logger = logging.getLogger(__name__)
+
+# Файл конфигурации по умолчанию; относительные пути внутри него отсчитываются от его каталога
+CONFIG_PATH = os.path.join(DATA_DIR, 'bot_config.json')
+# Пауза после последнего изменения файла перед перезагрузкой (редакторы пишут файл в несколько приёмов)
+RELOAD_DEBOUNCE = 1.0
+# Telegram считает бан короче 30 секунд или длиннее 366 дней вечным
+MIN_BAN_DURATION = 30
+MAX_BAN_DURATION = 366 * 86400
+
+DEFAULT_CHAT_RULES = """
+**Правила чата:**
+1. Торгівля (відкрита/закрита) будь-якого виду
+2. Реклама (відкрита / закрита) своїх послуг будь-якого виду
+3. Пропаганда BMW
+4. Розмови про те, що VAG ламається )))
+5. Грошові збори
+6. Інше ...
+"""
+
+# Значения по умолчанию для ключей, отсутствующих в файле
+DEFAULTS = {
+    'chat_rules': DEFAULT_CHAT_RULES,
+    'registration_timeout': 120,
+    'ban_duration': 30,
+    'banned_car_pattern': r'\bbmw\b|\bбмв\b|\bбеха\b',
+    'blocked_cities_path': 'cities_ru.txt',
+    'allowed_cities_path': 'cities_allowed.txt',
+    'moderation_rules_path': 'moderation_rules.json',
+    'invite_link': None,
+    'groups': {},
+}
+# Ключи, которые можно переопределить для отдельной группы в разделе groups
+GROUP_KEYS = ('title', 'invite_link', 'chat_rules', 'registration_timeout', 'ban_duration')
+_PATH_KEYS = ('blocked_cities_path', 'allowed_cities_path', 'moderation_rules_path')
+# События, означающие изменение файла (открытие и чтение самим ботом не учитываются)
+_CHANGE_EVENTS = frozenset({'created', 'modified', 'moved', 'deleted', 'closed'})
+
+
+class ConfigError(ValueError):
+    """Конфигурация не прошла проверку и не может быть применена."""
+
+
+# Настройки одной группы: недостающие в разделе groups значения берутся с верхнего уровня
+class GroupConfig:
+    __slots__ = ('group_id', 'title', 'invite_link', 'chat_rules', 'registration_timeout', 'ban_duration')
+
+    def __init__(self, group_id, title, invite_link, chat_rules, registration_timeout, ban_duration):
+        self.group_id = group_id
+        self.title = title
+        self.invite_link = invite_link
+        self.chat_rules = chat_rules
+        self.registration_timeout = registration_timeout
+        self.ban_duration = ban_duration
+
+
+# Снимок конфигурации со скомпилированными артефактами; после создания не изменяется
+class BotConfig:
+    __slots__ = ('chat_rules', 'registration_timeout', 'ban_duration', 'banned_car_regex',
+                 'city_index', 'moderation_engine', 'invite_link', 'groups', 'default_group',
+                 'sources', 'fingerprint', 'loaded_at')
+
+    def __init__(self, chat_rules, registration_timeout, ban_duration, banned_car_regex,
+                 city_index, moderation_engine, sources, invite_link=None, groups=None):
+        self.chat_rules = chat_rules
+        self.registration_timeout = registration_timeout
+        self.ban_duration = ban_duration
+        self.banned_car_regex = banned_car_regex
+        self.city_index = city_index
+        self.moderation_engine = moderation_engine
+        self.invite_link = invite_link
+        self.groups = dict(groups or {})  # group_id -> GroupConfig
+        self.default_group = GroupConfig(None, None, invite_link, chat_rules, registration_timeout, ban_duration)
+        self.sources = tuple(sources)  # файлы, из которых собран снимок
+        self.fingerprint = files_fingerprint(self.sources)
+        self.loaded_at = time.time()
+
+    def group(self, group_id) -> GroupConfig:
+        """Настройки группы; для группы без раздела в groups — значения верхнего уровня."""
+        return self.groups.get(group_id, self.default_group)
+
+
+# Функция для получения отпечатка файлов (время изменения и размер)
+def files_fingerprint(paths) -> tuple:
+    fingerprint = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            fingerprint.append((path, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            fingerprint.append((path, None, None))
+    return tuple(fingerprint)
+
+
+def _positive_int(values: dict, key: str, low: int, high: int, prefix: str = '') -> int:
+    value = values[key]
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ConfigError(f"{prefix}{key}: ожидается целое число, получено {value!r}")
+    if not low <= value <= high:
+        raise ConfigError(f"{prefix}{key}: значение {value} вне допустимого диапазона {low}..{high}")
+    return value
+
+
+def _optional_text(values: dict, key: str, prefix: str = ''):
+    value = values[key]
+    if value is not None and (not isinstance(value, str) or not value.strip()):
+        raise ConfigError(f"{prefix}{key}: ожидается непустая строка или null")
+    return value
+
+
+# Функция для проверки настроек групп из раздела groups
+def _build_groups(groups, defaults: dict) -> dict:
+    if not isinstance(groups, dict):
+        raise ConfigError("groups: ожидается объект {\"ID группы\": {настройки}}")
+    configs = {}
+    for key, entry in groups.items():
+        prefix = f"groups.{key}."
+        try:
+            group_id = int(key)
+        except ValueError:
+            raise ConfigError(f"groups: ключ {key!r} не является ID группы") from None
+        if not isinstance(entry, dict):
+            raise ConfigError(f"groups.{key}: ожидается объект")
+        unknown = set(entry) - set(GROUP_KEYS)
+        if unknown:
+            raise ConfigError(f"groups.{key}: неизвестные ключи: {', '.join(sorted(unknown))}")
+        values = {**defaults, 'title': None, **entry}
+        chat_rules = values['chat_rules']
+        if not isinstance(chat_rules, str) or not chat_rules.strip():
+            raise ConfigError(f"{prefix}chat_rules: ожидается непустая строка")
+        configs[group_id] = GroupConfig(
+            group_id,
+            _optional_text(values, 'title', prefix),
+            _optional_text(values, 'invite_link', prefix),
+            chat_rules,
+            _positive_int(values, 'registration_timeout', 10, 7 * 86400, prefix),
+            _positive_int(values, 'ban_duration', MIN_BAN_DURATION, MAX_BAN_DURATION, prefix),
+        )
+    return configs
+
+
+# Функция для чтения, проверки и сборки конфигурации (выполняется вне цикла событий)
+def build_config(path: str, overrides: dict = None) -> BotConfig:
+    """
+    Отсутствующий файл — значения по умолчанию. Любая ошибка (синтаксис JSON,
+    неизвестный ключ, недопустимое значение, неверное регулярное выражение,
+    пустой список городов) — ConfigError; частично собранный снимок не возвращается.
+    Раздел groups: {"ID группы": {title, invite_link, chat_rules, registration_timeout,
+    ban_duration}} — настройки отдельных групп поверх значений верхнего уровня.
+    """
+    values = dict(DEFAULTS)
+    base_dir = os.path.dirname(os.path.abspath(path))
+    sources = [os.path.abspath(path)]
+    if os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                loaded = json.load(f)
+        except (OSError, ValueError) as e:
+            raise ConfigError(f"не удалось прочитать {path}: {e}") from e
+        if not isinstance(loaded, dict):
+            raise ConfigError("корень файла должен быть объектом JSON")
+        unknown = set(loaded) - set(DEFAULTS)
+        if unknown:
+            raise ConfigError(f"неизвестные ключи: {', '.join(sorted(unknown))}")
+        values.update(loaded)
+    for key in _PATH_KEYS:
+        values[key] = os.path.join(base_dir, values[key])
+    # Переопределения (например, из переменных окружения) важнее файла; пути — от текущего каталога
+    for key, value in (overrides or {}).items():
+        values[key] = os.path.abspath(value) if key in _PATH_KEYS else value
+
+    chat_rules = values['chat_rules']
+    if not isinstance(chat_rules, str) or not chat_rules.strip():
+        raise ConfigError("chat_rules: ожидается непустая строка")
+    registration_timeout = _positive_int(values, 'registration_timeout', 10, 7 * 86400)
+    ban_duration = _positive_int(values, 'ban_duration', MIN_BAN_DURATION, MAX_BAN_DURATION)
+    invite_link = _optional_text(values, 'invite_link')
+    groups = _build_groups(values['groups'], {
+        'invite_link': invite_link, 'chat_rules': chat_rules,
+        'registration_timeout': registration_timeout, 'ban_duration': ban_duration,
+    })
+
+    try:
+        banned_car_regex = re.compile(values['banned_car_pattern'], re.IGNORECASE)
+    except (re.error, TypeError) as e:
+        raise ConfigError(f"banned_car_pattern: {e}") from e
+    if banned_car_regex.search(''):
+        raise ConfigError("banned_car_pattern совпадает с пустой строкой и запретил бы любой ответ")
+
+    for key in _PATH_KEYS:
+        if not os.path.isfile(values[key]):
+            raise ConfigError(f"{key}: файл {values[key]} не найден")
+    try:
+        city_index = load_city_index(values['blocked_cities_path'], values['allowed_cities_path'])
+        moderation_engine = ModerationEngine.from_file(values['moderation_rules_path'])
+    except (OSError, ValueError, KeyError, re.error) as e:
+        raise ConfigError(f"ошибка в файлах данных: {e}") from e
+    if not len(city_index):
+        raise ConfigError("индекс городов пуст")
+
+    sources.extend(values[key] for key in _PATH_KEYS)
+    return BotConfig(chat_rules, registration_timeout, ban_duration, banned_car_regex,
+                     city_index, moderation_engine, sources, invite_link, groups)
+
+
+# Обработчик событий файловой системы: реагирует только на файлы конфигурации
+class _ChangeHandler(FileSystemEventHandler):
+    def __init__(self, reloader: 'ConfigReloader'):
+        self.reloader = reloader
+
+    def on_any_event(self, event):
+        if event.is_directory or event.event_type not in _CHANGE_EVENTS:
+            return
+        paths = {os.path.abspath(event.src_path)}
+        dest_path = getattr(event, 'dest_path', None)
+        if dest_path:
+            paths.add(os.path.abspath(dest_path))
+        if paths & self.reloader.watched:
+            self.reloader.notify_changed()
+
+
+# Перезагрузка конфигурации при изменении файлов
+class ConfigReloader:
+    """
+    Новый снимок собирается в пуле потоков (сборка индекса городов и регулярных
+    выражений не блокирует цикл событий), затем apply(config) вызывается в цикле
+    событий одним синхронным шагом — обработчики видят либо старый, либо новый
+    снимок целиком. Некорректный файл не применяется: остаётся прежний снимок.
+    Если apply завершился ошибкой, повторно применяется прежний снимок.
+    """
+
+    def __init__(self, path: str, apply, overrides: dict = None, debounce: float = RELOAD_DEBOUNCE):
+        self.path = os.path.abspath(path)
+        self.apply = apply
+        self.overrides = overrides
+        self.debounce = debounce
+        self.current = None
+        self.watched = frozenset()
+        self.reloads = 0
+        self.failures = 0
+        self.last_error = None
+        self._failed_fingerprint = None
+        self._loop = None
+        self._observer = None
+        self._timer = None
+        self._task = None
+        self._lock = None
+
+    def load(self) -> BotConfig:
+        """Первичная синхронная загрузка при запуске; ошибка — ConfigError."""
+        config = build_config(self.path, self.overrides)
+        self.apply(config)
+        self._set_current(config)
+        return config
+
+    def _set_current(self, config: BotConfig):
+        self.current = config
+        self.watched = frozenset(config.sources)
+
+    async def reload(self, force: bool = False) -> bool:
+        """Возвращает True, если применён новый снимок."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            previous = self.current
+            fingerprint = files_fingerprint(previous.sources) if previous is not None else None
+            # Файлы не менялись с прошлой успешной или неудачной попытки
+            if not force and fingerprint is not None and fingerprint in (previous.fingerprint, self._failed_fingerprint):
+                return False
+            loop = asyncio.get_running_loop()
+            try:
+                config = await loop.run_in_executor(None, build_config, self.path, self.overrides)
+            except ConfigError as e:
+                self._failed_fingerprint = fingerprint
+                self.failures += 1
+                self.last_error = str(e)
+                logger.error(f"Конфигурация {self.path} не применена, остаётся прежняя: {e}")
+                return False
+            try:
+                self.apply(config)
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                self._failed_fingerprint = fingerprint
+                logger.error(f"Ошибка применения конфигурации, возврат к прежней: {e}")
+                if previous is not None:
+                    self.apply(previous)
+                return False
+            self._set_current(config)
+            self.reloads += 1
+            self.last_error = None
+            self._rewatch()
+            logger.info(f"Конфигурация {self.path} перезагружена.")
+            return True
+
+    def notify_changed(self):
+        """Вызывается из потока watchdog: откладывает перезагрузку до затишья."""
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._schedule)
+
+    def _schedule(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = self._loop.call_later(self.debounce, self._start_reload)
+
+    def _start_reload(self):
+        self._timer = None
+        self._task = asyncio.ensure_future(self.reload())
+
+    def _rewatch(self):
+        if self._observer is None:
+            return
+        directories = {os.path.dirname(path) for path in self.watched}
+        self._observer.unschedule_all()
+        handler = _ChangeHandler(self)
+        for directory in directories:
+            if os.path.isdir(directory):
+                self._observer.schedule(handler, directory, recursive=False)
+
+    def start(self, loop: asyncio.AbstractEventLoop = None):
+        """Начинает следить за файлами конфигурации (файл и файлы данных, на которые он ссылается)."""
+        self._loop = loop or asyncio.get_running_loop()
+        self._observer = Observer()
+        self._observer.daemon = True
+        self._rewatch()
+        self._observer.start()
+        logger.info(f"Отслеживаются изменения конфигурации: {', '.join(sorted(self.watched))}")
+
+    async def stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._observer is not None:
+            observer, self._observer = self._observer, None
+            observer.stop()
+            await asyncio.get_running_loop().run_in_executor(None, observer.join)
+        if self._task is not None and not self._task.done():
+            await self._task
+
+    def stats(self) -> dict:
+        return {
+            'path': self.path,
+            'loaded_at': self.current.loaded_at if self.current else None,
+            'reloads': self.reloads,
+            'failures': self.failures,
+            'last_error': self.last_error,
+        }
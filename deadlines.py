@@ -0,0 +1,97 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Максимальное число одновременных банов при разборе просроченных сроков
+SWEEP_CONCURRENCY = 20
+
+
+# Менеджер сроков регистрации на основе min-кучи
+class DeadlineManager:
+    """
+    Хранит сроки регистрации в min-куче с ключом (group_id, user_id). Отмена
+    выполняется за O(1): запись помечается удалённой и выбрасывается из кучи
+    при следующем разборе. Один периодический обработчик (sweep) забирает все
+    просроченные записи, чередуя группы: тысячи истёкших сроков после рейда
+    в одной группе не откладывают баны в остальных.
+    lag_observer(задержка) получает опоздание обработки каждого срока в секундах.
+    """
+
+    def __init__(self, max_concurrency: int = SWEEP_CONCURRENCY, lag_observer=None):
+        self.max_concurrency = max_concurrency
+        self.lag_observer = lag_observer
+        self._heap = []
+        self._entries = {}  # (group_id, user_id) -> [deadline, seq, group_id, user_id, active]
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def schedule(self, group_id: int, user_id: int, deadline: float):
+        """Устанавливает (или переносит) срок регистрации пользователя в группе."""
+        self.cancel(group_id, user_id)
+        entry = [deadline, next(self._counter), group_id, user_id, True]
+        self._entries[(group_id, user_id)] = entry
+        heapq.heappush(self._heap, entry)
+
+    def cancel(self, group_id: int, user_id: int) -> bool:
+        """Отменяет срок регистрации. Возвращает True, если срок был запланирован."""
+        entry = self._entries.pop((group_id, user_id), None)
+        if entry is None:
+            return False
+        entry[4] = False
+        return True
+
+    def deadline_of(self, group_id: int, user_id: int):
+        entry = self._entries.get((group_id, user_id))
+        return entry[0] if entry else None
+
+    def pop_expired(self, now: float = None) -> list:
+        """
+        Извлекает все просроченные записи: [(group_id, user_id), ...]. Внутри группы —
+        в порядке срока, группы чередуются по одной записи.
+        """
+        if now is None:
+            now = time.time()
+        by_group = {}
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            deadline, _, group_id, user_id, active = heapq.heappop(heap)
+            if active:
+                del self._entries[(group_id, user_id)]
+                by_group.setdefault(group_id, []).append((group_id, user_id))
+                if self.lag_observer is not None:
+                    self.lag_observer(now - deadline)
+        # Если отменённых записей накопилось больше половины кучи, перестраиваем её
+        if len(heap) > 2 * len(self._entries) + 64:
+            self._heap = [entry for entry in heap if entry[4]]
+            heapq.heapify(self._heap)
+        if len(by_group) <= 1:
+            return next(iter(by_group.values()), [])
+        return [key for keys in itertools.zip_longest(*by_group.values()) for key in keys if key is not None]
+
+    async def sweep(self, handler, now: float = None) -> int:
+        """
+        Вызывает handler(group_id, user_id) для всех просроченных записей
+        пачками не более max_concurrency одновременных вызовов.
+        """
+        expired = self.pop_expired(now)
+        for start in range(0, len(expired), self.max_concurrency):
+            batch = expired[start:start + self.max_concurrency]
+            results = await asyncio.gather(
+                *(handler(group_id, user_id) for group_id, user_id in batch),
+                return_exceptions=True
+            )
+            for (group_id, user_id), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    logger.error(
+                        f"Ошибка обработки истёкшего срока регистрации ID={user_id} в группе ID={group_id}: {result}"
+                    )
+        return len(expired)
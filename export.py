@@ -0,0 +1,101 @@
+import csv
+import io
+import json
+import logging
+import shlex
+from tempfile import SpooledTemporaryFile
+
+from storage import USER_FIELDS
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+# Поля, по которым можно фильтровать выгрузку (в таблице по ним есть индексы)
+EXPORT_FILTER_FIELDS = ('city', 'car_type', 'year')
+# До этого размера файл выгрузки держится в памяти, дальше переносится на диск
+EXPORT_SPOOL_SIZE = 8 * 1024 * 1024
+EXPORT_COLUMNS = ('user_id', *USER_FIELDS)
+
+
+# Функция для разбора аргументов команды: формат, группа и фильтры вида поле=значение
+def parse_export_args(text: str):
+    """
+    Возвращает (формат, group_id или None, {поле: значение}). Значения с пробелами
+    берутся в кавычки: /export_users csv group=-100123 city="Кривой Рог" year=2015
+    Некорректные аргументы вызывают ValueError с текстом для пользователя.
+    """
+    export_format = 'csv'
+    group_id = None
+    filters = {}
+    try:
+        tokens = shlex.split(text)
+    except ValueError:
+        raise ValueError("Не удалось разобрать аргументы: проверьте кавычки.")
+    for token in tokens:
+        if '=' not in token:
+            if token.lower() not in EXPORT_FORMATS:
+                raise ValueError(f"Неизвестный формат '{token}'. Доступны: {', '.join(EXPORT_FORMATS)}.")
+            export_format = token.lower()
+            continue
+        field, value = token.split('=', 1)
+        field = field.strip().lower()
+        if field == 'group':
+            try:
+                group_id = int(value)
+            except ValueError:
+                raise ValueError(f"Некорректный ID группы '{value}'.") from None
+            continue
+        if field not in EXPORT_FILTER_FIELDS:
+            raise ValueError(f"Фильтр по полю '{field}' не поддерживается. Доступны: {', '.join(EXPORT_FILTER_FIELDS)}.")
+        filters[field] = value.strip()
+    return export_format, group_id, filters
+
+
+# Генератор строк CSV (первая строка — заголовок)
+async def csv_lines(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    async for user_id, data in rows:
+        writer.writerow((user_id, *(data.get(field) or '' for field in USER_FIELDS)))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+# Генератор строк JSONL (одна анкета — один JSON-объект в строке)
+async def jsonl_lines(rows):
+    async for user_id, data in rows:
+        yield json.dumps({'user_id': user_id, **data}, ensure_ascii=False) + '\n'
+
+
+# Функция для выгрузки анкет группы во временный файл
+async def export_users(store, group_id: int, export_format: str = 'csv', filters: dict = None):
+    """
+    Строки читаются из хранилища порциями и по одной проходят через генератор
+    форматирования прямо в SpooledTemporaryFile, поэтому при формировании файла
+    память не растёт с числом анкет. Отправка не потоковая: InputFile в PTB
+    читает файл целиком, так что при загрузке в памяти оказывается одна копия
+    готовой выгрузки. Возвращает (файл, открытый на чтение с начала, число анкет).
+    """
+    rows = store.iter_users(group_id, filters)
+    lines = csv_lines(rows) if export_format == 'csv' else jsonl_lines(rows)
+    spool = SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE, mode='w+b')
+    # utf-8-sig: Excel корректно открывает кириллицу в CSV только с BOM
+    encoding = 'utf-8-sig' if export_format == 'csv' else 'utf-8'
+    text = io.TextIOWrapper(spool, encoding=encoding, newline='')
+    count = -1 if export_format == 'csv' else 0
+    try:
+        async for line in lines:
+            text.write(line)
+            count += 1
+        text.flush()
+        text.detach()
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool, max(count, 0)
@@ -0,0 +1,165 @@
+import logging
+import time
+
+from stats import RegistrationStats
+from tasks import BoundedTaskPool
+
+logger = logging.getLogger(__name__)
+
+# Максимум одновременных вызовов restrict_chat_member в режиме рейда (на каждую группу)
+RAID_RESTRICT_CONCURRENCY = 10
+
+
+# Состояние регистрации в одной группе
+class GroupState:
+    """
+    Анкеты, ожидающие регистрации пользователи, распределения анкет и пул
+    фоновых ограничений одной группы. Пул у каждой группы свой, поэтому
+    рейд в одной группе не задерживает ограничения новичков в остальных.
+    """
+    __slots__ = ('group_id', 'registered', 'registered_at', 'pending', 'stats', 'restrict_pool')
+
+    def __init__(self, group_id: int, restrict_concurrency: int = RAID_RESTRICT_CONCURRENCY):
+        self.group_id = group_id
+        self.registered = {}  # user_id -> UserRecord
+        self.registered_at = {}  # user_id -> время регистрации в этом процессе (загруженных анкет здесь нет)
+        self.pending = set()  # user_id ожидающих регистрации
+        self.stats = RegistrationStats()
+        self.restrict_pool = BoundedTaskPool(restrict_concurrency, name=f'restrict:{group_id}')
+
+
+# Реестр состояний групп, обслуживаемых одним процессом бота
+class GroupRegistry:
+    """
+    Состояние разделено по группам: ключ любой записи — пара (group_id, user_id),
+    поиск и изменение — O(1) независимо от числа групп. Выход из одной группы
+    не затрагивает анкету пользователя в другой. Индекс user_id -> группы,
+    где пользователь ожидает регистрации, нужен для /start без параметра.
+    stats — сумма распределений по группам: пользователь, зарегистрированный
+    в нескольких группах, учитывается в каждой; число разных людей — unique_registered_count.
+    """
+
+    def __init__(self, restrict_concurrency: int = RAID_RESTRICT_CONCURRENCY):
+        self.restrict_concurrency = restrict_concurrency
+        self.stats = RegistrationStats()
+        self._groups = {}
+        self._pending_groups = {}  # user_id -> {group_id, ...}
+
+    def __len__(self):
+        return len(self._groups)
+
+    def __iter__(self):
+        return iter(list(self._groups.values()))
+
+    def __contains__(self, group_id):
+        return group_id in self._groups
+
+    def group_ids(self) -> list:
+        return list(self._groups)
+
+    def get(self, group_id: int):
+        return self._groups.get(group_id)
+
+    def ensure(self, group_id: int) -> GroupState:
+        state = self._groups.get(group_id)
+        if state is None:
+            state = self._groups[group_id] = GroupState(group_id, self.restrict_concurrency)
+            logger.info(f"Добавлено состояние группы ID={group_id}.")
+        return state
+
+    @property
+    def registered_count(self) -> int:
+        return sum(len(state.registered) for state in self._groups.values())
+
+    def unique_registered_count(self) -> int:
+        """Число разных пользователей с анкетой хотя бы в одной группе (O(N), для отчётов)."""
+        return len(set().union(*(state.registered for state in self._groups.values())))
+
+    @property
+    def pending_count(self) -> int:
+        return sum(len(state.pending) for state in self._groups.values())
+
+    # --- Зарегистрированные пользователи ---
+
+    def load(self, records: dict):
+        """Заменяет все анкеты: {(group_id, user_id): UserRecord}. Статистика пересобирается."""
+        for state in self._groups.values():
+            state.registered.clear()
+            state.registered_at.clear()
+        for (group_id, user_id), record in records.items():
+            self.ensure(group_id).registered[user_id] = record
+        self.stats.rebuild(records.values())
+        for state in self._groups.values():
+            state.stats.rebuild(state.registered.values())
+
+    def record(self, group_id: int, user_id: int):
+        state = self._groups.get(group_id)
+        return state.registered.get(user_id) if state is not None else None
+
+    def is_registered(self, group_id: int, user_id: int) -> bool:
+        state = self._groups.get(group_id)
+        return state is not None and user_id in state.registered
+
+    def register(self, group_id: int, user_id: int, record):
+        """Сохраняет анкету; прежняя анкета в этой группе вычитается из статистики."""
+        state = self.ensure(group_id)
+        previous = state.registered.get(user_id)
+        if previous is not None:
+            state.stats.remove(previous)
+            self.stats.remove(previous)
+        state.registered[user_id] = record
+        state.registered_at[user_id] = time.time()
+        state.stats.add(record)
+        self.stats.add(record)
+
+    def unregister(self, group_id: int, user_id: int):
+        """Удаляет анкету пользователя в группе и возвращает её (или None)."""
+        state = self._groups.get(group_id)
+        if state is None:
+            return None
+        record = state.registered.pop(user_id, None)
+        state.registered_at.pop(user_id, None)
+        if record is not None:
+            state.stats.remove(record)
+            self.stats.remove(record)
+        return record
+
+    def unregister_if_older(self, group_id: int, user_id: int, before: float):
+        """
+        Удаляет анкету, только если она зарегистрирована раньше before: анкета,
+        заполненная заново во время сверки, остаётся. Возвращает удалённую анкету или None.
+        """
+        state = self._groups.get(group_id)
+        if state is None or state.registered_at.get(user_id, 0.0) >= before:
+            return None
+        return self.unregister(group_id, user_id)
+
+    # --- Ожидающие регистрации ---
+
+    def add_pending(self, group_id: int, user_id: int):
+        self.ensure(group_id).pending.add(user_id)
+        groups = self._pending_groups.get(user_id)
+        if groups is None:
+            groups = self._pending_groups[user_id] = set()
+        groups.add(group_id)
+
+    def discard_pending(self, group_id: int, user_id: int) -> bool:
+        """Возвращает True, если пользователь ожидал регистрации в группе."""
+        state = self._groups.get(group_id)
+        if state is None or user_id not in state.pending:
+            return False
+        state.pending.discard(user_id)
+        groups = self._pending_groups.get(user_id)
+        if groups is not None:
+            groups.discard(group_id)
+            if not groups:
+                del self._pending_groups[user_id]
+        return True
+
+    def is_pending(self, group_id: int, user_id: int) -> bool:
+        state = self._groups.get(group_id)
+        return state is not None and user_id in state.pending
+
+    def pending_groups(self, user_id: int) -> frozenset:
+        """Группы, в которых пользователь ожидает регистрации."""
+        return frozenset(self._pending_groups.get(user_id, ()))
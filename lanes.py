@@ -0,0 +1,171 @@
+import asyncio
+import logging
+
+from telegram import Update
+from telegram.ext import Application, BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# Максимум обновлений, обрабатываемых одновременно во всех полосах
+UPDATE_CONCURRENCY = 32
+# Максимум одновременно обрабатываемых обновлений одной группы (часть общего лимита)
+GROUP_UPDATE_CONCURRENCY = 16
+# Максимум обновлений, принятых в полосы (выполняемых и ожидающих своей очереди)
+MAX_PENDING_UPDATES = 10000
+
+
+# Функция для выбора полосы обновления
+def lane_key(update):
+    """
+    Обновления одного пользователя (личные сообщения, шаги анкеты, вступление и выход
+    из группы) попадают в одну полосу и обрабатываются строго по порядку.
+    Групповые события без пользователя — в полосу чата.
+    """
+    if isinstance(update, Update):
+        if update.chat_member is not None:
+            return update.chat_member.new_chat_member.user.id
+        message = update.effective_message
+        if message is not None and message.left_chat_member is not None:
+            return message.left_chat_member.id
+        if update.effective_user is not None:
+            return update.effective_user.id
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+    return None
+
+
+# Планировщик обновлений по последовательным полосам
+class LaneScheduler:
+    """
+    Каждая полоса — обновления одного ключа, обрабатываемые последовательно:
+    обновление ждёт завершения предыдущего в своей полосе. Разные полосы работают
+    параллельно, но не более max_concurrency обновлений сразу.
+    Полоса существует, только пока в ней есть обновления.
+    Если задан shard_key(update), обновления одной группы (шарда) занимают не больше
+    shard_concurrency из общего лимита: рейд в одной группе не забирает все места
+    и не задерживает обработку остальных групп. Место шарда берётся раньше общего,
+    поэтому ожидающие своей очереди обновления группы общий лимит не держат.
+    """
+
+    def __init__(self, max_concurrency: int = UPDATE_CONCURRENCY, shard_key=None,
+                 shard_concurrency: int = GROUP_UPDATE_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._shard_key = shard_key
+        self.shard_concurrency = min(shard_concurrency, max_concurrency)
+        self._shard_semaphores = {}
+        self._tails = {}  # ключ полосы -> future последнего обновления полосы
+        self.queued = 0
+        self.processing = 0
+
+    @property
+    def lanes(self) -> int:
+        return len(self._tails)
+
+    def _shard_semaphore(self, update):
+        if self._shard_key is None:
+            return None
+        try:
+            shard = self._shard_key(update)
+        except Exception as e:
+            logger.error(f"Ошибка определения группы обновления: {e}")
+            return None
+        if shard is None:
+            return None
+        semaphore = self._shard_semaphores.get(shard)
+        if semaphore is None:
+            semaphore = self._shard_semaphores[shard] = asyncio.Semaphore(self.shard_concurrency)
+        return semaphore
+
+    async def _process_limited(self, key, coroutine):
+        async with self._semaphore:
+            self.processing += 1
+            try:
+                await coroutine
+            except Exception as e:
+                logger.error(f"Ошибка обработки обновления в полосе {key}: {e}")
+            finally:
+                self.processing -= 1
+
+    async def run(self, key, update, coroutine):
+        """
+        Выполняет coroutine обработки update в полосе key. Место в полосе занимается
+        до первого await, поэтому порядок полосы совпадает с порядком вызовов run.
+        """
+        previous = self._tails.get(key)
+        done = asyncio.get_running_loop().create_future()
+        self._tails[key] = done
+        self.queued += 1
+        waiting = True
+        try:
+            if previous is not None:
+                # shield: отмена ожидающего обновления не должна отменять future предыдущего
+                await asyncio.shield(previous)
+            waiting = False
+            self.queued -= 1
+            shard_semaphore = self._shard_semaphore(update)
+            if shard_semaphore is None:
+                await self._process_limited(key, coroutine)
+            else:
+                async with shard_semaphore:
+                    await self._process_limited(key, coroutine)
+        finally:
+            if waiting:
+                self.queued -= 1
+            # Отмена до начала обработки: корутина закрывается без предупреждения «never awaited»
+            close = getattr(coroutine, 'close', None)
+            if close is not None:
+                close()
+            if not done.done():
+                done.set_result(None)
+            if self._tails.get(key) is done:
+                del self._tails[key]
+
+
+# Обработчик обновлений PTB (публичная точка расширения concurrent_updates) с полосами
+class LaneUpdateProcessor(BaseUpdateProcessor):
+    """
+    Application создаёт задачу на каждое обновление и передаёт сюда корутину его
+    обработки; LaneScheduler упорядочивает её в полосе и ограничивает параллельность.
+    Лимит max_pending базового класса — только предохранитель от неограниченного
+    числа ожидающих задач: порядок полос сохраняется, пока он не достигнут.
+    """
+
+    def __init__(self, update_concurrency: int = UPDATE_CONCURRENCY, shard_key=None,
+                 group_concurrency: int = GROUP_UPDATE_CONCURRENCY, max_pending: int = MAX_PENDING_UPDATES):
+        super().__init__(max(max_pending, update_concurrency))
+        self.lane_scheduler = LaneScheduler(update_concurrency, shard_key, group_concurrency)
+
+    async def do_process_update(self, update, coroutine):
+        await self.lane_scheduler.run(lane_key(update), update, coroutine)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+# Application с трассировкой медленных обновлений
+class LaneApplication(Application):
+    """
+    Обновления обрабатываются через LaneUpdateProcessor (ApplicationBuilder.concurrent_updates):
+    состояния ConversationHandler одного пользователя остаются упорядоченными,
+    а медленный обработчик одного пользователя не задерживает остальных.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # Трассировщик медленных обновлений (profiling.SlowUpdateTracer), если подключён
+        self.update_tracer = None
+
+    @property
+    def lane_scheduler(self):
+        return getattr(self.update_processor, 'lane_scheduler', None)
+
+    async def process_update(self, update):
+        tracer = self.update_tracer
+        if tracer is None or not tracer.enabled:
+            return await super().process_update(update)
+        with tracer.trace(update):
+            return await super().process_update(update)
@@ -0,0 +1,209 @@
+import contextvars
+import functools
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+# Формат текстового вывода (LOG_FORMAT=text) — прежний формат бота
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+# Поля контекста, добавляемые к каждой записи
+CONTEXT_FIELDS = ('user_id', 'group_id', 'handler')
+
+# Выборка частых событий: при всплеске выше SAMPLING_BURST событий в секунду
+# записывается только каждое N-е событие данного типа
+SAMPLING_BURST = 20
+SAMPLING_RATES = {
+    'message_sent': 10,
+    'message_deleted': 10,
+    'member_joined': 10,
+    'answer_received': 10,
+}
+
+# Контекст текущего обновления: задаётся обёрткой обработчика, виден во всех записях задачи
+log_context = contextvars.ContextVar('log_context', default={})
+
+
+# Фильтр, добавляющий к записи поля контекста обновления
+class ContextFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = log_context.get()
+        for field in CONTEXT_FIELDS:
+            if not hasattr(record, field):
+                setattr(record, field, context.get(field))
+        return True
+
+
+# Фильтр выборки: во время всплеска пропускает 1 из N записей события
+class SamplingFilter(logging.Filter):
+    """
+    Тип события задаётся через extra={'event': ...}. Пока событий данного типа
+    не больше burst в секунду, пишутся все; сверх этого — каждое rate-е,
+    а в поле sampled указывается, сколько записей оно представляет.
+    """
+
+    def __init__(self, rates: dict = None, burst: int = SAMPLING_BURST):
+        super().__init__()
+        self.rates = dict(SAMPLING_RATES if rates is None else rates)
+        self.burst = burst
+        self._windows = {}  # событие -> [начало секунды, событий в ней, пропущено подряд]
+        self.dropped = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        event = getattr(record, 'event', None)
+        rate = self.rates.get(event)
+        if not rate or rate <= 1:
+            return True
+        now = int(record.created)
+        window = self._windows.get(event)
+        if window is None or window[0] != now:
+            window = self._windows[event] = [now, 0, 0]
+        window[1] += 1
+        if window[1] <= self.burst:
+            return True
+        window[2] += 1
+        if window[2] < rate:
+            self.dropped += 1
+            return False
+        window[2] = 0
+        record.sampled = rate
+        return True
+
+
+# Форматирование записи в одну строку JSON
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for field in (*CONTEXT_FIELDS, 'event', 'sampled'):
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+# Обработчик очереди, который не форматирует запись в потоке цикла событий
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Стандартный QueueHandler форматирует сообщение до постановки в очередь.
+    Здесь запись передаётся как есть: сообщение собирается уже в фоновом
+    потоке QueueListener. Аргументы записи должны быть неизменяемыми.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info:
+            # Трассировку нужно снять сейчас и не держать кадры стека до записи
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+# Функция для настройки неблокирующего логирования
+def configure_logging(level=logging.INFO, json_output: bool = True, levels: dict = None,
+                      sampling: SamplingFilter = None, stream=None):
+    """
+    Все записи проходят через очередь в фоновый поток QueueListener, который
+    форматирует и пишет их в stream (по умолчанию stderr). Цикл событий тратит
+    на запись только фильтры и постановку в очередь.
+    levels — уровни подсистем {имя логгера: уровень}.
+    """
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            _listener.stop()
+        output = logging.StreamHandler(stream or sys.stderr)
+        output.setFormatter(JsonFormatter() if json_output else logging.Formatter(TEXT_FORMAT))
+
+        log_queue = queue.SimpleQueue()
+        queue_handler = _DeferredQueueHandler(log_queue)
+        queue_handler.addFilter(ContextFilter())
+        queue_handler.addFilter(sampling or SamplingFilter())
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(queue_handler)
+        root.setLevel(level)
+        for name, subsystem_level in (levels or {}).items():
+            set_level(name, subsystem_level)
+
+        _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+        _listener.start()
+    return _listener
+
+
+# Функция для остановки фонового потока с дозаписью очереди
+def shutdown_logging():
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+# Функция для изменения уровня подсистемы во время работы
+def set_level(name: str, level) -> int:
+    """Возвращает установленный числовой уровень; неизвестный уровень — ValueError."""
+    if isinstance(level, str):
+        numeric = logging.getLevelName(level.upper())
+        if not isinstance(numeric, int):
+            raise ValueError(f"Неизвестный уровень логирования: {level}")
+        level = numeric
+    logging.getLogger(name or None).setLevel(level)
+    return level
+
+
+# Функция для разбора уровней подсистем из строки вида "ratelimit=WARNING,cleanup=DEBUG"
+def parse_levels(text: str) -> dict:
+    levels = {}
+    for item in (text or '').split(','):
+        if '=' in item:
+            name, level = item.split('=', 1)
+            levels[name.strip()] = level.strip()
+    return levels
+
+
+# Функция для получения текущих уровней всех настроенных логгеров
+def current_levels() -> dict:
+    levels = {'root': logging.getLevelName(logging.getLogger().level)}
+    for name, logger in sorted(logging.root.manager.loggerDict.items()):
+        if isinstance(logger, logging.Logger) and logger.level != logging.NOTSET:
+            levels[name] = logging.getLevelName(logger.level)
+    return levels
+
+
+# Декоратор: контекст обновления (user_id, group_id, имя обработчика) для всех записей обработчика
+def with_log_context(callback, name: str = None):
+    name = name or getattr(callback, '__name__', repr(callback))
+
+    @functools.wraps(callback)
+    async def wrapper(update, context, *args, **kwargs):
+        user = getattr(update, 'effective_user', None)
+        chat = getattr(update, 'effective_chat', None)
+        token = log_context.set({
+            'user_id': user.id if user is not None else None,
+            'group_id': chat.id if chat is not None and chat.type != 'private' else None,
+            'handler': name,
+        })
+        try:
+            return await callback(update, context, *args, **kwargs)
+        finally:
+            log_context.reset(token)
+
+    return wrapper
@@ -0,0 +1,229 @@
+import bisect
+import functools
+import logging
+import time
+
+from aiohttp import web
+from telegram.ext import ApplicationHandlerStop
+
+logger = logging.getLogger(__name__)
+
+# Адрес и порт эндпоинта /metrics (только localhost; порт 0 отключает сервер)
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9100
+# Границы корзин гистограмм задержек (в секундах)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LAG_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Базовый класс метрики с метками
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, '') for name in self.label_names)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._render_samples())
+        return lines
+
+    def _render_samples(self) -> list:
+        return [
+            f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+            for key, value in self._values.items()
+        ]
+
+
+# Счётчик (только растёт)
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+# Текущее значение; может вычисляться функцией в момент запроса
+# (у метрики с метками функция возвращает {значение метки или кортеж значений: значение})
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labels=(), function=None):
+        super().__init__(name, documentation, labels)
+        self.function = function
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def _render_samples(self) -> list:
+        if self.function is not None:
+            value = self.function()
+            if self.label_names:
+                self._values = {key if isinstance(key, tuple) else (key,): v for key, v in value.items()}
+            else:
+                self._values[()] = value
+        return super()._render_samples()
+
+
+# Гистограмма с накопительными корзинами в формате Prometheus
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self._values.get(key)
+        if series is None:
+            # Счётчики по корзинам (последняя — +Inf), сумма и количество
+            series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def _render_samples(self) -> list:
+        lines = []
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, float('inf')), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.label_names, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+# Набор метрик процесса
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels=()) -> Counter:
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels=(), function=None) -> Gauge:
+        return self._register(Gauge(name, documentation, labels, function))
+
+    def histogram(self, name: str, documentation: str, labels=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+# Декоратор: длительность и ошибки обработчика
+def instrument(callback, histogram: Histogram, errors: Counter, name: str = None):
+    name = name or getattr(callback, '__name__', repr(callback))
+    if getattr(callback, '__instrumented__', False):
+        return callback
+
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        except ApplicationHandlerStop:
+            raise  # штатная остановка следующих групп обработчиков, не ошибка
+        except Exception:
+            errors.inc(handler=name)
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - started, handler=name)
+
+    wrapper.__instrumented__ = True
+    return wrapper
+
+
+def iter_handlers(handlers):
+    """Обходит обработчики, включая вложенные в ConversationHandler."""
+    for handler in handlers:
+        nested = []
+        if hasattr(handler, 'entry_points'):
+            nested.extend(handler.entry_points)
+            for state_handlers in handler.states.values():
+                nested.extend(state_handlers)
+            nested.extend(handler.fallbacks)
+        if nested:
+            yield from iter_handlers(nested)
+        else:
+            yield handler
+
+
+# Функция для оборачивания всех зарегистрированных обработчиков приложения
+def instrument_application(application, histogram: Histogram, errors: Counter) -> int:
+    """
+    Оборачивает callback каждого обработчика (и состояний ConversationHandler)
+    декоратором instrument — тела обработчиков не меняются. Возвращает их число.
+    """
+    count = 0
+    for group_handlers in application.handlers.values():
+        for handler in iter_handlers(group_handlers):
+            handler.callback = instrument(handler.callback, histogram, errors)
+            count += 1
+    return count
+
+
+# HTTP-сервер с эндпоинтом /metrics
+class MetricsServer:
+    def __init__(self, registry: MetricsRegistry, host: str = METRICS_HOST, port: int = METRICS_PORT):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._runner = None
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(
+            text=self.registry.render(),
+            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+        )
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/metrics', self.handle_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        logger.info(f"Метрики доступны на http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,195 @@
+import json
+import logging
+import re
+import unicodedata
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Действия модерации в порядке строгости
+ACTION_WARN = 'warn'
+ACTION_DELETE = 'delete'
+ACTION_RESTRICT = 'restrict'
+ACTION_SEVERITY = {ACTION_WARN: 1, ACTION_DELETE: 2, ACTION_RESTRICT: 3}
+
+# Время ограничения по умолчанию для действия restrict (в секундах)
+DEFAULT_RESTRICT_SECONDS = 3600
+
+
+# Функция для нормализации текста перед поиском ключевых слов
+def normalize_text(text: str) -> str:
+    return unicodedata.normalize('NFKC', text).casefold().replace('ё', 'е')
+
+
+# Автомат Ахо–Корасик для поиска всех ключевых слов за один проход
+class AhoCorasick:
+    __slots__ = ('goto', 'fail', 'output')
+
+    def __init__(self, patterns):
+        """patterns — итерируемое из пар (ключевое слово, значение)."""
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [()]
+        for word, value in patterns:
+            state = 0
+            for char in word:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(())
+                state = next_state
+            self.output[state] = self.output[state] + (value,)
+        self._build_fail_links()
+
+    def _build_fail_links(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def find(self, text: str) -> set:
+        """Возвращает множество значений всех найденных ключевых слов."""
+        found = set()
+        goto, fail, output = self.goto, self.fail, self.output
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found.update(output[state])
+        return found
+
+
+# Правило модерации
+class ModerationRule:
+    __slots__ = ('rule_id', 'description', 'action', 'restrict_seconds', 'keywords', 'regexes', 'domains')
+
+    def __init__(self, rule_id, description='', action=ACTION_DELETE, restrict_seconds=DEFAULT_RESTRICT_SECONDS,
+                 keywords=(), regexes=(), domains=()):
+        if action not in ACTION_SEVERITY:
+            raise ValueError(f"Неизвестное действие '{action}' в правиле '{rule_id}'")
+        self.rule_id = rule_id
+        self.description = description
+        self.action = action
+        self.restrict_seconds = int(restrict_seconds)
+        self.keywords = tuple(normalize_text(keyword) for keyword in keywords if keyword)
+        self.regexes = tuple(regexes)
+        self.domains = tuple(domain.lower().lstrip('.') for domain in domains if domain)
+
+
+# Результат проверки сообщения
+class ModerationVerdict:
+    __slots__ = ('rules', 'action', 'restrict_seconds')
+
+    def __init__(self, rules):
+        self.rules = rules
+        strictest = max(rules, key=lambda rule: ACTION_SEVERITY[rule.action])
+        self.action = strictest.action
+        self.restrict_seconds = max(
+            (rule.restrict_seconds for rule in rules if rule.action == ACTION_RESTRICT), default=0
+        )
+
+    @property
+    def rule_ids(self):
+        return [rule.rule_id for rule in self.rules]
+
+
+# Скомпилированный набор правил модерации
+class ModerationEngine:
+    """
+    Все ключевые слова собираются в один автомат Ахо–Корасик: он за один проход
+    отбирает правила-кандидаты, а затем ключевые слова кандидата проверяются
+    на границы слов. Регулярные выражения и шаблоны доменов компилируются
+    по отдельности и проверяются независимо, поэтому пересекающиеся совпадения
+    разных правил не теряются, а обратные ссылки в шаблонах работают как написаны.
+    Для каждого правила ведётся счётчик срабатываний.
+    """
+
+    def __init__(self, rules):
+        self.rules = {rule.rule_id: rule for rule in rules}
+        self.hits = {rule.rule_id: 0 for rule in rules}
+        self.checked = 0
+        self._automaton = AhoCorasick(
+            (keyword, rule.rule_id) for rule in rules for keyword in rule.keywords
+        )
+        # Ключевое слово должно стоять отдельным словом: «скам» не срабатывает в «скамейке»
+        self._keyword_regexes = {
+            rule.rule_id: re.compile(
+                r"(?<!\w)(?:" + '|'.join(re.escape(keyword) for keyword in rule.keywords) + r")(?!\w)"
+            )
+            for rule in rules if rule.keywords
+        }
+        self._pattern_rules = []  # [(rule_id, скомпилированный шаблон), ...]
+        for rule in rules:
+            patterns = list(rule.regexes)
+            if rule.domains:
+                domains = '|'.join(re.escape(domain) for domain in rule.domains)
+                patterns.append(rf"(?<![\w.-])(?:[\w-]+\.)*(?:{domains})(?![\w-])")
+            for pattern in patterns:
+                # ошибка в шаблоне указывает на конкретное правило
+                self._pattern_rules.append((rule.rule_id, re.compile(pattern, re.IGNORECASE)))
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'ModerationEngine':
+        rules = []
+        for item in config.get('rules', []):
+            rules.append(ModerationRule(
+                rule_id=item['id'],
+                description=item.get('description', ''),
+                action=item.get('action', ACTION_DELETE),
+                restrict_seconds=item.get('restrict_seconds', DEFAULT_RESTRICT_SECONDS),
+                keywords=item.get('keywords', ()),
+                regexes=item.get('regexes', ()),
+                domains=item.get('domains', ()),
+            ))
+        return cls(rules)
+
+    @classmethod
+    def from_file(cls, path: str) -> 'ModerationEngine':
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls.from_config(json.load(f))
+
+    def match(self, text: str) -> set:
+        """Возвращает идентификаторы сработавших правил."""
+        normalized = normalize_text(text)
+        matched = {
+            rule_id for rule_id in self._automaton.find(normalized)
+            if self._keyword_regexes[rule_id].search(normalized)
+        }
+        for rule_id, pattern in self._pattern_rules:
+            if rule_id not in matched and pattern.search(text):
+                matched.add(rule_id)
+        return matched
+
+    def check(self, text: str):
+        """Проверяет сообщение и возвращает ModerationVerdict или None."""
+        self.checked += 1
+        matched = self.match(text)
+        if not matched:
+            return None
+        for rule_id in matched:
+            self.hits[rule_id] += 1
+        return ModerationVerdict([self.rules[rule_id] for rule_id in matched])
+
+    def adopt_stats(self, other: 'ModerationEngine'):
+        """
+        Переносит счётчики прежнего движка при перезагрузке правил: общий счётчик
+        проверок и срабатывания правил, оставшихся в новой конфигурации.
+        """
+        self.checked = other.checked
+        for rule_id, hits in other.hits.items():
+            if rule_id in self.hits:
+                self.hits[rule_id] = hits
+
+    def stats(self) -> dict:
+        return {'checked': self.checked, 'hits': dict(self.hits)}
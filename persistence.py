@@ -0,0 +1,228 @@
+import asyncio
+import json
+import logging
+
+import aiosqlite
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+# Интервал сброса изменённых ключей на диск (в секундах)
+FLUSH_INTERVAL = 5
+
+
+# Персистентность состояния бота в SQLite с пакетной записью изменённых ключей
+class SqlitePersistence(BasePersistence):
+    """
+    Хранит context.user_data, состояния ConversationHandler, ожидающих регистрации
+    пользователей и отслеживаемые сообщения (последние два — по ключу (group_id, user_id)).
+    Изменения накапливаются в памяти
+    и записываются одной транзакцией раз в FLUSH_INTERVAL секунд — только
+    изменённые ключи.
+    """
+
+    def __init__(self, path: str, flush_interval: float = FLUSH_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=flush_interval
+        )
+        self.path = path
+        self.flush_interval = flush_interval
+        self.db = None
+        self._open_lock = asyncio.Lock()
+        self._flush_lock = asyncio.Lock()
+        self._flush_task = None
+        # Изменённые ключи: значение None означает удаление строки
+        self._dirty_user_data = {}
+        self._dirty_conversations = {}
+        self._dirty_pending = {}
+        self._dirty_messages = {}
+
+    async def _ensure_open(self):
+        async with self._open_lock:
+            if self.db is not None:
+                return
+            self.db = await aiosqlite.connect(self.path)
+            await self.db.execute("PRAGMA journal_mode=WAL")
+            await self.db.execute("PRAGMA synchronous=NORMAL")
+            await self.db.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS user_data (
+                    user_id INTEGER PRIMARY KEY,
+                    data    TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS conversations (
+                    name  TEXT NOT NULL,
+                    key   TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    PRIMARY KEY (name, key)
+                );
+                CREATE TABLE IF NOT EXISTS pending_users (
+                    group_id INTEGER NOT NULL,
+                    user_id  INTEGER NOT NULL,
+                    deadline REAL NOT NULL,
+                    PRIMARY KEY (group_id, user_id)
+                );
+                CREATE TABLE IF NOT EXISTS user_messages (
+                    group_id    INTEGER NOT NULL,
+                    user_id     INTEGER NOT NULL,
+                    message_ids TEXT NOT NULL,
+                    PRIMARY KEY (group_id, user_id)
+                );
+                """
+            )
+            await self.db.commit()
+            self._flush_task = asyncio.create_task(self._flush_loop())
+            logger.info(f"Персистентность состояния открыта: {self.path}")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self._flush_dirty()
+            except Exception as e:
+                logger.error(f"Ошибка сброса состояния на диск: {e}")
+
+    def _has_dirty(self) -> bool:
+        return bool(
+            self._dirty_user_data or self._dirty_conversations
+            or self._dirty_pending or self._dirty_messages
+        )
+
+    async def _flush_dirty(self):
+        async with self._flush_lock:
+            if self.db is None or not self._has_dirty():
+                return
+            user_data, self._dirty_user_data = self._dirty_user_data, {}
+            conversations, self._dirty_conversations = self._dirty_conversations, {}
+            pending, self._dirty_pending = self._dirty_pending, {}
+            messages, self._dirty_messages = self._dirty_messages, {}
+
+            await self.db.executemany(
+                "INSERT OR REPLACE INTO user_data (user_id, data) VALUES (?, ?)",
+                [(uid, json.dumps(data, ensure_ascii=False)) for uid, data in user_data.items() if data is not None]
+            )
+            await self.db.executemany(
+                "DELETE FROM user_data WHERE user_id = ?",
+                [(uid,) for uid, data in user_data.items() if data is None]
+            )
+            await self.db.executemany(
+                "INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)",
+                [(name, key, json.dumps(state)) for (name, key), state in conversations.items() if state is not None]
+            )
+            await self.db.executemany(
+                "DELETE FROM conversations WHERE name = ? AND key = ?",
+                [(name, key) for (name, key), state in conversations.items() if state is None]
+            )
+            await self.db.executemany(
+                "INSERT OR REPLACE INTO pending_users (group_id, user_id, deadline) VALUES (?, ?, ?)",
+                [(*key, deadline) for key, deadline in pending.items() if deadline is not None]
+            )
+            await self.db.executemany(
+                "DELETE FROM pending_users WHERE group_id = ? AND user_id = ?",
+                [key for key, deadline in pending.items() if deadline is None]
+            )
+            await self.db.executemany(
+                "INSERT OR REPLACE INTO user_messages (group_id, user_id, message_ids) VALUES (?, ?, ?)",
+                [(*key, json.dumps(ids)) for key, ids in messages.items() if ids is not None]
+            )
+            await self.db.executemany(
+                "DELETE FROM user_messages WHERE group_id = ? AND user_id = ?",
+                [key for key, ids in messages.items() if ids is None]
+            )
+            await self.db.commit()
+            logger.debug(
+                f"Состояние сброшено на диск: user_data={len(user_data)}, conversations={len(conversations)}, "
+                f"pending={len(pending)}, messages={len(messages)}."
+            )
+
+    # --- Ожидающие регистрации пользователи и отслеживаемые сообщения ---
+
+    def save_pending(self, group_id: int, user_id: int, deadline: float):
+        """Помечает ожидающего пользователя группы для записи вместе с крайним сроком регистрации."""
+        self._dirty_pending[(group_id, user_id)] = deadline
+
+    def drop_pending(self, group_id: int, user_id: int):
+        self._dirty_pending[(group_id, user_id)] = None
+
+    def save_messages(self, group_id: int, user_id: int, message_ids):
+        self._dirty_messages[(group_id, user_id)] = list(message_ids)
+
+    def drop_messages(self, group_id: int, user_id: int):
+        self._dirty_messages[(group_id, user_id)] = None
+
+    async def load_pending(self) -> dict:
+        """Возвращает {(group_id, user_id): deadline} для всех ожидающих пользователей."""
+        await self._ensure_open()
+        async with self.db.execute("SELECT group_id, user_id, deadline FROM pending_users") as cursor:
+            return {(row[0], row[1]): row[2] async for row in cursor}
+
+    async def load_messages(self) -> dict:
+        """Возвращает {(group_id, user_id): [записи]} для всех отслеживаемых переписок."""
+        await self._ensure_open()
+        async with self.db.execute("SELECT group_id, user_id, message_ids FROM user_messages") as cursor:
+            return {(row[0], row[1]): json.loads(row[2]) async for row in cursor}
+
+    # --- Интерфейс BasePersistence ---
+
+    async def get_user_data(self):
+        await self._ensure_open()
+        async with self.db.execute("SELECT user_id, data FROM user_data") as cursor:
+            return {row[0]: json.loads(row[1]) async for row in cursor}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str):
+        await self._ensure_open()
+        async with self.db.execute(
+            "SELECT key, state FROM conversations WHERE name = ?", (name,)
+        ) as cursor:
+            return {tuple(json.loads(row[0])): json.loads(row[1]) async for row in cursor}
+
+    async def update_conversation(self, name: str, key, new_state):
+        self._dirty_conversations[(name, json.dumps(list(key)))] = new_state
+
+    async def update_user_data(self, user_id: int, data):
+        self._dirty_user_data[user_id] = data
+
+    async def update_chat_data(self, chat_id: int, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id: int):
+        pass
+
+    async def drop_user_data(self, user_id: int):
+        self._dirty_user_data[user_id] = None
+
+    async def refresh_user_data(self, user_id: int, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        """Вызывается при остановке приложения: записывает остатки и закрывает базу."""
+        if self._flush_task:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self._flush_dirty()
+        if self.db is not None:
+            await self.db.close()
+            self.db = None
+            logger.info("Персистентность состояния закрыта.")
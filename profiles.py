@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Время жизни записи профиля (в секундах) и максимальный размер кэша
+PROFILE_TTL = 6 * 3600
+PROFILE_CACHE_SIZE = 10000
+# Максимум одновременных запросов get_chat при обновлении кэша
+PROFILE_FETCH_CONCURRENCY = 10
+
+
+# LRU-кэш профилей пользователей с ограничением времени жизни
+class ProfileCache:
+    """
+    Хранит полное имя пользователя по user_id. Заполняется бесплатно из
+    обновлений chat_member, а недостающие записи догружает через get_chat
+    пачками с ограниченной параллельностью.
+    """
+
+    def __init__(self, ttl: float = PROFILE_TTL, max_size: int = PROFILE_CACHE_SIZE,
+                 fetch_concurrency: int = PROFILE_FETCH_CONCURRENCY):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.fetch_concurrency = fetch_concurrency
+        self._entries = OrderedDict()  # user_id -> (full_name, время записи)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def put(self, user_id: int, full_name: str, now: float = None):
+        if now is None:
+            now = time.monotonic()
+        self._entries[user_id] = (full_name, now)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def remember(self, user):
+        """Запоминает профиль из объекта telegram.User, полученного в обновлении."""
+        if user is not None:
+            self.put(user.id, user.full_name)
+
+    def get(self, user_id: int, now: float = None):
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        if now is None:
+            now = time.monotonic()
+        full_name, stored_at = entry
+        if now - stored_at > self.ttl:
+            del self._entries[user_id]
+            return None
+        self._entries.move_to_end(user_id)
+        return full_name
+
+    def discard(self, user_id: int):
+        self._entries.pop(user_id, None)
+
+    async def get_many(self, bot, user_ids) -> dict:
+        """
+        Возвращает {user_id: полное имя или None}. Отсутствующие в кэше
+        профили запрашиваются через get_chat не более fetch_concurrency одновременно.
+        """
+        result = {}
+        missing = []
+        for user_id in user_ids:
+            full_name = self.get(user_id)
+            if full_name is None:
+                missing.append(user_id)
+            else:
+                result[user_id] = full_name
+        self.hits += len(result)
+        self.misses += len(missing)
+
+        semaphore = asyncio.Semaphore(self.fetch_concurrency)
+
+        async def fetch(user_id):
+            async with semaphore:
+                try:
+                    chat = await bot.get_chat(user_id)
+                    self.put(user_id, chat.full_name)
+                    result[user_id] = chat.full_name
+                except Exception as e:
+                    logger.error(f"Ошибка получения информации о пользователе ID={user_id}: {e}")
+                    result[user_id] = None
+
+        if missing:
+            await asyncio.gather(*(fetch(user_id) for user_id in missing))
+        return result
@@ -0,0 +1,322 @@
+import contextvars
+import functools
+import heapq
+import itertools
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Период снятия стека профилировщиком и предельная длительность профилирования (в секундах)
+PROFILE_INTERVAL = 0.005
+MAX_PROFILE_SECONDS = 300
+# Трассировка медленных обновлений: порог обновления, порог блокировки цикла событий, сколько хранить
+SLOW_UPDATE_THRESHOLD = 0.5
+LOOP_BLOCK_THRESHOLD = 0.1
+SLOW_TRACES_KEPT = 50
+# Ограничения размера одной трассы
+MAX_TRACE_API_CALLS = 100
+MAX_STACK_DEPTH = 64
+
+# Трасса обновления, обрабатываемого в текущей задаче
+current_trace = contextvars.ContextVar('current_trace', default=None)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+# Функция для получения стека кадра в формате collapsed stack: от корня к вершине через ';'
+def collapse_stack(frame, depth: int = MAX_STACK_DEPTH) -> str:
+    labels = []
+    while frame is not None and len(labels) < depth:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+def _thread_stack(thread_id: int) -> str:
+    frame = sys._current_frames().get(thread_id)
+    return collapse_stack(frame) if frame is not None else ''
+
+
+# Сэмплирующий профилировщик потока цикла событий
+class SamplingProfiler:
+    """
+    Фоновый поток раз в interval снимает стек потока цикла событий через
+    sys._current_frames(). Накладные расходы не зависят от числа вызовов функций,
+    поэтому профилировщик можно включать на работающем боте. Результат — строки
+    collapsed stack ("кадр;кадр;кадр число"), которые принимают flamegraph.pl и speedscope.
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self.samples = Counter()
+        self.started = None
+        self.duration = 0.0
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, thread_id: int = None):
+        if self.running:
+            raise RuntimeError("Профилирование уже выполняется")
+        target = thread_id or threading.get_ident()
+        self.samples = Counter()
+        self.started = time.monotonic()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(target,), name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def _run(self, thread_id: int):
+        while not self._stop.wait(self.interval):
+            stack = _thread_stack(thread_id)
+            if stack:
+                self.samples[stack] += 1
+
+    def stop(self) -> Counter:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            self.duration = time.monotonic() - self.started
+        return self.samples
+
+    def collapsed(self) -> str:
+        return ''.join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+    def top_functions(self, limit: int = 10) -> list:
+        """Функции, чаще всего находившиеся на вершине стека: [(кадр, доля)]."""
+        total = sum(self.samples.values())
+        leaves = Counter()
+        for stack, count in self.samples.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        return [(label, count / total) for label, count in leaves.most_common(limit)] if total else []
+
+
+# Трасса одного обновления
+class UpdateTrace:
+    __slots__ = ('update_id', 'kind', 'user_id', 'chat_id', 'started', 'duration',
+                 'handlers', 'api_calls', 'blocks')
+
+    def __init__(self, update):
+        self.update_id = getattr(update, 'update_id', None)
+        self.kind = _update_kind(update)
+        user = getattr(update, 'effective_user', None)
+        chat = getattr(update, 'effective_chat', None)
+        self.user_id = user.id if user is not None else None
+        self.chat_id = chat.id if chat is not None else None
+        self.started = time.time()
+        self.duration = 0.0
+        self.handlers = []   # (имя обработчика, длительность)
+        self.api_calls = []  # (метод Bot API, длительность, ошибка или None)
+        self.blocks = []     # (длительность блокировки цикла, стек)
+
+    def format(self) -> str:
+        lines = [
+            f"update_id={self.update_id} {self.kind} user={self.user_id} chat={self.chat_id} "
+            f"{time.strftime('%H:%M:%S', time.localtime(self.started))} — {self.duration * 1000:.1f} мс"
+        ]
+        for name, duration in self.handlers:
+            lines.append(f"  обработчик {name}: {duration * 1000:.1f} мс")
+        for endpoint, duration, error in self.api_calls:
+            lines.append(f"  API {endpoint}: {duration * 1000:.1f} мс" + (f" ({error})" if error else ""))
+        for duration, stack in self.blocks:
+            lines.append(f"  блокировка цикла событий: {duration * 1000:.1f} мс")
+            for label in stack.split(';')[-8:] if stack else ():
+                lines.append(f"    {label}")
+        return '\n'.join(lines)
+
+
+def _update_kind(update) -> str:
+    for kind in ('message', 'edited_message', 'callback_query', 'chat_member', 'my_chat_member'):
+        if getattr(update, kind, None) is not None:
+            return kind
+    return type(update).__name__
+
+
+# Сторож цикла событий: замечает блокировки и снимает стек заблокировавшего кода
+class LoopBlockMonitor:
+    """
+    Цикл событий каждые interval отмечает «пульс». Если пульса нет дольше
+    threshold, фоновый поток снимает стек потока цикла — это и есть код,
+    который блокирует цикл (синхронный ввод-вывод, тяжёлые вычисления).
+    Когда цикл освобождается, on_block(длительность, стек) вызывается в цикле.
+    """
+
+    def __init__(self, threshold: float, on_block, interval: float = None):
+        self.threshold = threshold
+        self.on_block = on_block
+        self.interval = interval or min(0.05, threshold / 2)
+        self._loop = None
+        self._loop_thread = None
+        self._beat = 0.0
+        self._stack = None
+        self._handle = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self, loop):
+        self._loop = loop
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._handle = loop.call_later(self.interval, self._tick)
+        self._thread = threading.Thread(target=self._watch, name='loop-block-monitor', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _tick(self):
+        now = time.monotonic()
+        lag = now - self._beat - self.interval
+        self._beat = now
+        if lag >= self.threshold:
+            stack, self._stack = self._stack, None
+            self.on_block(lag, stack)
+        self._handle = self._loop.call_later(self.interval, self._tick)
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            beat = self._beat
+            if self._stack is None and time.monotonic() - beat - self.interval >= self.threshold:
+                stack = _thread_stack(self._loop_thread)
+                # Цикл мог освободиться, пока снимался стек
+                if beat == self._beat:
+                    self._stack = stack
+
+
+# Трассировщик медленных обновлений
+class SlowUpdateTracer:
+    """
+    Пока включён, для каждого обновления собирает цепочку обработчиков, вызовы
+    Bot API с длительностями и блокировки цикла событий. Трассы дольше threshold
+    попадают в ограниченный буфер, где хранятся keep самых медленных.
+    Выключенный трассировщик стоит одной проверки флага на обновление.
+    """
+
+    def __init__(self, threshold: float = SLOW_UPDATE_THRESHOLD, block_threshold: float = LOOP_BLOCK_THRESHOLD,
+                 keep: int = SLOW_TRACES_KEPT):
+        self.threshold = threshold
+        self.block_threshold = block_threshold
+        self.keep = keep
+        self.enabled = False
+        self.traced = 0
+        self.slow = 0
+        self.recent_blocks = deque(maxlen=keep)  # (время, длительность, стек), в том числе вне обновлений
+        self._slowest = []  # min-куча (длительность, номер, трасса)
+        self._sequence = itertools.count()
+        self._active = set()
+        self._monitor = None
+
+    def enable(self, loop, threshold: float = None, block_threshold: float = None):
+        if threshold is not None:
+            self.threshold = threshold
+        if block_threshold is not None:
+            self.block_threshold = block_threshold
+        if self._monitor is not None:
+            self._monitor.stop()
+        self._monitor = LoopBlockMonitor(self.block_threshold, self._on_block)
+        self._monitor.start(loop)
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+        if self._monitor is not None:
+            self._monitor.stop()
+            self._monitor = None
+
+    def clear(self):
+        self._slowest.clear()
+        self.recent_blocks.clear()
+        self.traced = self.slow = 0
+
+    @contextmanager
+    def trace(self, update):
+        trace = UpdateTrace(update)
+        token = current_trace.set(trace)
+        self._active.add(trace)
+        started = time.perf_counter()
+        try:
+            yield trace
+        finally:
+            trace.duration = time.perf_counter() - started
+            self._active.discard(trace)
+            current_trace.reset(token)
+            self.traced += 1
+            if trace.duration >= self.threshold:
+                self.slow += 1
+                self._remember(trace)
+
+    def _remember(self, trace: UpdateTrace):
+        item = (trace.duration, next(self._sequence), trace)
+        if len(self._slowest) < self.keep:
+            heapq.heappush(self._slowest, item)
+        elif item[0] > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, item)
+
+    def _on_block(self, duration: float, stack):
+        self.recent_blocks.append((time.time(), duration, stack))
+        for trace in self._active:
+            trace.blocks.append((duration, stack))
+
+    def slowest(self) -> list:
+        return [trace for _, _, trace in sorted(self._slowest, reverse=True)]
+
+    def report(self) -> str:
+        lines = [
+            f"Трассировка: {'включена' if self.enabled else 'выключена'}, порог обновления "
+            f"{self.threshold * 1000:.0f} мс, порог блокировки {self.block_threshold * 1000:.0f} мс.",
+            f"Обновлений: {self.traced}, медленных: {self.slow}, хранится: {len(self._slowest)}.",
+            "",
+        ]
+        for trace in self.slowest():
+            lines.append(trace.format())
+            lines.append("")
+        if self.recent_blocks:
+            lines.append("Последние блокировки цикла событий:")
+            for moment, duration, stack in self.recent_blocks:
+                lines.append(f"  {time.strftime('%H:%M:%S', time.localtime(moment))} {duration * 1000:.1f} мс: "
+                             f"{stack.rsplit(';', 1)[-1] if stack else 'стек не снят'}")
+        return '\n'.join(lines) + '\n'
+
+
+# Функция для учёта вызова Bot API в трассе текущего обновления
+def record_api_call(endpoint: str, duration: float, error=None):
+    trace = current_trace.get()
+    if trace is not None and len(trace.api_calls) < MAX_TRACE_API_CALLS:
+        trace.api_calls.append((endpoint, duration, type(error).__name__ if error is not None else None))
+
+
+# Декоратор: обработчик попадает в цепочку трассы текущего обновления
+def trace_handler(callback, name: str = None):
+    name = name or getattr(callback, '__name__', repr(callback))
+
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        trace = current_trace.get()
+        if trace is None:
+            return await callback(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        finally:
+            trace.handlers.append((name, time.perf_counter() - started))
+
+    return wrapper
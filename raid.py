@@ -0,0 +1,137 @@
+import asyncio
+import html
+import logging
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Порог режима рейда: RAID_JOIN_THRESHOLD вступлений за RAID_WINDOW секунд
+RAID_JOIN_THRESHOLD = 10
+RAID_WINDOW = 10
+# Сколько секунд режим рейда держится после последнего превышения порога
+RAID_COOLDOWN = 60
+# Окно, за которое приветствия собираются в одно сообщение (в секундах)
+WELCOME_BATCH_WINDOW = 3
+# Максимум упоминаний в одном сводном приветствии
+WELCOME_BATCH_MAX_MENTIONS = 50
+# Бот может удалять сообщения в группе не старше 48 часов — более старые приветствия не отслеживаются
+WELCOME_MESSAGE_TTL = 48 * 3600
+
+
+# Детектор рейдов по частоте вступлений в скользящем окне
+class RaidDetector:
+    def __init__(self, threshold: int = RAID_JOIN_THRESHOLD, window: float = RAID_WINDOW,
+                 cooldown: float = RAID_COOLDOWN):
+        self.threshold = threshold
+        self.window = window
+        self.cooldown = cooldown
+        self._joins = {}         # group_id -> deque с временем вступлений
+        self._active_until = {}  # group_id -> время окончания режима рейда
+
+    def register_join(self, group_id: int, now: float = None) -> bool:
+        """Учитывает вступление и возвращает True, если в группе действует режим рейда."""
+        if now is None:
+            now = time.monotonic()
+        joins = self._joins.get(group_id)
+        if joins is None:
+            joins = self._joins[group_id] = deque()
+        joins.append(now)
+        while joins and joins[0] <= now - self.window:
+            joins.popleft()
+
+        if len(joins) >= self.threshold:
+            if not self.is_active(group_id, now):
+                logger.warning(f"Режим рейда включён в группе ID={group_id}: {len(joins)} вступлений за {self.window} с.")
+            self._active_until[group_id] = now + self.cooldown
+        return self.is_active(group_id, now)
+
+    def is_active(self, group_id: int, now: float = None) -> bool:
+        if now is None:
+            now = time.monotonic()
+        until = self._active_until.get(group_id)
+        if until is None:
+            return False
+        if until <= now:
+            del self._active_until[group_id]
+            logger.info(f"Режим рейда в группе ID={group_id} завершён.")
+            return False
+        return True
+
+
+# Сборщик приветствий: одно сообщение на много новых участников
+class WelcomeAggregator:
+    """
+    Накапливает новых участников группы и раз в WELCOME_BATCH_WINDOW секунд
+    отправляет одно сообщение с упоминаниями и общей клавиатурой
+    (reply_markup_factory(bot, group_id) — клавиатура своя у каждой группы).
+    Предыдущее сводное сообщение удаляется, чтобы они не копились в чате;
+    запись о нём хранится, пока его можно удалить (WELCOME_MESSAGE_TTL).
+    """
+
+    def __init__(self, reply_markup_factory, window: float = WELCOME_BATCH_WINDOW,
+                 max_mentions: int = WELCOME_BATCH_MAX_MENTIONS, message_ttl: float = WELCOME_MESSAGE_TTL):
+        self.reply_markup_factory = reply_markup_factory
+        self.window = window
+        self.max_mentions = max_mentions
+        self.message_ttl = message_ttl
+        self._pending = {}        # group_id -> [(user_id, first_name), ...]
+        self._flush_tasks = {}    # group_id -> asyncio.Task
+        self._last_messages = {}  # group_id -> (время отправки, [message_id, ...])
+
+    def _prune_expired(self, now: float):
+        expired = [
+            group_id for group_id, (sent_at, _) in self._last_messages.items()
+            if now - sent_at >= self.message_ttl
+        ]
+        for group_id in expired:
+            del self._last_messages[group_id]
+
+    def add(self, bot, group_id: int, user_id: int, first_name: str):
+        self._prune_expired(time.time())
+        self._pending.setdefault(group_id, []).append((user_id, first_name))
+        if group_id not in self._flush_tasks:
+            self._flush_tasks[group_id] = asyncio.create_task(self._flush_later(bot, group_id))
+
+    @staticmethod
+    def render_mentions(users) -> str:
+        return ", ".join(
+            f"<a href='tg://user?id={user_id}'>{html.escape(first_name or str(user_id))}</a>"
+            for user_id, first_name in users
+        )
+
+    async def _flush_later(self, bot, group_id: int):
+        try:
+            await asyncio.sleep(self.window)
+        finally:
+            self._flush_tasks.pop(group_id, None)
+        users = self._pending.pop(group_id, [])
+        if users:
+            await self.flush(bot, group_id, users)
+
+    async def flush(self, bot, group_id: int, users):
+        self._prune_expired(time.time())
+        _, previous = self._last_messages.pop(group_id, (0.0, []))
+        reply_markup = self.reply_markup_factory(bot, group_id)
+        sent = []
+        for start in range(0, len(users), self.max_mentions):
+            chunk = users[start:start + self.max_mentions]
+            try:
+                message = await bot.send_message(
+                    chat_id=group_id,
+                    text=f"Добро пожаловать, {self.render_mentions(chunk)}! Чтобы остаться в группе, пожалуйста, зарегистрируйтесь через нашего бота.",
+                    reply_markup=reply_markup,
+                    parse_mode='HTML'
+                )
+                sent.append(message.message_id)
+            except Exception as e:
+                logger.error(f"Ошибка отправки сводного приветствия в группу ID={group_id}: {e}")
+        if sent:
+            self._last_messages[group_id] = (time.time(), sent)
+        logger.info("Отправлено сводное приветствие для %s участников в группу ID=%s.", len(users), group_id)
+
+        for message_id in previous:
+            try:
+                await bot.delete_message(chat_id=group_id, message_id=message_id)
+            except Exception as e:
+                logger.debug("Не удалось удалить прошлое сводное приветствие ID=%s: %s", message_id, e)
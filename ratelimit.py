@@ -0,0 +1,286 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Классы приоритетов: меньше — важнее
+PRIORITY_MODERATION = 0  # ограничения и баны
+PRIORITY_MESSAGE = 1     # приветствия, вопросы анкеты и прочие сообщения
+PRIORITY_CLEANUP = 2     # удаление старых сообщений
+PRIORITY_NAMES = {PRIORITY_MODERATION: 'moderation', PRIORITY_MESSAGE: 'message', PRIORITY_CLEANUP: 'cleanup'}
+
+ENDPOINT_PRIORITIES = {
+    'restrictChatMember': PRIORITY_MODERATION,
+    'banChatMember': PRIORITY_MODERATION,
+    'unbanChatMember': PRIORITY_MODERATION,
+    'deleteMessage': PRIORITY_CLEANUP,
+    'deleteMessages': PRIORITY_CLEANUP,
+}
+
+# Лимиты Telegram: ~30 сообщений/с на бота, ~20 сообщений/мин в группу, ~1 сообщение/с в личный чат
+GLOBAL_RATE = 30
+GLOBAL_BURST = 30
+GROUP_RATE = 20 / 60
+GROUP_BURST = 3
+PRIVATE_RATE = 1
+PRIVATE_BURST = 3
+
+# Сколько раз повторять запрос после RetryAfter
+MAX_RETRIES = 5
+
+
+# Корзина токенов
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Сколько секунд ждать до появления токена (0 — токен есть)."""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+
+# Очередь запросов одного чата
+class _ChatLane:
+    __slots__ = ('key', 'bucket', 'heap', 'blocked_until', 'scheduled', 'ready_entry')
+
+    def __init__(self, key, bucket):
+        self.key = key
+        self.bucket = bucket
+        self.heap = []
+        self.blocked_until = 0.0
+        self.scheduled = False
+        self.ready_entry = None  # актуальная запись этого чата в очереди готовых
+
+    def wait_time(self, now: float) -> float:
+        blocked = max(0.0, self.blocked_until - now)
+        if self.bucket is None:
+            return blocked
+        return max(blocked, self.bucket.wait_time(now))
+
+
+# Центральная очередь исходящих запросов к Bot API с приоритетами
+class PriorityRateLimiter(BaseRateLimiter):
+    """
+    Пропускает все запросы бота через общую очередь с приоритетами.
+    Действует глобальная корзина токенов и корзины на каждый чат для отправки сообщений.
+    Ограничения и баны обслуживаются раньше приветствий, приветствия — раньше удаления сообщений.
+    При RetryAfter чат (или весь бот) ставится на паузу, а запрос повторяется.
+    Приоритет можно задать явно: rate_limit_args={'priority': PRIORITY_CLEANUP}.
+    observer(endpoint, длительность, ошибка или None) вызывается после каждого
+    фактического обращения к Bot API (время ожидания в очереди не входит).
+    """
+
+    def __init__(self, global_rate: float = GLOBAL_RATE, global_burst: float = GLOBAL_BURST,
+                 max_retries: int = MAX_RETRIES, observer=None):
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.max_retries = max_retries
+        self._global_blocked_until = 0.0
+        self._lanes = {}
+        self._ready = []     # (priority, seq, lane_key) — чаты, готовые к отправке
+        self._sleeping = []  # (ready_at, seq, lane_key) — чаты, ожидающие токен
+        self._counter = itertools.count()
+        self._wakeup = None
+        self._task = None
+        self._queued = 0
+        self._queued_by_priority = {PRIORITY_MODERATION: 0, PRIORITY_MESSAGE: 0, PRIORITY_CLEANUP: 0}
+        self.sent = 0
+        self.retries = 0
+        self.observer = observer
+
+    async def initialize(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._dispatch_loop())
+
+    async def shutdown(self):
+        if self._task:
+            task, self._task = self._task, None
+            task.cancel()
+            # Дожидаемся отмены, иначе цикл событий закроется с незавершённой задачей
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self) -> dict:
+        """Текущая глубина очереди и счётчики."""
+        return {
+            'queued': self._queued,
+            'queued_by_priority': dict(self._queued_by_priority),
+            'lanes': len(self._lanes),
+            'sent': self.sent,
+            'retries': self.retries,
+        }
+
+    @staticmethod
+    def _lane_key(endpoint: str, data: dict):
+        # Лимиты на чат действуют только для отправки и редактирования сообщений
+        if not (endpoint.startswith('send') or endpoint.startswith('edit')):
+            return None
+        return data.get('chat_id')
+
+    def _get_lane(self, key):
+        lane = self._lanes.get(key)
+        if lane is None:
+            bucket = None
+            if isinstance(key, int):
+                if key < 0:
+                    bucket = TokenBucket(GROUP_RATE, GROUP_BURST)
+                else:
+                    bucket = TokenBucket(PRIVATE_RATE, PRIVATE_BURST)
+            lane = _ChatLane(key, bucket)
+            self._lanes[key] = lane
+        return lane
+
+    def _schedule_lane(self, lane, now: float):
+        if lane.scheduled or not lane.heap:
+            return
+        lane.scheduled = True
+        wait = lane.wait_time(now)
+        if wait > 0:
+            heapq.heappush(self._sleeping, (now + wait, next(self._counter), lane.key))
+        else:
+            self._push_ready(lane)
+
+    def _push_ready(self, lane):
+        head = lane.heap[0]
+        lane.ready_entry = (head[0], head[1], lane.key)
+        heapq.heappush(self._ready, lane.ready_entry)
+
+    async def _acquire(self, priority: int, lane_key):
+        future = asyncio.get_running_loop().create_future()
+        lane = self._get_lane(lane_key)
+        heapq.heappush(lane.heap, (priority, next(self._counter), future))
+        self._queued += 1
+        self._queued_by_priority[priority] = self._queued_by_priority.get(priority, 0) + 1
+        if not lane.scheduled:
+            self._schedule_lane(lane, time.monotonic())
+        elif lane.ready_entry is not None and priority < lane.ready_entry[0]:
+            # Более важный запрос обгоняет устаревшую запись чата в очереди готовых
+            self._push_ready(lane)
+        self._wakeup.set()
+        try:
+            await future
+        finally:
+            self._queued -= 1
+            self._queued_by_priority[priority] -= 1
+
+    async def _dispatch_loop(self):
+        while True:
+            now = time.monotonic()
+            # Перемещаем чаты, у которых появился токен, в очередь готовых
+            while self._sleeping and self._sleeping[0][0] <= now:
+                _, _, key = heapq.heappop(self._sleeping)
+                lane = self._lanes.get(key)
+                if lane is None:
+                    continue
+                lane.scheduled = False
+                self._schedule_lane(lane, now)
+
+            timeout = None
+            if self._sleeping:
+                timeout = self._sleeping[0][0] - now
+            global_wait = max(self._global_blocked_until - now, self.global_bucket.wait_time(now))
+            if self._ready and global_wait > 0:
+                timeout = global_wait if timeout is None else min(timeout, global_wait)
+            elif self._ready:
+                self._grant_next(now)
+                continue
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _grant_next(self, now: float):
+        entry = heapq.heappop(self._ready)
+        lane = self._lanes.get(entry[2])
+        if lane is None or lane.ready_entry is not entry:
+            return  # устаревшая запись
+        key = lane.key
+        lane.scheduled = False
+        lane.ready_entry = None
+        # Пропускаем запросы, ожидание которых было отменено
+        while lane.heap and lane.heap[0][2].done():
+            heapq.heappop(lane.heap)
+        if not lane.heap:
+            del self._lanes[key]
+            return
+        wait = lane.wait_time(now)
+        if wait > 0:
+            self._schedule_lane(lane, now)
+            return
+        _, _, future = heapq.heappop(lane.heap)
+        self.global_bucket.consume()
+        if lane.bucket is not None:
+            lane.bucket.consume()
+        future.set_result(None)
+        if lane.heap:
+            self._schedule_lane(lane, now)
+        elif lane.blocked_until <= now:
+            del self._lanes[key]
+
+    def _block(self, lane_key, retry_after: float):
+        until = time.monotonic() + retry_after
+        if lane_key is None:
+            self._global_blocked_until = max(self._global_blocked_until, until)
+        else:
+            lane = self._get_lane(lane_key)
+            lane.blocked_until = max(lane.blocked_until, until)
+
+    async def _call(self, endpoint, callback, args, kwargs):
+        if self.observer is None:
+            return await callback(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            result = await callback(*args, **kwargs)
+        except Exception as e:
+            self.observer(endpoint, time.perf_counter() - started, e)
+            raise
+        self.observer(endpoint, time.perf_counter() - started, None)
+        return result
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        priority = ENDPOINT_PRIORITIES.get(endpoint, PRIORITY_MESSAGE)
+        if isinstance(rate_limit_args, dict) and 'priority' in rate_limit_args:
+            priority = rate_limit_args['priority']
+        lane_key = self._lane_key(endpoint, data)
+
+        attempt = 0
+        while True:
+            await self._acquire(priority, lane_key)
+            try:
+                result = await self._call(endpoint, callback, args, kwargs)
+                self.sent += 1
+                return result
+            except RetryAfter as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                self.retries += 1
+                logger.warning(
+                    f"RetryAfter {e.retry_after} с для {endpoint} (чат {lane_key}), попытка {attempt}/{self.max_retries}."
+                )
+                self._block(lane_key, e.retry_after)
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import time
+
+from telegram.constants import ChatMemberStatus
+from telegram.error import BadRequest
+
+from ratelimit import PRIORITY_CLEANUP
+
+logger = logging.getLogger(__name__)
+
+# Период сверки участников группы с хранилищем (в секундах)
+RECONCILE_INTERVAL = 1800
+# Размер порции пользователей и число порций за один запуск
+RECONCILE_CHUNK_SIZE = 200
+RECONCILE_CHUNKS_PER_RUN = 5
+# Максимум одновременных запросов get_chat_member
+RECONCILE_CONCURRENCY = 5
+# Ключ курсора продолжения в таблице meta (у каждой группы свой: reconcile_cursor:<group_id>)
+RECONCILE_CURSOR_KEY = 'reconcile_cursor'
+
+DEPARTED_STATUSES = (ChatMemberStatus.LEFT, ChatMemberStatus.BANNED)
+
+
+# Сверка зарегистрированных пользователей с фактическим составом группы
+class MembershipReconciler:
+    """
+    Обходит анкеты группы порциями по user_id и проверяет каждого пользователя
+    через get_chat_member с ограниченной параллельностью и низким приоритетом
+    в общей очереди запросов. Курсор сохраняется в meta после каждой порции,
+    поэтому большая группа проверяется постепенно, за несколько запусков,
+    а после перезапуска обход продолжается с того же места.
+    Ушедшие пользователи удаляются из хранилища одной транзакцией на порцию.
+    check_pending проверяет ожидающих регистрации — их анкет в хранилище нет.
+    """
+
+    def __init__(self, store, chunk_size: int = RECONCILE_CHUNK_SIZE,
+                 chunks_per_run: int = RECONCILE_CHUNKS_PER_RUN,
+                 concurrency: int = RECONCILE_CONCURRENCY):
+        self.store = store
+        self.chunk_size = chunk_size
+        self.chunks_per_run = chunks_per_run
+        self.concurrency = concurrency
+        self.pending_limit = chunk_size * chunks_per_run
+        self.checked = 0
+        self.pruned = 0
+        self.errors = 0
+        self._lock = asyncio.Lock()
+
+    async def _is_departed(self, bot, group_id: int, user_id: int, semaphore: asyncio.Semaphore):
+        """True — ушёл, False — в группе, None — проверить не удалось."""
+        async with semaphore:
+            try:
+                member = await bot.get_chat_member(
+                    chat_id=group_id,
+                    user_id=user_id,
+                    rate_limit_args={'priority': PRIORITY_CLEANUP}
+                )
+            except BadRequest as e:
+                if 'not found' in e.message.lower() or 'participant_id_invalid' in e.message.lower():
+                    return True
+                self.errors += 1
+                logger.debug("Ошибка проверки участника ID=%s в группе ID=%s: %s", user_id, group_id, e)
+                return None
+            except Exception as e:
+                self.errors += 1
+                logger.debug("Ошибка проверки участника ID=%s в группе ID=%s: %s", user_id, group_id, e)
+                return None
+        return member.status in DEPARTED_STATUSES
+
+    async def check_chunk(self, bot, group_id: int, user_ids) -> list:
+        """Возвращает user_id ушедших из группы пользователей порции."""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = await asyncio.gather(
+            *(self._is_departed(bot, group_id, user_id, semaphore) for user_id in user_ids)
+        )
+        self.checked += len(user_ids)
+        return [user_id for user_id, departed in zip(user_ids, results) if departed]
+
+    async def check_pending(self, bot, group_id: int, user_ids) -> list:
+        """Возвращает ушедших из группы среди ожидающих регистрации (не больше pending_limit проверок за запуск)."""
+        user_ids = list(user_ids)[:self.pending_limit]
+        departed = []
+        for start in range(0, len(user_ids), self.chunk_size):
+            departed.extend(await self.check_chunk(bot, group_id, user_ids[start:start + self.chunk_size]))
+        return departed
+
+    async def run(self, bot, group_id: int) -> list:
+        """
+        Проверяет до chunks_per_run порций, начиная с сохранённого курсора,
+        удаляет ушедших из хранилища и возвращает [(user_id, время начала проверки порции)]
+        для удалённых анкет: анкету в памяти, заполненную после этого времени, трогать нельзя.
+        """
+        if self._lock.locked():
+            logger.debug("Сверка участников уже выполняется, запуск пропущен.")
+            return []
+        async with self._lock:
+            cursor_key = f"{RECONCILE_CURSOR_KEY}:{group_id}"
+            stored_cursor = await self.store.get_meta(cursor_key)
+            cursor = int(stored_cursor) if stored_cursor else None
+            departed_all = []
+            for _ in range(self.chunks_per_run):
+                started_at = time.time()
+                page = await self.store.page(group_id, cursor, self.chunk_size)
+                if not page:
+                    cursor = None  # дошли до конца, следующий запуск начнёт сначала
+                    break
+                user_ids = [user_id for user_id, _ in page]
+                departed = await self.check_chunk(bot, group_id, user_ids)
+                if departed:
+                    # Анкеты, обновлённые во время проверки (повторная регистрация), не трогаем:
+                    # вызывающему возвращаются только действительно удалённые
+                    deleted = await self.store.delete_many(group_id, departed, older_than=started_at)
+                    self.pruned += len(deleted)
+                    departed_all.extend((user_id, started_at) for user_id in deleted)
+                cursor = user_ids[-1]
+                await self.store.set_meta(cursor_key, cursor)
+                if len(page) < self.chunk_size:
+                    cursor = None
+                    break
+            if cursor is None:
+                await self.store.set_meta(cursor_key, None)
+        logger.info(
+            f"Сверка участников группы ID={group_id}: удалено {len(departed_all)}, "
+            f"курсор {cursor if cursor is not None else 'сброшен'}."
+        )
+        return departed_all
+
+    def stats(self) -> dict:
+        return {'checked': self.checked, 'pruned': self.pruned, 'errors': self.errors}
@@ -0,0 +1,80 @@
+import sys
+from array import array
+
+from storage import USER_FIELDS
+
+# Поля, значения которых часто повторяются у разных пользователей и интернируются
+INTERNED_FIELDS = ('city', 'car_type', 'year')
+
+
+# Функция для интернирования повторяющегося строкового значения
+def intern_value(value):
+    if isinstance(value, str):
+        return sys.intern(value)
+    return value
+
+
+# Анкета зарегистрированного пользователя в памяти
+class UserRecord:
+    """
+    Компактная запись вместо словаря с пятью ключами: без __dict__, а город,
+    модель автомобиля и год интернированы, поэтому одинаковые значения
+    у тысяч участников хранятся в одном экземпляре строки.
+    """
+    __slots__ = USER_FIELDS
+
+    def __init__(self, name=None, city=None, car_type=None, year=None, purpose=None):
+        self.name = name
+        self.city = intern_value(city)
+        self.car_type = intern_value(car_type)
+        self.year = intern_value(year)
+        self.purpose = purpose
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'UserRecord':
+        return cls(*(data.get(field) for field in USER_FIELDS))
+
+    def to_dict(self) -> dict:
+        return {field: getattr(self, field) for field in USER_FIELDS}
+
+    def get(self, field: str, default=None):
+        value = getattr(self, field, None)
+        return default if value is None else value
+
+    def __repr__(self):
+        return f"UserRecord({self.to_dict()!r})"
+
+
+# Функция для оценки занимаемой объектом памяти вместе с вложенными объектами
+def deep_sizeof(obj, seen: set = None) -> int:
+    """
+    Обходит словари, последовательности, множества, атрибуты объектов и __slots__.
+    Предназначена для структур данных: объекты, ссылающиеся на цикл событий
+    или приложение, передавать не нужно — обход уйдёт во весь граф.
+    Общие объекты (например, интернированные строки) учитываются один раз.
+    """
+    if seen is None:
+        seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        current = stack.pop()
+        if id(current) in seen:
+            continue
+        seen.add(id(current))
+        size += sys.getsizeof(current)
+        if isinstance(current, (str, bytes, int, float, bool, array)) or current is None:
+            continue
+        if isinstance(current, dict):
+            stack.extend(current.keys())
+            stack.extend(current.values())
+        elif isinstance(current, (list, tuple, set, frozenset)):
+            stack.extend(current)
+        else:
+            for cls in type(current).__mro__:
+                for slot in getattr(cls, '__slots__', ()):
+                    if hasattr(current, slot):
+                        stack.append(getattr(current, slot))
+            if hasattr(current, '__dict__'):
+                stack.append(current.__dict__)
+    return size
@@ -0,0 +1,89 @@
+import re
+from collections import Counter
+
+# Поля анкеты, по которым ведутся распределения
+STATS_FIELDS = ('car_type', 'city', 'year')
+
+# Этапы воронки регистрации в порядке прохождения
+FUNNEL_STEPS = ('joins', 'start', 'name', 'city', 'car_type', 'year', 'completed')
+# Исходы, не входящие в основную цепочку воронки
+FUNNEL_OUTCOMES = ('timeouts', 'bans', 'cancelled', 'left')
+
+_SPACES = re.compile(r"\s+")
+
+
+# Функция для приведения значения к ключу счётчика: без учёта регистра и лишних пробелов
+def stats_key(value):
+    if not value:
+        return None
+    return _SPACES.sub(' ', str(value)).strip().casefold() or None
+
+
+# Распределения зарегистрированных пользователей по полям анкеты
+class RegistrationStats:
+    """
+    Счётчики обновляются за O(1) при каждой регистрации и удалении анкеты
+    и пересобираются один раз при загрузке. Для каждого ключа запоминается
+    первое встреченное написание, чтобы показывать его в отчёте.
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.counters = {field: Counter() for field in STATS_FIELDS}
+        self._labels = {field: {} for field in STATS_FIELDS}
+
+    def rebuild(self, records):
+        self.__init__()
+        for record in records:
+            self.add(record)
+
+    def _update(self, record, delta: int):
+        for field in STATS_FIELDS:
+            value = getattr(record, field, None)
+            key = stats_key(value)
+            if key is None:
+                continue
+            counter = self.counters[field]
+            counter[key] += delta
+            if counter[key] <= 0:
+                del counter[key]
+                self._labels[field].pop(key, None)
+            elif delta > 0:
+                self._labels[field].setdefault(key, value.strip())
+
+    def add(self, record):
+        self.total += 1
+        self._update(record, 1)
+
+    def remove(self, record):
+        if record is None:
+            return
+        self.total -= 1
+        self._update(record, -1)
+
+    def top(self, field: str, limit: int = 10) -> list:
+        """Возвращает [(написание, количество), ...] для limit самых частых значений."""
+        labels = self._labels[field]
+        return [(labels.get(key, key), count) for key, count in self.counters[field].most_common(limit)]
+
+    def distinct(self, field: str) -> int:
+        return len(self.counters[field])
+
+
+# Воронка регистрации: сколько пользователей дошли до каждого этапа
+class RegistrationFunnel:
+    """Счётчики с момента запуска бота: этапы FUNNEL_STEPS и исходы FUNNEL_OUTCOMES."""
+
+    def __init__(self):
+        self.counts = dict.fromkeys(FUNNEL_STEPS + FUNNEL_OUTCOMES, 0)
+
+    def step(self, name: str):
+        self.counts[name] += 1
+
+    def conversion(self) -> list:
+        """Возвращает [(этап, количество, доля от присоединившихся), ...]."""
+        joins = self.counts['joins']
+        return [
+            (step, self.counts[step], self.counts[step] / joins if joins else None)
+            for step in FUNNEL_STEPS
+        ]
@@ -0,0 +1,294 @@
+import json
+import logging
+import os
+import time
+from abc import ABC, abstractmethod
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+# Поля анкеты зарегистрированного пользователя (порядок совпадает с колонками таблицы)
+USER_FIELDS = ('name', 'city', 'car_type', 'year', 'purpose')
+# Максимум user_id в одном запросе удаления (лимит параметров SQLite — 999 в старых версиях)
+DELETE_BATCH_SIZE = 500
+
+# Таблица анкет: одна строка на пару (группа, пользователь)
+USERS_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS {table} (
+    group_id   INTEGER NOT NULL,
+    user_id    INTEGER NOT NULL,
+    name       TEXT,
+    city       TEXT,
+    car_type   TEXT,
+    year       TEXT,
+    purpose    TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (group_id, user_id)
+);
+"""
+
+
+# Общий интерфейс хранилища зарегистрированных пользователей
+class UserStore(ABC):
+    """
+    Интерфейс хранилища анкет. Анкета принадлежит паре (group_id, user_id):
+    один пользователь может быть зарегистрирован в нескольких группах.
+    Все изменения выполняются построчно, без перезаписи всего набора данных.
+    """
+
+    async def open(self):
+        """Открывает соединение с хранилищем."""
+
+    async def close(self):
+        """Закрывает соединение с хранилищем."""
+
+    @abstractmethod
+    async def load_all(self) -> dict:
+        """Возвращает словарь {(group_id, user_id): анкета} со всеми анкетами."""
+
+    @abstractmethod
+    async def get(self, group_id: int, user_id: int):
+        """Возвращает анкету пользователя в группе или None."""
+
+    @abstractmethod
+    async def upsert(self, group_id: int, user_id: int, data: dict):
+        """Добавляет или обновляет анкету одного пользователя в группе."""
+
+    @abstractmethod
+    async def delete(self, group_id: int, user_id: int):
+        """Удаляет анкету одного пользователя в группе."""
+
+    @abstractmethod
+    async def delete_many(self, group_id: int, user_ids, older_than: float = None) -> list:
+        """
+        Удаляет анкеты нескольких пользователей группы одной транзакцией и возвращает
+        user_id действительно удалённых. Если задан older_than, анкеты, обновлённые
+        позже этого времени, сохраняются.
+        """
+
+    @abstractmethod
+    async def count(self, group_id: int = None) -> int:
+        """Возвращает количество анкет в группе (без group_id — во всех группах)."""
+
+    @abstractmethod
+    async def page(self, group_id: int, cursor: int = None, limit: int = 10, backward: bool = False) -> list:
+        """
+        Возвращает страницу анкет группы [(user_id, анкета), ...], упорядоченную по user_id.
+        cursor — user_id, после которого (или до которого при backward=True) начинается страница.
+        """
+
+    @abstractmethod
+    def iter_users(self, group_id: int, filters: dict = None, batch_size: int = 1000):
+        """
+        Асинхронный генератор (user_id, анкета) по анкетам группы в порядке user_id.
+        filters — точные значения полей {поле: значение}; строки читаются порциями batch_size.
+        """
+
+    @abstractmethod
+    async def get_meta(self, key: str, default=None):
+        """Возвращает служебное значение по ключу."""
+
+    @abstractmethod
+    async def set_meta(self, key: str, value):
+        """Сохраняет служебное значение (None удаляет ключ)."""
+
+
+# Хранилище на SQLite (aiosqlite) в режиме WAL
+class SqliteUserStore(UserStore):
+    """
+    Хранилище анкет в SQLite. Каждая регистрация или выход — одна строка
+    с ключом (group_id, user_id), индексы (group_id, city), (group_id, car_type)
+    и (group_id, year) ускоряют выборки администраторов своей группы.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.db = None
+
+    async def open(self):
+        self.db = await aiosqlite.connect(self.path)
+        await self.db.execute("PRAGMA journal_mode=WAL")
+        await self.db.execute("PRAGMA synchronous=NORMAL")
+        await self.db.executescript(
+            f"""
+            {USERS_TABLE_SQL.format(table='users')}
+            CREATE INDEX IF NOT EXISTS idx_users_group_city ON users(group_id, city);
+            CREATE INDEX IF NOT EXISTS idx_users_group_car_type ON users(group_id, car_type);
+            CREATE INDEX IF NOT EXISTS idx_users_group_year ON users(group_id, year);
+            CREATE TABLE IF NOT EXISTS meta (
+                key   TEXT PRIMARY KEY,
+                value TEXT
+            );
+            """
+        )
+        await self.db.commit()
+        logger.info(f"Хранилище пользователей открыто: {self.path}")
+
+    async def close(self):
+        if self.db is not None:
+            await self.db.close()
+            self.db = None
+            logger.info("Хранилище пользователей закрыто.")
+
+    @staticmethod
+    def _row_to_data(row) -> dict:
+        return dict(zip(USER_FIELDS, row))
+
+    async def load_all(self) -> dict:
+        users = {}
+        async with self.db.execute(
+            "SELECT group_id, user_id, name, city, car_type, year, purpose FROM users"
+        ) as cursor:
+            async for row in cursor:
+                users[(row[0], row[1])] = self._row_to_data(row[2:])
+        return users
+
+    async def get(self, group_id: int, user_id: int):
+        async with self.db.execute(
+            "SELECT name, city, car_type, year, purpose FROM users WHERE group_id = ? AND user_id = ?",
+            (group_id, user_id)
+        ) as cursor:
+            row = await cursor.fetchone()
+        return self._row_to_data(row) if row else None
+
+    async def upsert(self, group_id: int, user_id: int, data: dict):
+        await self.db.execute(
+            """
+            INSERT INTO users (group_id, user_id, name, city, car_type, year, purpose, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(group_id, user_id) DO UPDATE SET
+                name = excluded.name,
+                city = excluded.city,
+                car_type = excluded.car_type,
+                year = excluded.year,
+                purpose = excluded.purpose,
+                updated_at = excluded.updated_at
+            """,
+            (group_id, user_id, *(data.get(field) for field in USER_FIELDS), time.time())
+        )
+        await self.db.commit()
+
+    async def delete(self, group_id: int, user_id: int):
+        await self.db.execute("DELETE FROM users WHERE group_id = ? AND user_id = ?", (group_id, user_id))
+        await self.db.commit()
+
+    async def delete_many(self, group_id: int, user_ids, older_than: float = None) -> list:
+        user_ids = list(user_ids)
+        deleted = []
+        # Порции по DELETE_BATCH_SIZE укладываются в лимит параметров SQLite
+        for start in range(0, len(user_ids), DELETE_BATCH_SIZE):
+            batch = user_ids[start:start + DELETE_BATCH_SIZE]
+            query = f"DELETE FROM users WHERE group_id = ? AND user_id IN ({', '.join('?' * len(batch))})"
+            params = [group_id, *batch]
+            if older_than is not None:
+                query += " AND updated_at < ?"
+                params.append(older_than)
+            async with self.db.execute(query + " RETURNING user_id", params) as cursor:
+                deleted.extend(row[0] for row in await cursor.fetchall())
+        if user_ids:
+            await self.db.commit()
+        return deleted
+
+    async def count(self, group_id: int = None) -> int:
+        if group_id is None:
+            query, params = "SELECT COUNT(*) FROM users", ()
+        else:
+            query, params = "SELECT COUNT(*) FROM users WHERE group_id = ?", (group_id,)
+        async with self.db.execute(query, params) as cursor:
+            row = await cursor.fetchone()
+        return row[0]
+
+    async def page(self, group_id: int, cursor: int = None, limit: int = 10, backward: bool = False) -> list:
+        query = "SELECT user_id, name, city, car_type, year, purpose FROM users WHERE group_id = ?"
+        params = (group_id,)
+        if cursor is not None:
+            query += " AND user_id < ?" if backward else " AND user_id > ?"
+            params = (group_id, cursor)
+        query += " ORDER BY user_id DESC LIMIT ?" if backward else " ORDER BY user_id LIMIT ?"
+        async with self.db.execute(query, (*params, limit)) as rows_cursor:
+            rows = await rows_cursor.fetchall()
+        if backward:
+            rows.reverse()
+        return [(row[0], self._row_to_data(row[1:])) for row in rows]
+
+    async def iter_users(self, group_id: int, filters: dict = None, batch_size: int = 1000):
+        query = "SELECT user_id, name, city, car_type, year, purpose FROM users"
+        conditions = ["group_id = ?"]
+        params = [group_id]
+        for field, value in (filters or {}).items():
+            if field not in USER_FIELDS:
+                raise ValueError(f"Неизвестное поле фильтра: {field}")
+            conditions.append(f"{field} = ?")
+            params.append(value)
+        query += " WHERE " + " AND ".join(conditions) + " ORDER BY user_id"
+        async with self.db.execute(query, params) as rows_cursor:
+            while True:
+                rows = await rows_cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row[0], self._row_to_data(row[1:])
+
+    async def get_meta(self, key: str, default=None):
+        async with self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)) as cursor:
+            row = await cursor.fetchone()
+        return row[0] if row else default
+
+    async def set_meta(self, key: str, value):
+        if value is None:
+            await self.db.execute("DELETE FROM meta WHERE key = ?", (key,))
+        else:
+            await self.db.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value))
+            )
+        await self.db.commit()
+
+    async def migrate_from_json(self, json_path: str, group_id: int = None) -> int:
+        """
+        Однократно переносит анкеты из старого JSON-файла в базу (в группу group_id).
+        Без group_id непустой файл не переносится и миграция откладывается.
+        Повторный запуск ничего не делает: факт миграции отмечается в таблице meta.
+        """
+        async with self.db.execute(
+            "SELECT value FROM meta WHERE key = 'json_migrated'"
+        ) as cursor:
+            if await cursor.fetchone():
+                return 0
+
+        migrated = 0
+        if os.path.exists(json_path):
+            try:
+                with open(json_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (json.JSONDecodeError, OSError) as e:
+                logger.error(f"Ошибка чтения {json_path} при миграции: {e}. Миграция отложена.")
+                return 0
+            if data and group_id is None:
+                logger.error(
+                    f"Миграция из {json_path} отложена: не задан GROUP_ID группы, к которой относятся анкеты. "
+                    f"Файл сохранён, миграция выполнится при следующем запуске с GROUP_ID."
+                )
+                return 0
+
+            now = time.time()
+            rows = [
+                (group_id, int(uid), *(user.get(field) for field in USER_FIELDS), now)
+                for uid, user in data.items()
+            ]
+            await self.db.executemany(
+                """
+                INSERT OR IGNORE INTO users (group_id, user_id, name, city, car_type, year, purpose, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                rows
+            )
+            migrated = len(rows)
+
+        await self.db.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', ?)",
+            (str(time.time()),)
+        )
+        await self.db.commit()
+        logger.info(f"Миграция из {json_path} завершена: перенесено {migrated} пользователей.")
+        return migrated
@@ -0,0 +1,69 @@
+import asyncio
+import logging
+import random
+
+from telegram.error import BadRequest, NetworkError, TimedOut
+
+logger = logging.getLogger(__name__)
+
+# Повторы временно неудачных запросов: число попыток и начальная задержка (в секундах)
+RETRY_ATTEMPTS = 4
+RETRY_BASE_DELAY = 0.5
+# Временные ошибки, после которых запрос имеет смысл повторить (RetryAfter обрабатывает PriorityRateLimiter)
+RETRYABLE_ERRORS = (NetworkError, TimedOut)
+
+
+# Пул фоновых задач с ограничением одновременного выполнения
+class BoundedTaskPool:
+    """
+    Запускает корутины в фоне, но не более limit одновременно.
+    Обработчик, отправивший задачу, не ждёт её завершения.
+    """
+
+    def __init__(self, limit: int, name: str = 'pool'):
+        self.name = name
+        self._semaphore = asyncio.Semaphore(limit)
+        self._tasks = set()
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def submit(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(self._run(coro))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _run(self, coro):
+        async with self._semaphore:
+            try:
+                return await coro
+            except Exception as e:
+                logger.error(f"Ошибка фоновой задачи ({self.name}): {e}")
+
+    async def join(self):
+        """Дожидается завершения всех запущенных задач."""
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+
+# Функция для выполнения запроса с повторами и экспоненциальной задержкой
+async def retry_with_backoff(factory, description: str, attempts: int = RETRY_ATTEMPTS,
+                             base_delay: float = RETRY_BASE_DELAY):
+    """
+    Только для идемпотентных запросов (restrict_chat_member, ban_chat_member и т. п.):
+    после TimedOut запрос мог быть выполнен, и повтор send_message продублирует сообщение.
+    factory — функция без аргументов, возвращающая новую корутину для каждой попытки.
+    Повторяются только временные сетевые ошибки; BadRequest, Forbidden и прочие
+    постоянные ошибки пробрасываются сразу. После последней попытки ошибка пробрасывается.
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            return await factory()
+        except RETRYABLE_ERRORS as e:
+            # В PTB BadRequest наследуется от NetworkError, но это постоянная ошибка
+            if isinstance(e, BadRequest) or attempt == attempts:
+                raise
+            delay = base_delay * 2 ** (attempt - 1) * (1 + random.random() / 2)
+            logger.warning(f"{description}: попытка {attempt} не удалась ({e}), повтор через {delay:.2f} с.")
+            await asyncio.sleep(delay)
@@ -0,0 +1,20 @@
+import asyncio
+
+from storage import SqliteUserStore
+
+
+# Функция для запуска корутины в отдельном цикле событий (без pytest-asyncio)
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+# Функция для выполнения сценария с открытым хранилищем: scenario(store) -> корутина
+def with_store(path, scenario):
+    async def main():
+        store = SqliteUserStore(path)
+        await store.open()
+        try:
+            return await scenario(store)
+        finally:
+            await store.close()
+    return run(main())
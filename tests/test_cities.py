@@ -0,0 +1,43 @@
+import pytest
+
+from cities import build_city_index, load_city_index, levenshtein, BLOCKED, ALLOWED
+
+
+@pytest.fixture(scope='module')
+def city_index():
+    return build_city_index()
+
+
+@pytest.mark.parametrize('text', ['Москва', 'москва', 'Moskva', 'Moscow', 'г. Москва', 'Мск', 'Масква'])
+def test_blocked_spellings(city_index, text):
+    assert city_index.is_blocked(text)
+    assert city_index.lookup(text) == ('Москва', BLOCKED)
+
+
+@pytest.mark.parametrize('text', ['Киев', 'Kyiv', 'Харьков', 'Kharkiv', 'Одесса'])
+def test_allowed_cities_are_not_blocked(city_index, text):
+    assert not city_index.is_blocked(text)
+    assert city_index.lookup(text)[1] == ALLOWED
+
+
+def test_blocked_city_inside_phrase(city_index):
+    assert city_index.is_blocked("живу в Питере")
+    assert city_index.is_blocked("Москва, Россия")
+
+
+def test_unknown_text(city_index):
+    assert city_index.lookup("Атлантида") is None
+    assert city_index.lookup("...") is None
+
+
+def test_levenshtein_respects_limit():
+    assert levenshtein('moskva', 'maskva', 2) == 1
+    assert levenshtein('moskva', 'kiev', 1) > 1
+
+
+def test_snapshot_round_trip(tmp_path):
+    snapshot_path = str(tmp_path / 'cities.idx')
+    built = load_city_index(snapshot_path=snapshot_path)
+    loaded = load_city_index(snapshot_path=snapshot_path)
+    assert len(loaded) == len(built)
+    assert loaded.is_blocked('Moskva')
@@ -0,0 +1,72 @@
+from deadlines import DeadlineManager
+
+from tests.helpers import run
+
+
+def test_schedule_cancel_and_reschedule():
+    manager = DeadlineManager()
+    manager.schedule(-1, 10, 100.0)
+    assert manager.deadline_of(-1, 10) == 100.0
+    manager.schedule(-1, 10, 200.0)
+    assert manager.deadline_of(-1, 10) == 200.0
+    assert len(manager) == 1
+
+    assert manager.cancel(-1, 10)
+    assert not manager.cancel(-1, 10)
+    assert manager.deadline_of(-1, 10) is None
+    assert manager.pop_expired(now=1000.0) == []
+
+
+def test_same_user_in_different_groups_is_independent():
+    manager = DeadlineManager()
+    manager.schedule(-1, 10, 100.0)
+    manager.schedule(-2, 10, 100.0)
+    manager.cancel(-1, 10)
+    assert manager.pop_expired(now=100.0) == [(-2, 10)]
+
+
+def test_pop_expired_interleaves_groups_in_deadline_order():
+    manager = DeadlineManager()
+    for user_id in range(3):
+        manager.schedule(-1, user_id, 10.0 + user_id)
+    manager.schedule(-2, 100, 50.0)
+    manager.schedule(-2, 101, 500.0)
+
+    expired = manager.pop_expired(now=60.0)
+    assert expired == [(-1, 0), (-2, 100), (-1, 1), (-1, 2)]
+    assert (-2, 101) in manager
+    assert len(manager) == 1
+
+
+def test_lag_observer_gets_delay():
+    lags = []
+    manager = DeadlineManager(lag_observer=lags.append)
+    manager.schedule(-1, 1, 10.0)
+    manager.pop_expired(now=12.5)
+    assert lags == [2.5]
+
+
+def test_sweep_calls_handler_and_survives_errors():
+    manager = DeadlineManager(max_concurrency=2)
+    for user_id in range(5):
+        manager.schedule(-1, user_id, 1.0)
+    handled = []
+
+    async def handler(group_id, user_id):
+        handled.append((group_id, user_id))
+        if user_id == 2:
+            raise RuntimeError("ошибка бана")
+
+    assert run(manager.sweep(handler, now=2.0)) == 5
+    assert sorted(handled) == [(-1, user_id) for user_id in range(5)]
+    assert len(manager) == 0
+
+
+def test_heap_is_compacted_after_many_cancellations():
+    manager = DeadlineManager()
+    for user_id in range(200):
+        manager.schedule(-1, user_id, 1000.0 + user_id)
+    for user_id in range(190):
+        manager.cancel(-1, user_id)
+    manager.pop_expired(now=0.0)
+    assert len(manager._heap) == 10
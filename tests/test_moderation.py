@@ -0,0 +1,63 @@
+import pytest
+
+from moderation import ModerationEngine, ModerationRule, ACTION_WARN, ACTION_RESTRICT
+
+
+def make_engine():
+    return ModerationEngine([
+        ModerationRule('scam', action=ACTION_WARN, keywords=['скам', 'Ёлка']),
+        ModerationRule('buy', action=ACTION_RESTRICT, restrict_seconds=600, regexes=[r'buy now']),
+        ModerationRule('cheap', regexes=[r'now cheap']),
+        ModerationRule('repeat', regexes=[r'(\w)\1\1']),
+        ModerationRule('links', domains=['bit.ly']),
+    ])
+
+
+def test_keywords_match_whole_words_only():
+    engine = make_engine()
+    assert engine.match("это СКАМ!") == {'scam'}
+    assert engine.match("скамейка во дворе") == set()
+    assert engine.match("ёлка") == {'scam'}
+
+
+def test_overlapping_rules_all_match():
+    assert make_engine().match("buy now cheap") == {'buy', 'cheap'}
+
+
+def test_backreferences_keep_their_numbers():
+    engine = make_engine()
+    assert engine.match("ааа") == {'repeat'}
+    assert engine.match("aba") == set()
+
+
+def test_domains_match_subdomains_but_not_lookalikes():
+    engine = make_engine()
+    assert engine.match("смотри go.bit.ly/abc") == {'links'}
+    assert engine.match("notbit.ly") == set()
+
+
+def test_verdict_uses_strictest_action_and_counts_hits():
+    engine = make_engine()
+    verdict = engine.check("скам, buy now")
+    assert verdict.action == ACTION_RESTRICT
+    assert verdict.restrict_seconds == 600
+    assert sorted(verdict.rule_ids) == ['buy', 'scam']
+    assert engine.check("обычное сообщение") is None
+    assert engine.stats() == {
+        'checked': 2, 'hits': {'scam': 1, 'buy': 1, 'cheap': 0, 'repeat': 0, 'links': 0},
+    }
+
+
+def test_adopt_stats_keeps_hits_of_remaining_rules():
+    old = make_engine()
+    old.check("скам")
+    new = ModerationEngine([ModerationRule('scam', keywords=['скам']), ModerationRule('new', keywords=['x'])])
+    new.adopt_stats(old)
+    assert new.stats() == {'checked': 1, 'hits': {'scam': 1, 'new': 0}}
+
+
+def test_invalid_rules_are_rejected():
+    with pytest.raises(ValueError):
+        ModerationRule('bad', action='explode')
+    with pytest.raises(Exception):
+        ModerationEngine([ModerationRule('bad', regexes=['(unclosed'])])
@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+from telegram.error import RetryAfter
+
+from ratelimit import (
+    PriorityRateLimiter, TokenBucket,
+    PRIORITY_MODERATION, PRIORITY_MESSAGE, PRIORITY_CLEANUP,
+)
+
+from tests.helpers import run
+
+
+def test_token_bucket_refills_at_rate():
+    bucket = TokenBucket(rate=2, capacity=1)
+    now = bucket.updated
+    assert bucket.wait_time(now) == 0
+    bucket.consume()
+    assert bucket.wait_time(now) == pytest.approx(0.5)
+    assert bucket.wait_time(now + 0.5) == 0
+
+
+def test_requests_are_served_by_priority():
+    order = []
+
+    async def scenario():
+        limiter = PriorityRateLimiter(global_rate=50, global_burst=1)
+        await limiter.initialize()
+        try:
+            async def request(name, endpoint, rate_limit_args=None):
+                async def callback():
+                    order.append(name)
+                return await limiter.process_request(callback, (), {}, endpoint, {}, rate_limit_args)
+
+            await asyncio.gather(
+                request('cleanup', 'deleteMessage'),
+                request('message', 'getChat'),
+                request('moderation', 'banChatMember'),
+                request('explicit_cleanup', 'getChatMember', {'priority': PRIORITY_CLEANUP}),
+            )
+            return limiter.stats()
+        finally:
+            await limiter.shutdown()
+
+    stats = run(scenario())
+    assert order == ['moderation', 'message', 'cleanup', 'explicit_cleanup']
+    assert stats['sent'] == 4
+    assert stats['queued'] == 0
+    assert stats['queued_by_priority'] == {PRIORITY_MODERATION: 0, PRIORITY_MESSAGE: 0, PRIORITY_CLEANUP: 0}
+
+
+def test_retry_after_is_retried_and_observed():
+    observed = []
+    attempts = []
+
+    async def scenario():
+        limiter = PriorityRateLimiter(observer=lambda endpoint, duration, error: observed.append((endpoint, error)))
+        await limiter.initialize()
+        try:
+            async def callback():
+                attempts.append(1)
+                if len(attempts) == 1:
+                    raise RetryAfter(0.01)
+                return 'ok'
+
+            result = await limiter.process_request(callback, (), {}, 'sendMessage', {'chat_id': 5}, None)
+            return result, limiter.retries
+        finally:
+            await limiter.shutdown()
+
+    assert run(scenario()) == ('ok', 1)
+    assert len(attempts) == 2
+    assert isinstance(observed[0][1], RetryAfter)
+    assert observed[1] == ('sendMessage', None)
+
+
+def test_retry_after_gives_up_after_max_retries():
+    async def scenario():
+        limiter = PriorityRateLimiter(max_retries=1)
+        await limiter.initialize()
+        try:
+            async def callback():
+                raise RetryAfter(0.01)
+
+            await limiter.process_request(callback, (), {}, 'sendMessage', {'chat_id': 5}, None)
+        finally:
+            await limiter.shutdown()
+
+    with pytest.raises(RetryAfter):
+        run(scenario())
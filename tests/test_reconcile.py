@@ -0,0 +1,100 @@
+from types import SimpleNamespace
+
+from telegram.constants import ChatMemberStatus
+from telegram.error import BadRequest, NetworkError
+
+from groups import GroupRegistry
+from reconcile import MembershipReconciler, RECONCILE_CURSOR_KEY
+from records import UserRecord
+
+from tests.helpers import run, with_store
+
+
+# Бот-заглушка: statuses — {user_id: статус или исключение}, остальные — участники группы
+class FakeBot:
+    def __init__(self, statuses=None, on_call=None):
+        self.statuses = statuses or {}
+        self.on_call = on_call
+        self.calls = []
+
+    async def get_chat_member(self, chat_id, user_id, rate_limit_args=None):
+        self.calls.append((chat_id, user_id, rate_limit_args))
+        if self.on_call is not None:
+            await self.on_call(user_id)
+        status = self.statuses.get(user_id, ChatMemberStatus.MEMBER)
+        if isinstance(status, Exception):
+            raise status
+        return SimpleNamespace(status=status)
+
+
+async def fill(store, group_id, user_ids):
+    for user_id in user_ids:
+        await store.upsert(group_id, user_id, {'name': str(user_id)})
+
+
+def test_run_deletes_departed_and_walks_with_cursor(store_path):
+    bot = FakeBot({
+        2: ChatMemberStatus.LEFT,
+        3: BadRequest("User not found"),
+        5: ChatMemberStatus.BANNED,
+        6: NetworkError("timeout"),
+    })
+    reconciler = MembershipReconciler(None, chunk_size=2, chunks_per_run=2, concurrency=2)
+
+    async def scenario(store):
+        reconciler.store = store
+        await fill(store, -1, range(1, 8))
+        await fill(store, -2, [2])
+        first = await reconciler.run(bot, -1)
+        cursor = await store.get_meta(f"{RECONCILE_CURSOR_KEY}:-1")
+        second = await reconciler.run(bot, -1)
+        return first, cursor, second, await store.get_meta(f"{RECONCILE_CURSOR_KEY}:-1"), await store.count(-2)
+
+    first, cursor, second, final_cursor, other_group = with_store(store_path, scenario)
+    assert [user_id for user_id, _ in first] == [2, 3]
+    assert cursor == '4'
+    assert [user_id for user_id, _ in second] == [5]
+    assert final_cursor is None  # дошли до конца — следующий обход начнётся сначала
+    assert other_group == 1
+    assert reconciler.stats() == {'checked': 7, 'pruned': 3, 'errors': 1}
+    assert all(args == {'priority': 2} for _, _, args in bot.calls)
+
+
+def test_run_keeps_profile_saved_during_check(store_path):
+    reconciler = MembershipReconciler(None, chunk_size=10)
+
+    async def scenario(store):
+        reconciler.store = store
+
+        async def re_register(user_id):
+            # Пользователь заново заполнил анкету, пока шла проверка
+            await store.upsert(-1, user_id, {'name': 'снова'})
+
+        await fill(store, -1, [1])
+        bot = FakeBot({1: ChatMemberStatus.LEFT}, on_call=re_register)
+        return await reconciler.run(bot, -1), await store.get(-1, 1)
+
+    departed, record = with_store(store_path, scenario)
+    assert departed == []
+    assert record['name'] == 'снова'
+
+
+def test_registry_keeps_profile_registered_after_check_started():
+    registry = GroupRegistry()
+    registry.register(-1, 1, UserRecord(name='до проверки'))
+    started_at = registry.get(-1).registered_at[1] + 1
+    registry.register(-1, 2, UserRecord(name='после проверки'))
+    registry.get(-1).registered_at[2] = started_at + 1
+
+    assert registry.unregister_if_older(-1, 1, started_at) is not None
+    assert registry.unregister_if_older(-1, 2, started_at) is None
+    assert registry.registered_count == 1
+
+
+def test_check_pending_is_limited_per_run():
+    reconciler = MembershipReconciler(None, chunk_size=2, chunks_per_run=2)
+    bot = FakeBot({1: ChatMemberStatus.LEFT, 9: ChatMemberStatus.LEFT})
+
+    departed = run(reconciler.check_pending(bot, -1, range(1, 10)))
+    assert departed == [1]
+    assert len(bot.calls) == 4
@@ -0,0 +1,98 @@
+import json
+import time
+
+import storage
+
+from tests.helpers import with_store
+
+
+def test_upsert_get_and_delete(store_path):
+    async def scenario(store):
+        await store.upsert(-1, 10, {'name': 'Иван', 'city': 'Київ'})
+        await store.upsert(-2, 10, {'name': 'Иван', 'city': 'Львів'})
+        await store.upsert(-1, 10, {'name': 'Иван', 'city': 'Одеса'})
+        first = await store.get(-1, 10)
+        await store.delete(-1, 10)
+        return first, await store.get(-1, 10), await store.get(-2, 10), await store.count()
+
+    first, deleted, other_group, count = with_store(store_path, scenario)
+    assert first['city'] == 'Одеса'
+    assert deleted is None
+    assert other_group['city'] == 'Львів'
+    assert count == 1
+
+
+def test_delete_many_batches_and_returns_deleted_ids(store_path, monkeypatch):
+    monkeypatch.setattr(storage, 'DELETE_BATCH_SIZE', 3)
+
+    async def scenario(store):
+        for user_id in range(10):
+            await store.upsert(-1, user_id, {'name': str(user_id)})
+        await store.upsert(-2, 1, {'name': 'другая группа'})
+        deleted = await store.delete_many(-1, [1, 2, 3, 4, 5, 6, 7, 100])
+        return deleted, await store.count(-1), await store.count(-2)
+
+    deleted, remaining, other_group = with_store(store_path, scenario)
+    assert sorted(deleted) == [1, 2, 3, 4, 5, 6, 7]
+    assert remaining == 3
+    assert other_group == 1
+
+
+def test_delete_many_keeps_rows_updated_after_cutoff(store_path):
+    async def scenario(store):
+        await store.upsert(-1, 1, {'name': 'старая'})
+        cutoff = time.time() + 0.001
+        time.sleep(0.01)
+        await store.upsert(-1, 2, {'name': 'новая'})
+        return await store.delete_many(-1, [1, 2], older_than=cutoff), await store.get(-1, 2)
+
+    deleted, kept = with_store(store_path, scenario)
+    assert deleted == [1]
+    assert kept['name'] == 'новая'
+
+
+def test_page_walks_forward_and_backward(store_path):
+    async def scenario(store):
+        for user_id in (5, 1, 3, 4, 2):
+            await store.upsert(-1, user_id, {'name': str(user_id)})
+        first = await store.page(-1, limit=2)
+        second = await store.page(-1, cursor=first[-1][0], limit=2)
+        back = await store.page(-1, cursor=second[0][0], limit=2, backward=True)
+        return [ids for ids, _ in first], [ids for ids, _ in second], [ids for ids, _ in back]
+
+    assert with_store(store_path, scenario) == ([1, 2], [3, 4], [1, 2])
+
+
+def test_iter_users_filters(store_path):
+    async def scenario(store):
+        await store.upsert(-1, 1, {'city': 'Київ', 'year': '2010'})
+        await store.upsert(-1, 2, {'city': 'Львів', 'year': '2010'})
+        await store.upsert(-2, 3, {'city': 'Київ', 'year': '2010'})
+        return [user_id async for user_id, _ in store.iter_users(-1, {'city': 'Київ'}, batch_size=1)]
+
+    assert with_store(store_path, scenario) == [1]
+
+
+def test_meta_round_trip(store_path):
+    async def scenario(store):
+        await store.set_meta('cursor', 42)
+        value = await store.get_meta('cursor')
+        await store.set_meta('cursor', None)
+        return value, await store.get_meta('cursor', 'нет')
+
+    assert with_store(store_path, scenario) == ('42', 'нет')
+
+
+def test_json_migration_needs_group_and_runs_once(store_path, tmp_path):
+    json_path = tmp_path / 'registered_users.json'
+    json_path.write_text(json.dumps({'7': {'name': 'Олег', 'city': 'Київ'}}), encoding='utf-8')
+
+    async def scenario(store):
+        without_group = await store.migrate_from_json(str(json_path))
+        migrated = await store.migrate_from_json(str(json_path), -1)
+        repeated = await store.migrate_from_json(str(json_path), -1)
+        return without_group, migrated, repeated, await store.get(-1, 7)
+
+    without_group, migrated, repeated, record = with_store(store_path, scenario)
+    assert (without_group, migrated, repeated) == (0, 1, 0)
+    assert record['name'] == 'Олег'
@@ -0,0 +1,128 @@
+import asyncio
+import hmac
+import logging
+import secrets
+import signal
+
+from aiohttp import web
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+# Встроенный HTTP-сервер для приёма обновлений через вебхук
+class WebhookServer:
+    """
+    aiohttp-сервер: принимает обновления от Telegram, проверяет секретный токен
+    и сразу кладёт обновление в application.update_queue, не дожидаясь обработки.
+    Без заданного secret_token генерируется случайный: сервер никогда не принимает
+    обновления без токена. Одновременно обрабатывается не больше max_connections
+    запросов (то же значение передаётся Telegram в set_webhook), остальные ждут.
+    GET /health отвечает состоянием бота и глубиной очереди обновлений.
+    """
+
+    def __init__(self, application, listen: str, port: int, path: str,
+                 secret_token: str = None, max_connections: int = 40):
+        self.application = application
+        self.listen = listen
+        self.port = port
+        self.path = path if path.startswith('/') else f'/{path}'
+        if not secret_token:
+            secret_token = secrets.token_urlsafe(32)
+            logger.warning("WEBHOOK_SECRET не задан: для вебхука сгенерирован случайный секретный токен.")
+        self.secret_token = secret_token
+        self.max_connections = max_connections
+        self._semaphore = asyncio.Semaphore(max_connections)
+        self.received = 0
+        self.rejected = 0
+        self._runner = None
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get('/health', self.handle_health)
+        return app
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        received_token = request.headers.get(SECRET_HEADER, '')
+        if not hmac.compare_digest(received_token.encode(), self.secret_token.encode()):
+            self.rejected += 1
+            logger.warning(f"Отклонён запрос вебхука с неверным секретным токеном от {request.remote}.")
+            return web.Response(status=403)
+        async with self._semaphore:
+            return await self._accept_update(request)
+
+    async def _accept_update(self, request: web.Request) -> web.Response:
+        try:
+            data = await request.json()
+        except ValueError:
+            self.rejected += 1
+            return web.Response(status=400)
+
+        update = Update.de_json(data, self.application.bot)
+        if update is None:
+            return web.Response(status=400)
+        self.received += 1
+        self.application.update_queue.put_nowait(update)
+        return web.Response()
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            'status': 'ok' if self.application.running else 'stopped',
+            'update_queue': self.application.update_queue.qsize(),
+            'received': self.received,
+            'rejected': self.rejected,
+        })
+
+    async def start(self):
+        self._runner = web.AppRunner(self.build_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.listen, self.port)
+        await site.start()
+        logger.info(f"Вебхук-сервер слушает {self.listen}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+# Функция для запуска бота в режиме вебхука (аналог application.run_polling)
+def run_webhook(application, server: WebhookServer, webhook_url: str, drop_pending_updates: bool = False):
+    async def _run():
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except NotImplementedError:
+                pass
+
+        await application.initialize()
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        await server.start()
+        try:
+            await application.bot.set_webhook(
+                url=webhook_url,
+                secret_token=server.secret_token,
+                max_connections=server.max_connections,
+                allowed_updates=Update.ALL_TYPES,
+                drop_pending_updates=drop_pending_updates
+            )
+            logger.info(f"Вебхук установлен: {webhook_url}")
+            await stop_event.wait()
+        finally:
+            logger.info("Остановка вебхук-сервера...")
+            await server.stop()
+            if application.running:
+                await application.stop()
+            # Порядок как в Application.run_polling: сначала shutdown, затем post_shutdown
+            await application.shutdown()
+            if application.post_shutdown:
+                await application.post_shutdown(application)
+
+    asyncio.run(_run())